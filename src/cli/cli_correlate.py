@@ -0,0 +1,138 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import argparse
+import logging
+
+from cli.cliexec_correlate import CliExecCorrelate
+
+LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOGGING_LEVEL = logging.INFO
+logging.basicConfig(format=LOGGING_FORMAT, level=LOGGING_LEVEL)
+logger = logging.getLogger(__name__)
+
+
+def correlate_datasets(parser: argparse.ArgumentParser):
+    args = parser.parse_args()
+
+    cliexec = CliExecCorrelate()
+
+    cliexec.correlate_datasets(
+        args.database_dir,
+        args.datasets,
+        args.resolution,
+        args.output_file,
+        args.value_columns,
+        args.how,
+        args.year,
+        args.month,
+        args.day
+    )
+
+
+def add_correlate_datasets_parser(
+        subparsers
+):
+    correlate_parser = subparsers.add_parser(
+        "correlate-datasets",
+        help="Join datasets cell by cell into a parquet file")
+    correlate_parser.add_argument(
+        "--database-dir", required=True,
+        type=str,
+        help="The directory in which databases are stored"
+    )
+    correlate_parser.add_argument(
+        "--datasets", required=True,
+        nargs="+",
+        type=str,
+        help="The names of the datasets to join. "
+             "must be datasets registered in the metadata"
+    )
+    correlate_parser.add_argument(
+        "--resolution", required=True,
+        type=int,
+        help="The h3 resolution of the cells to join on. Datasets stored "
+             "at other resolutions are rolled up or down to it"
+    )
+    correlate_parser.add_argument(
+        "--output-file", required=True,
+        type=str,
+        help="The parquet file where the joined data will be stored"
+    )
+    correlate_parser.add_argument(
+        "--value-columns", required=False,
+        nargs="+",
+        type=str,
+        help="The value columns to include, as <dataset>.<column>. "
+             "Every numeric value column is included for datasets "
+             "with no columns listed"
+    )
+    correlate_parser.add_argument(
+        "--how", required=False,
+        type=str,
+        default="inner",
+        help="How to join datasets. acceptable values: [inner, left, full]"
+    )
+    correlate_parser.add_argument(
+        "--year", required=False,
+        type=int,
+        help="The year to join data for"
+    )
+    correlate_parser.add_argument(
+        "--month", required=False,
+        type=int,
+        help="The month to join data for"
+    )
+    correlate_parser.add_argument(
+        "--day", required=False,
+        type=int,
+        help="The day to join data for"
+    )
+
+
+def execute():
+    """
+    Main function that sets up the argparse CLI interface.
+    """
+
+    # Initialize argparse and set general CLI description
+    parser = argparse.ArgumentParser(
+        description="Data Mesh Agent Command Line Interface (CLI)")
+
+    # Parser for top-level commands
+    parser.add_argument('--verbose', action='store_true',
+                        help='Enable verbose output')
+
+    # Create subparsers to handle multiple commands
+    subparsers = parser.add_subparsers(dest="command",
+                                       help="Available commands")
+
+    add_correlate_datasets_parser(subparsers)
+
+    args = parser.parse_args()
+    logger.info(args)
+
+    # Set up logging
+    logging_format = "%(asctime)s - %(levelname)s - %(message)s"
+    logging.basicConfig(format=logging_format,
+                        level=logging.INFO if args.verbose else logging.WARNING)
+
+    # Execute corresponding function based on provided command
+    if args.command == "correlate-datasets":
+        correlate_datasets(parser)
+    else:
+        usage(parser, "Command missing - please provide command")
+
+
+def usage(parser: any, msg: str):
+    print(f"Error: {msg}\n")
+    parser.print_help()
+
+
+if __name__ == "__main__":
+    # Execute mainline
+    execute()
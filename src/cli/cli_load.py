@@ -70,6 +70,14 @@ def load_pipeline(parser: argparse.ArgumentParser):
     return cliexec.load_pipeline(args.config_path)
 
 
+def recluster(parser: argparse.ArgumentParser):
+    args = parser.parse_args()
+
+    cliexec = CliExecLoad()
+
+    return cliexec.recluster(args.database_dir, args.dataset_name)
+
+
 def usage(parser:any, msg: str):
     print(f"Error: {msg}\n")
     parser.print_help()
@@ -118,6 +126,25 @@ def add_load_pipeline_parser(
         required=True
     )
 
+def add_recluster_parser(
+        subparsers
+):
+    recluster = subparsers.add_parser(
+        "recluster",
+        help="rewrite a stored dataset with rows ordered by time and"
+             " location, so queries can skip unrelated data"
+    )
+    recluster.add_argument(
+        "--database_dir",
+        help="the directory containing the dataset's database",
+        required=True
+    )
+    recluster.add_argument(
+        "--dataset_name",
+        help="the name of the dataset to recluster",
+        required=True
+    )
+
 def execute():
     """
     Main function that sets up the argparse CLI interface.
@@ -135,6 +162,7 @@ def execute():
     add_load_parser(subparsers)
     add_initialize_parser(subparsers)
     add_load_pipeline_parser(subparsers)
+    add_recluster_parser(subparsers)
 
     args = parser.parse_args()
     logger.info(args)
@@ -151,6 +179,8 @@ def execute():
         load(parser)
     elif args.command == "load-pipeline":
         load_pipeline(parser)
+    elif args.command == "recluster":
+        recluster(parser)
     else:
         usage(parser, "Command missing - please provide command")
 
@@ -30,7 +30,8 @@ def visualize_dataset(parser: argparse.ArgumentParser):
         args.month,
         args.day,
         args.ds_type,
-        args.visualizer_type
+        args.visualizer_type,
+        args.scale_to_dataset
     )
 
 
@@ -124,6 +125,13 @@ def add_viualize_dataset_parser(
         help="the type of ds to process. acceptable values: ["
              "HexGridVisualizer, PointLocationVisualizer]"
     )
+    visualize_parser.add_argument(
+        "--scale-to-dataset", required=False,
+        action="store_true",
+        help="Scale colours to the value statistics stored for the whole"
+             " dataset, rather than to the values displayed. Requires the"
+             " dataset to have been loaded with collect_statistics enabled"
+    )
 
 
 def execute():
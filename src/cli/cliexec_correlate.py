@@ -0,0 +1,67 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import logging
+from typing import Dict, List, Optional
+
+from geoserver.correlation import DatasetCorrelator
+
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+
+class CliExecCorrelate:
+
+    def __init__(self):
+        pass
+
+    def correlate_datasets(
+            self,
+            database_dir: str,
+            datasets: List[str],
+            resolution: int,
+            output_file: str,
+            value_columns: Optional[List[str]],
+            how: str,
+            year: Optional[int],
+            month: Optional[int],
+            day: Optional[int]
+    ) -> int:
+        correlator = DatasetCorrelator(database_dir)
+        rows = correlator.correlate_to_parquet(
+            datasets,
+            resolution,
+            output_file,
+            self._parse_value_columns(value_columns),
+            how,
+            year,
+            month,
+            day
+        )
+        logger.info(f"wrote {rows} rows to {output_file}")
+        return rows
+
+    @staticmethod
+    def _parse_value_columns(
+            value_columns: Optional[List[str]]
+    ) -> Optional[Dict[str, List[str]]]:
+        """
+        Parse value columns given as <dataset>.<column> into the columns
+        to include for each dataset.
+        """
+        if value_columns is None:
+            return None
+        parsed: Dict[str, List[str]] = {}
+        for v in value_columns:
+            if "." not in v:
+                raise ValueError(
+                    f"value column {v} must be given as <dataset>.<column>")
+            dataset, column = v.split(".", 1)
+            parsed.setdefault(dataset, []).append(column)
+        return parsed
@@ -8,6 +8,7 @@
 import logging
 import os.path
 
+from loader import clustering
 from loader.load_pipeline import LoadingPipelineFactory
 from loader.loader_factory import LoaderFactory
 
@@ -43,3 +44,11 @@ class CliExecLoad:
     ):
         load_p = LoadingPipelineFactory.create_from_conf_file(config_path)
         load_p.run()
+
+    def recluster(
+            self,
+            database_dir: str,
+            dataset_name: str
+    ):
+        tables = clustering.recluster_dataset(database_dir, dataset_name)
+        logger.info(f"reclustered tables {tables} of dataset {dataset_name}")
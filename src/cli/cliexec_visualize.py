@@ -10,9 +10,8 @@ import logging
 import os.path
 from typing import List, Optional, Dict, Any, Tuple
 
-import pandas
-
 from geoserver.geomesh import Geomesh
+from geoserver.metadata import MetadataDB
 import visualizer
 
 
@@ -45,10 +44,11 @@ class CliExecVisualize:
             month: Optional[int],
             day: Optional[int],
             ds_type: str,
-            visualizer_type: str = "HexGridVisualizer"
+            visualizer_type: str = "HexGridVisualizer",
+            scale_to_dataset: bool = False
     ):
         geo = Geomesh(database_dir)
-        ds = geo.bounding_box_get(
+        ds_pandas = geo.bounding_box_get_df(
             dataset,
             resolution,
             min_lat,
@@ -59,9 +59,20 @@ class CliExecVisualize:
             month,
             day
         )
-        ds_pandas = pandas.json_normalize(ds)
 
         if visualizer_type == "HexGridVisualizer":
+            # colours are scaled to the values queried, unless asked to
+            #  scale them to the whole dataset's stored statistics
+            value_stats = None
+            if scale_to_dataset:
+                stats = MetadataDB(database_dir).get_dataset_statistics(
+                    dataset)
+                if stats is None:
+                    raise ValueError(
+                        f"no statistics are stored for dataset {dataset}."
+                        f" load it with collect_statistics enabled to"
+                        f" scale colours to the whole dataset")
+                value_stats = stats["columns"].get(value_column)
             vis = visualizer.HexGridVisualizer(
                 ds_pandas,
                 value_column,
@@ -69,7 +80,8 @@ class CliExecVisualize:
                 min_lat,
                 max_lat,
                 min_long,
-                max_long
+                max_long,
+                value_stats
             )
             vis.visualize_dataset(resolution, output_file, threshold, ds_type)
 
@@ -8,7 +8,7 @@
 import logging
 import math
 import os.path
-from typing import List, Set, Tuple, Optional
+from typing import Any, Dict, List, Set, Tuple, Optional
 
 import h3
 from pandas import DataFrame
@@ -151,9 +151,18 @@ class HexGridVisualizer(AbstractVisualizer):
             min_lat: Optional[float],
             max_lat: Optional[float],
             min_long: Optional[float],
-            max_long: Optional[float]
+            max_long: Optional[float],
+            value_stats: Optional[Dict[str, Any]] = None
     ):
+        """
+        :param value_stats:
+            statistics of the value column stored when the dataset was
+            loaded, with min, max, mean and std keys. If set, colours are
+            scaled from these instead of computing them from the dataset.
+        :type value_stats: Optional[Dict[str, Any]]
+        """
         self.dataset = dataset
+        self.value_stats = value_stats
         if min_lat is None:
             self.min_lat = dataset['latitude'].min()
         else:
@@ -262,14 +271,7 @@ class HexGridVisualizer(AbstractVisualizer):
         else:
             geo_map = in_map
 
-        max_val = self.dataset[self.value_col].max()
-        min_value = self.dataset[self.value_col].min()
-        std_dev = self.dataset[self.value_col].std()
-        avg = self.dataset[self.value_col].mean()
-        max_colour_value = avg + 2 * std_dev
-        if max_colour_value > max_val:
-            max_colour_value = max_val
-
+        min_value, max_colour_value = self._get_colour_scale()
         scale_width = max_colour_value - min_value
 
         for index, cell in enumerate(h3_cells):
@@ -326,14 +328,7 @@ class HexGridVisualizer(AbstractVisualizer):
         else:
             geo_map = in_map
 
-        max_val = self.dataset[self.value_col].max()
-        min_value = self.dataset[self.value_col].min()
-        std_dev = self.dataset[self.value_col].std()
-        avg = self.dataset[self.value_col].mean()
-        max_colour_value = avg + 2 * std_dev
-        if max_colour_value > max_val:
-            max_colour_value = max_val
-
+        min_value, max_colour_value = self._get_colour_scale()
         scale_width = max_colour_value - min_value
 
         # This relies on the assumption that the dataset is pre-filtered
@@ -358,6 +353,23 @@ class HexGridVisualizer(AbstractVisualizer):
 
         return geo_map
 
+    def _get_colour_scale(self) -> Tuple[float, float]:
+        if self.value_stats is not None and \
+                self.value_stats.get("std") is not None:
+            max_val = self.value_stats["max"]
+            min_value = self.value_stats["min"]
+            std_dev = self.value_stats["std"]
+            avg = self.value_stats["mean"]
+        else:
+            max_val = self.dataset[self.value_col].max()
+            min_value = self.dataset[self.value_col].min()
+            std_dev = self.dataset[self.value_col].std()
+            avg = self.dataset[self.value_col].mean()
+        max_colour_value = avg + 2 * std_dev
+        if max_colour_value > max_val:
+            max_colour_value = max_val
+        return min_value, max_colour_value
+
     def _add_cell_to_map(
             self,
             cell: str,
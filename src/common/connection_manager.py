@@ -0,0 +1,250 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import atexit
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, Optional
+
+import duckdb
+
+from common.const import LOGGING_FORMAT
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Process wide cache of duckdb connections, one per database file.
+#
+# duckdb allows a database file to be opened either read-write by a single
+#  process, or read-only by any number of processes. Within a process, all
+#  connections to a file must also use the same mode. So each file gets a
+#  single cached connection: read-only while the process only reads it,
+#  and read-write once anything in the process writes to it. Callers are
+#  given cursors of the cached connection, which share its database
+#  instance but have their own transaction state, so threads can read
+#  and write concurrently.
+#
+# Callers should close the cursors they are given, ideally through the
+#  reading/writing context managers. A read-only connection is closed as
+#  soon as the last cursor reading through it is closed, so that a long
+#  running process that only reads, such as a query server, does not keep
+#  files it has read locked against loaders in other processes. Read-write
+#  connections stay open until close or close_all.
+
+
+@dataclass
+class _CachedConnection:
+    connection: duckdb.DuckDBPyConnection
+    read_only: bool
+    # identifies the file the connection was opened on, so that a file
+    #  deleted and recreated at the same path is not read through a stale
+    #  connection
+    inode: Optional[int]
+    # number of cursors returned by get_reader that are still open
+    readers: int = 0
+
+
+class _ReaderCursor:
+    """
+    Cursor returned by get_reader. Behaves as the duckdb cursor it wraps,
+    and releases its hold on the cached connection when closed, or when
+    garbage collected if never closed.
+    """
+
+    def __init__(self, key: str, cached: _CachedConnection):
+        self._key = key
+        self._cached = cached
+        self._cursor = cached.connection.cursor()
+        self._released = False
+        cached.readers += 1
+
+    def close(self) -> None:
+        with _lock:
+            if self._released:
+                return
+            self._released = True
+            self._cursor.close()
+            _release(self._key, self._cached)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __enter__(self) -> "_ReaderCursor":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def __del__(self) -> None:
+        if not getattr(self, "_released", True):
+            self.close()
+
+
+_lock = threading.RLock()
+_connections: Dict[str, _CachedConnection] = {}
+
+
+def get_reader(db_path: str) -> duckdb.DuckDBPyConnection:
+    """
+    Get a cursor for reading the database at db_path. Uses the process's
+    connection to the file if one is open, or opens the file read-only.
+
+    :raises ValueError: if the database file does not exist
+    """
+    key = _get_key(db_path)
+    with _lock:
+        cached = _get_valid(key)
+        if cached is None:
+            if not os.path.exists(key):
+                raise ValueError(f"database {db_path} does not exist")
+            cached = _open(key, db_path, read_only=True)
+        return _ReaderCursor(key, cached)
+
+
+def get_writer(db_path: str) -> duckdb.DuckDBPyConnection:
+    """
+    Get a cursor for writing to the database at db_path, creating the
+    file if it does not exist. If the file is open read-only in this
+    process, it is reopened read-write, which requires that all cursors
+    returned by get_reader for the file have been closed.
+
+    :raises ValueError:
+        if the file is still in use by read-only cursors of this process,
+        or is open read-only by another process
+    """
+    key = _get_key(db_path)
+    with _lock:
+        cached = _get_valid(key)
+        if cached is not None and cached.read_only:
+            if cached.readers > 0:
+                raise ValueError(
+                    f"cannot open database {db_path} for writing while"
+                    f" {cached.readers} read-only cursors of it are open."
+                    f" close them first.")
+            _close(key)
+            cached = None
+        if cached is None:
+            try:
+                cached = _open(key, db_path, read_only=False)
+            except duckdb.ConnectionException as e:
+                raise ValueError(
+                    f"cannot open database {db_path} for writing while it"
+                    f" is open read-only. close all readers of the database"
+                    f" first.") from e
+        return cached.connection.cursor()
+
+
+@contextmanager
+def reading(db_path: str) -> Iterator[duckdb.DuckDBPyConnection]:
+    cursor = get_reader(db_path)
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+@contextmanager
+def writing(db_path: str) -> Iterator[duckdb.DuckDBPyConnection]:
+    cursor = get_writer(db_path)
+    try:
+        yield cursor
+    finally:
+        cursor.close()
+
+
+def checkpoint(db_path: str) -> None:
+    """
+    Write changes held by this process's read-write connection to a
+    database file into the file itself, so they can be read by other
+    database instances, such as one the file is attached to. Only a
+    cursor of the connection is used and closed, so the connection stays
+    usable by others. Does nothing if the file is not open read-write.
+    """
+    key = _get_key(db_path)
+    with _lock:
+        cached = _get_valid(key)
+        if cached is None or cached.read_only:
+            return
+        cursor = cached.connection.cursor()
+    try:
+        cursor.execute("CHECKPOINT")
+    finally:
+        cursor.close()
+
+
+def close(db_path: str) -> None:
+    """
+    Close the cached connection to a database file, if any.
+    """
+    with _lock:
+        _close(_get_key(db_path))
+
+
+def close_all() -> None:
+    """
+    Close every cached connection. Called automatically on exit.
+    """
+    with _lock:
+        for key in list(_connections.keys()):
+            _close(key)
+
+
+def _get_key(db_path: str) -> str:
+    return os.path.abspath(db_path)
+
+
+def _get_inode(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_ino
+    except FileNotFoundError:
+        return None
+
+
+def _get_valid(key: str) -> Optional[_CachedConnection]:
+    cached = _connections.get(key)
+    if cached is None:
+        return None
+    if _get_inode(key) != cached.inode:
+        logger.info(f"database file {key} was replaced or deleted."
+                    f" reopening connection")
+        _close(key)
+        return None
+    return cached
+
+
+def _open(key: str, db_path: str, read_only: bool) -> _CachedConnection:
+    # duckdb shares a database instance between connections opened with
+    #  the same path string, so the path is passed on as given rather than
+    #  normalized, letting other connections in the process made with the
+    #  same path share the instance
+    connection = duckdb.connect(database=db_path, read_only=read_only)
+    cached = _CachedConnection(connection, read_only, _get_inode(key))
+    _connections[key] = cached
+    return cached
+
+
+def _release(key: str, cached: _CachedConnection) -> None:
+    cached.readers -= 1
+    # the connection may have been closed, or replaced after its file was,
+    #  since the cursor was opened
+    if cached.readers <= 0 and cached.read_only and \
+            _connections.get(key) is cached:
+        _close(key)
+
+
+def _close(key: str) -> None:
+    cached = _connections.pop(key, None)
+    if cached is not None:
+        cached.connection.close()
+
+
+atexit.register(close_all)
@@ -10,6 +10,9 @@ LATITUDE_COL = "latitude"
 LONGITUDE_COL = "longitude"
 CELL_COL = "h3_cell"
 
+# coarse h3 parent cell that partitioned parquet datasets are split by
+PARTITION_COL = "h3_partition"
+
 YEAR_COL = "year"
 MONTH_COL = "month"
 DAY_COL = "day"
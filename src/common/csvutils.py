@@ -0,0 +1,171 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import math
+from typing import Dict, Iterator, Optional
+
+import duckdb
+from pandas import DataFrame
+
+SUPPORTED_DATA_TYPES = [
+    "float",
+    "str",
+    "int"
+]
+
+# mapping of supported csv column type -> duckdb type used when parsing
+CSV_TO_DUCKDB_TYPES = {
+    "float": "DOUBLE",
+    "str": "VARCHAR",
+    "int": "BIGINT"
+}
+
+# duckdb produces results in vectors of this many rows
+DUCKDB_VECTOR_SIZE = 2048
+
+
+def read_typed_csv(
+        file_path: str,
+        columns: Dict[str, str],
+        has_header_row: bool,
+        threads: Optional[int] = None
+) -> DataFrame:
+    """
+    Read an entire csv file into a DataFrame, with each column parsed
+    into the type specified for it.
+
+    :param file_path: the csv file to read
+    :type file_path: str
+    :param columns:
+        the names of the columns in the file, in order, mapped to their
+        type. Supported types are those in SUPPORTED_DATA_TYPES.
+    :type columns: Dict[str, str]
+    :param has_header_row:
+        whether the first row of the file is a header row that should be
+        skipped. Column names always come from the columns parameter.
+    :type has_header_row: bool
+    :param threads:
+        maximum number of threads used to parse the file. Uses the duckdb
+        default if not set.
+    :type threads: Optional[int]
+    :return: the parsed file
+    :rtype: DataFrame
+
+    :raises ValueError:
+        if any row does not have exactly the configured number of columns,
+        or a value cannot be converted to its column type. Empty values
+        are read as empty strings in str columns, and cannot be converted
+        to int or float.
+    """
+    connection = _get_connection(threads)
+    try:
+        return connection.execute(
+            _read_csv_sql(file_path, columns, has_header_row)
+        ).df()
+    except duckdb.Error as e:
+        raise ValueError(
+            f"could not read csv file {file_path}: {e}") from e
+    finally:
+        connection.close()
+
+
+def read_typed_csv_chunks(
+        file_path: str,
+        columns: Dict[str, str],
+        has_header_row: bool,
+        chunk_size: int,
+        threads: Optional[int] = None
+) -> Iterator[DataFrame]:
+    """
+    Read a csv file as a stream of DataFrames, so that memory use depends
+    on the chunk size rather than the size of the file. Parameters and
+    errors are the same as read_typed_csv.
+
+    :param chunk_size:
+        the approximate number of rows in each chunk. Rounded up to a
+        multiple of the duckdb vector size (2048 rows).
+    :type chunk_size: int
+    """
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size must be at least 1, was {chunk_size}")
+    vectors_per_chunk = math.ceil(chunk_size / DUCKDB_VECTOR_SIZE)
+
+    connection = _get_connection(threads)
+    try:
+        result = connection.execute(
+            _read_csv_sql(file_path, columns, has_header_row))
+        while True:
+            chunk = result.fetch_df_chunk(vectors_per_chunk)
+            if len(chunk) == 0:
+                break
+            yield chunk
+    except duckdb.Error as e:
+        raise ValueError(
+            f"could not read csv file {file_path}: {e}") from e
+    finally:
+        connection.close()
+
+
+def validate_column_types(columns: Dict[str, str]) -> None:
+    for name, col_type in columns.items():
+        if col_type not in SUPPORTED_DATA_TYPES:
+            raise ValueError(
+                f"column type {col_type} for column {name}"
+                f" is not a supported type. supported types are"
+                f" {SUPPORTED_DATA_TYPES}"
+            )
+
+
+def _get_connection(threads: Optional[int]) -> duckdb.DuckDBPyConnection:
+    connection = duckdb.connect()
+    if threads is not None:
+        connection.execute(f"SET threads = {int(threads)}")
+    return connection
+
+
+def _read_csv_sql(
+        file_path: str,
+        columns: Dict[str, str],
+        has_header_row: bool
+) -> str:
+    validate_column_types(columns)
+    # every column is read as text and converted afterwards, as read_csv
+    #  reads empty fields as NULL. Empty fields are kept as empty strings
+    #  in str columns, and are an error in numeric columns, as they were
+    #  when files were parsed with the csv module
+    col_spec = ", ".join(
+        f"'{_escape(name)}': 'VARCHAR'" for name in columns.keys()
+    )
+    select = ", ".join(
+        _convert_sql(name, col_type) for name, col_type in columns.items()
+    )
+    header = "true" if has_header_row else "false"
+    return f"""
+        SELECT {select} FROM read_csv(
+            '{_escape(file_path)}',
+            columns={{{col_spec}}},
+            header={header},
+            auto_detect=false,
+            delim=',',
+            quote='"'
+        )
+    """
+
+
+def _convert_sql(name: str, col_type: str) -> str:
+    col = '"' + name.replace('"', '""') + '"'
+    if col_type == "str":
+        return f"coalesce({col}, '') AS {col}"
+    message = _escape(f"empty value in {col_type} column {name}")
+    return f"""
+        CASE WHEN {col} IS NULL THEN error('{message}')
+        ELSE CAST({col} AS {CSV_TO_DUCKDB_TYPES[col_type]}) END AS {col}
+    """
+
+
+def _escape(s: str) -> str:
+    return s.replace("'", "''")
@@ -0,0 +1,263 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import datetime
+import decimal
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+import duckdb
+import h3
+
+from common import duckdbutils
+from common.const import CELL_COL, LATITUDE_COL, LONGITUDE_COL, \
+    PARTITION_COL
+
+# Statistics describing a dataset, computed when it is written and stored
+#  in the metadata database, so that its extent and value distribution
+#  are known without scanning it. Statistics are a JSON compatible dict:
+#
+# {
+#     "row_count": rows in the dataset's base table,
+#     "resolutions": {resolution: row count}, for each resolution stored,
+#     "extent": {"min_lat", "max_lat", "min_long", "max_long"},
+#     "key_ranges": {key column: {"min", "max"}},
+#     "centroids": whether every row's latitude and longitude are its
+#         cell's center, or None if the dataset has no cell column,
+#     "columns": {
+#         numeric value column: {
+#             "count", "min", "max", "mean", "std",
+#             "histogram": {"edges": [bins + 1 values], "counts": [bins]}
+#         }
+#     }
+# }
+
+DEFAULT_HISTOGRAM_BINS = 20
+
+# latitude/longitude within this many degrees of a cell's center are taken
+#  to be the center, as locations may be stored with single precision
+CENTROID_TOLERANCE = 1e-4
+# rows checked at a time for being located at their cell's center
+_CENTROID_FETCH_ROWS = 100000
+
+# columns describing location rather than data
+_POINT_RES_COL_PATTERN = re.compile("res[0-9]+")
+_LOCATION_COLS = [CELL_COL, LATITUDE_COL, LONGITUDE_COL, PARTITION_COL,
+                  "geometry"]
+
+
+def compute_statistics(
+        connection: duckdb.DuckDBPyConnection,
+        source: str,
+        key_cols: List[str],
+        resolution_counts: Optional[Dict[int, int]] = None,
+        num_bins: int = DEFAULT_HISTOGRAM_BINS
+) -> Dict[str, Any]:
+    """
+    Compute the statistics of a dataset, using aggregate queries over the
+    stored data.
+
+    :param connection: connection able to read the source
+    :type connection: duckdb.DuckDBPyConnection
+    :param source: a table name, or table function such as read_parquet
+    :type source: str
+    :param key_cols: key columns other than location, such as time columns
+    :type key_cols: List[str]
+    :param resolution_counts:
+        number of rows stored at each resolution, for datasets stored at
+        several resolutions
+    :type resolution_counts: Optional[Dict[int, int]]
+    :param num_bins: number of equal width histogram bins per column
+    :type num_bins: int
+    :return: the statistics, in the format described above
+    :rtype: Dict[str, Any]
+    """
+    described = connection.execute(
+        f"DESCRIBE SELECT * FROM {source}").fetchall()
+    col_types = dict((r[0], r[1]) for r in described)
+    key_cols = [k for k in key_cols if k in col_types]
+    value_cols = [
+        c for c, t in col_types.items()
+        if c not in key_cols and c not in _LOCATION_COLS
+        and not _POINT_RES_COL_PATTERN.fullmatch(c)
+        and duckdbutils.is_numeric_type(t)
+    ]
+    has_location = LATITUDE_COL in col_types and LONGITUDE_COL in col_types
+
+    aggs = ["count(*)"]
+    if has_location:
+        aggs.extend([
+            f"min({LATITUDE_COL})", f"max({LATITUDE_COL})",
+            f"min({LONGITUDE_COL})", f"max({LONGITUDE_COL})"
+        ])
+    for k in key_cols:
+        aggs.extend([f'min("{k}")', f'max("{k}")'])
+    for v in value_cols:
+        aggs.extend([
+            f'count("{v}")', f'min("{v}")', f'max("{v}")',
+            f'avg("{v}")', f'stddev_samp("{v}")'
+        ])
+    row = list(connection.execute(
+        f"SELECT {', '.join(aggs)} FROM {source}").fetchone())
+
+    stats = {
+        "row_count": row.pop(0),
+        "resolutions": dict(
+            (str(r), c) for r, c in (resolution_counts or {}).items()),
+        "extent": None,
+        "key_ranges": {},
+        "centroids": None,
+        "columns": {}
+    }
+    if has_location:
+        min_lat, max_lat, min_long, max_long = row[:4]
+        row = row[4:]
+        if min_lat is not None:
+            stats["extent"] = {
+                "min_lat": float(min_lat),
+                "max_lat": float(max_lat),
+                "min_long": float(min_long),
+                "max_long": float(max_long)
+            }
+    if CELL_COL in col_types:
+        stats["centroids"] = has_location and \
+            _located_at_centroids(connection, source)
+    for k in key_cols:
+        stats["key_ranges"][k] = {
+            "min": _to_json_value(row.pop(0)),
+            "max": _to_json_value(row.pop(0))
+        }
+    for v in value_cols:
+        count, v_min, v_max, mean, std = row[:5]
+        row = row[5:]
+        col_stats = {
+            "count": count,
+            "min": _to_json_value(v_min),
+            "max": _to_json_value(v_max),
+            "mean": _to_json_value(mean),
+            "std": _to_json_value(std),
+            "histogram": None
+        }
+        if count > 0:
+            col_stats["histogram"] = _histogram(
+                connection, source, v, float(v_min), float(v_max), num_bins)
+        stats["columns"][v] = col_stats
+    return stats
+
+
+def get_cell_resolution(
+        connection: duckdb.DuckDBPyConnection,
+        source: str
+) -> Optional[int]:
+    """
+    Get the h3 resolution of the cells in a source's cell column, or None
+    if it has no valid cells.
+    """
+    columns = [
+        r[0] for r in
+        connection.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()
+    ]
+    if CELL_COL not in columns:
+        return None
+    first_cell = connection.execute(
+        f"SELECT {CELL_COL} FROM {source} LIMIT 1").fetchone()
+    if first_cell is None or not h3.h3_is_valid(first_cell[0]):
+        return None
+    return h3.h3_get_resolution(first_cell[0])
+
+
+def count_rows(connection: duckdb.DuckDBPyConnection, source: str) -> int:
+    return connection.execute(f"SELECT count(*) FROM {source}").fetchone()[0]
+
+
+def extent_intersects(
+        stats: Optional[Dict[str, Any]],
+        min_lat: float,
+        max_lat: float,
+        min_long: float,
+        max_long: float,
+        margin: float = 0.0
+) -> bool:
+    """
+    Whether a bounding box, widened by margin degrees, can contain any of
+    a dataset's rows. True if the dataset's extent is unknown.
+    """
+    if stats is None or stats.get("extent") is None:
+        return True
+    extent = stats["extent"]
+    return min_lat - margin <= extent["max_lat"] and \
+        max_lat + margin >= extent["min_lat"] and \
+        min_long - margin <= extent["max_long"] and \
+        max_long + margin >= extent["min_long"]
+
+
+def _located_at_centroids(
+        connection: duckdb.DuckDBPyConnection,
+        source: str
+) -> bool:
+    """
+    Whether every row of a source is located at its cell's center.
+    """
+    result = connection.execute(f"""
+        SELECT DISTINCT {CELL_COL}, {LATITUDE_COL}, {LONGITUDE_COL}
+        FROM {source}
+    """)
+    while True:
+        rows = result.fetchmany(_CENTROID_FETCH_ROWS)
+        if len(rows) == 0:
+            return True
+        for cell, lat, long in rows:
+            if cell is None or lat is None or long is None or \
+                    not h3.h3_is_valid(cell):
+                return False
+            center_lat, center_long = h3.h3_to_geo(cell)
+            if abs(lat - center_lat) > CENTROID_TOLERANCE or \
+                    abs(long - center_long) > CENTROID_TOLERANCE:
+                return False
+
+
+def _histogram(
+        connection: duckdb.DuckDBPyConnection,
+        source: str,
+        column: str,
+        v_min: float,
+        v_max: float,
+        num_bins: int
+) -> Dict[str, List]:
+    if v_min == v_max:
+        count = connection.execute(
+            f'SELECT count("{column}") FROM {source}').fetchone()[0]
+        return {"edges": [v_min, v_max], "counts": [count]}
+
+    width = (v_max - v_min) / num_bins
+    rows = connection.execute(f"""
+        SELECT
+            least(
+                CAST(floor((CAST("{column}" AS DOUBLE) - ?) / ?) AS INTEGER),
+                ?
+            ) AS bin,
+            count(*)
+        FROM {source}
+        WHERE "{column}" IS NOT NULL
+        GROUP BY bin
+    """, [v_min, width, num_bins - 1]).fetchall()
+    counts = [0] * num_bins
+    for b, c in rows:
+        counts[b] = c
+    edges = [v_min + i * width for i in range(num_bins)] + [v_max]
+    return {"edges": edges, "counts": counts}
+
+
+def _to_json_value(v: Any) -> Any:
+    if isinstance(v, decimal.Decimal):
+        return float(v)
+    if isinstance(v, float) and math.isnan(v):
+        return None
+    if isinstance(v, (datetime.date, datetime.datetime, datetime.time)):
+        return v.isoformat()
+    return v
@@ -6,6 +6,19 @@
 #
 # Created: 2024-05-22 by davis.broda@brodagroupsoftware.com
 import re
+import warnings
+from typing import Iterable, List, Optional
+
+import h3
+import numpy
+
+with warnings.catch_warnings():
+    # the vectorized functions are only offered as unstable by h3 3.x
+    warnings.simplefilter("ignore")
+    from h3.unstable import vect
+
+from common.const import CELL_COL
+
 
 def get_point_res_col(resolution: int) -> str:
     if resolution > 15 or resolution < 0:
@@ -14,3 +27,131 @@ def get_point_res_col(resolution: int) -> str:
         )
 
     return f"res{resolution}"
+
+
+def get_table_name(
+        dataset_name: str,
+        ds_type: str,
+        resolution: Optional[int] = None
+) -> str:
+    """
+    Get the name of the table in a dataset's database that holds the data
+    for the given dataset type and resolution. h3 datasets hold one table
+    per resolution, while point and h3_index datasets hold a single table.
+    """
+    if ds_type == "h3":
+        if resolution is None:
+            raise ValueError(
+                "resolution parameter cannot be None for h3 dataset"
+            )
+        return dataset_name + f"_{resolution}"
+    elif ds_type == "point" or ds_type == "h3_index":
+        return dataset_name
+    else:
+        raise ValueError(
+            f"dataset type: {ds_type} not yet implemented"
+        )
+
+
+def get_pyramid_table_name(dataset_name: str, resolution: int) -> str:
+    """
+    Get the name of the table holding the rollup of an h3_index dataset
+    at a coarser resolution.
+    """
+    return dataset_name + f"_{resolution}"
+
+
+def is_cell_col(col_name: str) -> bool:
+    """
+    Whether a column holds h3 cell ids, either the cell column of an h3
+    dataset or one of the per-resolution columns of a point dataset.
+    """
+    return col_name == CELL_COL or \
+        re.fullmatch("res[0-9]+", col_name) is not None
+
+
+def get_cells(
+        latitudes: Iterable[float],
+        longitudes: Iterable[float],
+        resolution: int
+) -> List[str]:
+    """
+    Get the h3 cell containing each latitude/longitude pair.
+
+    Considerably faster than using DataFrame.apply row by row, as no
+    intermediate Series is created per row.
+    """
+    geo_to_h3 = h3.geo_to_h3
+    return [
+        geo_to_h3(lat, long, resolution)
+        for lat, long in zip(latitudes, longitudes)
+    ]
+
+
+def get_cell_ids(
+        latitudes: Iterable[float],
+        longitudes: Iterable[float],
+        resolution: int
+) -> numpy.ndarray:
+    """
+    Get the h3 cell containing each latitude/longitude pair, as integer
+    ids rather than strings. Computed in a single vectorized call, so is
+    much faster than get_cells for large inputs. ids can be converted to
+    the usual strings with h3.h3_to_string, or lower(hex(id)) in duckdb.
+    """
+    lat = numpy.ascontiguousarray(latitudes, dtype=numpy.float64)
+    long = numpy.ascontiguousarray(longitudes, dtype=numpy.float64)
+    return vect.geo_to_h3(lat, long, resolution)
+
+
+def get_parent_cell_ids(
+        cell_ids: numpy.ndarray,
+        resolution: int
+) -> numpy.ndarray:
+    """
+    Get the parent at a coarser resolution of each of an array of integer
+    cell ids.
+    """
+    return vect.h3_to_parent(
+        numpy.ascontiguousarray(cell_ids, dtype=numpy.uint64), resolution)
+
+
+def get_hilbert_keys(
+        latitudes: Iterable[float],
+        longitudes: Iterable[float],
+        order: int = 16
+) -> numpy.ndarray:
+    """
+    Get the position of each point along a Hilbert curve covering the
+    globe. Points that are close together generally have close keys, so
+    sorting by this key clusters nearby points together in storage.
+
+    :param order:
+        the curve covers a 2^order x 2^order grid of latitude/longitude
+        cells. Points in the same grid cell share a key.
+    :type order: int
+    :return: the key of each point, in the same order as the input
+    :rtype: numpy.ndarray
+    """
+    n = 1 << order
+    lat = numpy.asarray(latitudes, dtype=numpy.float64)
+    long = numpy.asarray(longitudes, dtype=numpy.float64)
+    x = numpy.clip(((long + 180.0) / 360.0 * n).astype(numpy.int64), 0, n - 1)
+    y = numpy.clip(((lat + 90.0) / 180.0 * n).astype(numpy.int64), 0, n - 1)
+
+    keys = numpy.zeros(len(x), dtype=numpy.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx.astype(numpy.int64)) ^ ry.astype(numpy.int64))
+
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry & rx
+        x = numpy.where(flip, n - 1 - x, x)
+        y = numpy.where(flip, n - 1 - y, y)
+        swap = ~ry
+        x, y = numpy.where(swap, y, x), numpy.where(swap, x, y)
+        s >>= 1
+    return keys
+
@@ -5,7 +5,7 @@
 # https://opensource.org/licenses/MIT.
 #
 # Created: 2024-03-08 by davis.broda@brodagroupsoftware.com
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, List
 
 import duckdb
 
@@ -35,6 +35,12 @@ GENERAL_PURPOSE_DATA_TYPES = [
     "VARCHAR"
 ]
 
+NUMERIC_TYPES = [
+    "TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT",
+    "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT",
+    "FLOAT", "REAL", "DOUBLE"
+]
+
 COMPOSITE_TYPES = [
     "ARRAY",
     "LIST",
@@ -101,6 +107,10 @@ def duckdb_check_table_exists(
         return False
 
 
+def is_numeric_type(col_type: str) -> bool:
+    return col_type in NUMERIC_TYPES or col_type.startswith("DECIMAL")
+
+
 def is_general_col_type(col_type:str) -> Tuple[bool, Optional[str]]:
     """
     Determines whether a given column type is a valid general purpose
@@ -147,3 +157,134 @@ def convert_to_cannonical_type(col_type: str) -> str:
             f"column type: {col_type} is not a known duckdb type")
 
     return out
+
+
+def merge_into_table(
+        connection: duckdb.DuckDBPyConnection,
+        target_table: str,
+        source_table: str,
+        key_cols: List[str],
+        delete_missing: bool = False,
+        delete_scope_cols: Optional[List[str]] = None
+) -> Dict[str, int]:
+    """
+    Merge the rows of a source table into a target table, matching rows
+    on the key columns. Rows with new keys are inserted, rows whose
+    values differ from the stored row are updated, and identical rows are
+    left untouched. Runs within a single transaction.
+
+    :param connection: connection to the database holding both tables
+    :type connection: duckdb.DuckDBPyConnection
+    :param target_table: the table to merge rows into
+    :type target_table: str
+    :param source_table:
+        the table holding the incoming rows. Every column must exist in
+        the target table.
+    :type source_table: str
+    :param key_cols:
+        the columns that uniquely identify a row in both tables
+    :type key_cols: List[str]
+    :param delete_missing:
+        whether to delete rows of the target table whose keys are not
+        present in the source table
+    :type delete_missing: bool
+    :param delete_scope_cols:
+        if set, only rows of the target table whose values for these
+        columns appear in the source table are considered for deletion.
+        Ex. passing time columns restricts deletion to the time periods
+        being reloaded.
+    :type delete_scope_cols: Optional[List[str]]
+    :return:
+        counts of the rows that were inserted, updated, deleted and
+        unchanged, under those keys
+    :rtype: Dict[str, int]
+    """
+    if len(key_cols) == 0:
+        raise ValueError("at least one key column is required to merge")
+
+    source_cols = [
+        r[0] for r in connection.execute(
+            f"DESCRIBE SELECT * FROM {source_table}").fetchall()
+    ]
+    for col in key_cols:
+        if col not in source_cols:
+            raise ValueError(
+                f"key column {col} is not present in table {source_table}")
+    value_cols = [c for c in source_cols if c not in key_cols]
+
+    # NULL keys match NULL keys, as a NULL key column identifies rows
+    #  just as other values do
+    join_cond = " AND ".join(
+        f't."{k}" IS NOT DISTINCT FROM s."{k}"' for k in key_cols)
+    changed_cond = " OR ".join(
+        f's."{c}" IS DISTINCT FROM t."{c}"' for c in value_cols)
+    if len(changed_cond) == 0:
+        changed_cond = "false"
+
+    counts = {"inserted": 0, "updated": 0, "deleted": 0, "unchanged": 0}
+
+    connection.begin()
+    try:
+        connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE merge_diff AS
+            SELECT
+                s.*,
+                t.merge_matched IS NULL AS is_new,
+                t.merge_matched IS NOT NULL AND ({changed_cond})
+                    AS is_changed
+            FROM {source_table} s
+            LEFT JOIN (
+                SELECT *, true AS merge_matched FROM {target_table}
+            ) t ON {join_cond}
+        """)
+        row = connection.execute("""
+            SELECT
+                count(*) FILTER (WHERE is_new),
+                count(*) FILTER (WHERE is_changed),
+                count(*) FILTER (WHERE NOT is_new AND NOT is_changed)
+            FROM merge_diff
+        """).fetchone()
+        counts["inserted"], counts["updated"], counts["unchanged"] = row
+
+        if counts["updated"] > 0 and len(value_cols) > 0:
+            set_str = ", ".join(f'"{c}" = s."{c}"' for c in value_cols)
+            connection.execute(f"""
+                UPDATE {target_table} AS t SET {set_str}
+                FROM (SELECT * FROM merge_diff WHERE is_changed) s
+                WHERE {join_cond}
+            """)
+
+        if counts["inserted"] > 0:
+            col_str = ", ".join(f'"{c}"' for c in source_cols)
+            connection.execute(f"""
+                INSERT INTO {target_table} ({col_str})
+                SELECT {col_str} FROM merge_diff WHERE is_new
+            """)
+
+        if delete_missing:
+            scope = ""
+            if delete_scope_cols is not None and len(delete_scope_cols) > 0:
+                scope_cond = " AND ".join(
+                    f't."{c}" IS NOT DISTINCT FROM s."{c}"'
+                    for c in delete_scope_cols)
+                scope = f"AND EXISTS (SELECT 1 FROM {source_table} s" \
+                        f" WHERE {scope_cond})"
+            missing_where = f"""
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM {source_table} s WHERE {join_cond}
+                ) {scope}
+            """
+            counts["deleted"] = connection.execute(
+                f"SELECT count(*) FROM {target_table} t {missing_where}"
+            ).fetchone()[0]
+            if counts["deleted"] > 0:
+                connection.execute(
+                    f"DELETE FROM {target_table} t {missing_where}")
+
+        connection.execute("DROP TABLE merge_diff")
+    except Exception:
+        connection.rollback()
+        raise
+    connection.commit()
+    return counts
+
@@ -0,0 +1,225 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterator, Optional, Tuple, Type, \
+    TypeVar
+
+from common.const import LOGGING_FORMAT
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+INITIAL_DELAY = 0.05
+MAX_DELAY = 2.0
+
+# lock files held by this process, with the thread holding each
+_held_lock = threading.Lock()
+_held: Dict[str, int] = {}
+
+
+def backoff_delays(
+        timeout: float,
+        initial_delay: float = INITIAL_DELAY,
+        max_delay: float = MAX_DELAY
+) -> Iterator[float]:
+    """
+    Delays to wait between attempts: doubling from initial_delay up to
+    max_delay, with jitter so that processes waiting on the same resource
+    do not retry in lockstep. Stops once timeout seconds have passed.
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        yield min(remaining, delay * random.uniform(0.5, 1.0))
+        delay = min(delay * 2, max_delay)
+
+
+def retry_with_backoff(
+        fn: Callable[[], T],
+        retry_on: Tuple[Type[Exception], ...],
+        timeout: float,
+        description: str
+) -> T:
+    """
+    Call fn until it succeeds, waiting between attempts on any of the
+    retry_on exceptions.
+
+    :raises ValueError: if fn still fails after timeout seconds
+    """
+    last_error = None
+    for delay in backoff_delays(timeout):
+        try:
+            return fn()
+        except retry_on as e:
+            last_error = e
+            logger.debug(f"{description} failed, retrying: {e}")
+        time.sleep(delay)
+    try:
+        return fn()
+    except retry_on as e:
+        last_error = e
+    raise ValueError(
+        f"{description} still failing after {timeout} seconds:"
+        f" {last_error}") from last_error
+
+
+class FileLock:
+    """
+    Lock shared by processes on one machine, held by creating a lock
+    file exclusively and released by deleting it. The lock file records
+    the holder's host and pid, so a lock left by a process on this host
+    that has died is detected and broken. Locks held longer than
+    stale_after seconds are also broken, which covers holders on other
+    hosts sharing the directory.
+
+    The lock is not reentrant. A thread trying to acquire a lock it
+    already holds, through any FileLock on the same path, gets an error
+    immediately rather than waiting out the timeout on itself.
+
+    Can be used as a context manager.
+    """
+
+    def __init__(
+            self,
+            lock_path: str,
+            timeout: float = 600,
+            stale_after: Optional[float] = None
+    ):
+        self.lock_path = lock_path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.held = False
+
+    def acquire(self) -> None:
+        """
+        :raises ValueError:
+            if the lock is not acquired within the timeout, or is already
+            held by the calling thread
+        """
+        key = os.path.abspath(self.lock_path)
+        with _held_lock:
+            if _held.get(key) == threading.get_ident():
+                raise ValueError(
+                    f"lock {self.lock_path} is already held by this thread,"
+                    f" and cannot be acquired again until released")
+        if self._try_acquire():
+            return
+        logger.info(f"waiting for lock {self.lock_path}")
+        for delay in backoff_delays(self.timeout):
+            time.sleep(delay)
+            if self._try_acquire():
+                return
+        raise ValueError(
+            f"could not acquire lock {self.lock_path} within"
+            f" {self.timeout} seconds. held by: {self._read_holder()}")
+
+    def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        with _held_lock:
+            _held.pop(os.path.abspath(self.lock_path), None)
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            logger.warning(f"lock file {self.lock_path} was removed while"
+                           f" the lock was held")
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.release()
+
+    def _try_acquire(self) -> bool:
+        try:
+            fd = os.open(
+                self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            holder = self._read_holder()
+            if self._is_stale(holder):
+                self._break(holder)
+                return self._try_acquire()
+            return False
+        with os.fdopen(fd, "w") as f:
+            json.dump({
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "time": time.time()
+            }, f)
+        self.held = True
+        with _held_lock:
+            _held[os.path.abspath(self.lock_path)] = threading.get_ident()
+        return True
+
+    def _read_holder(self) -> Optional[dict]:
+        try:
+            with open(self.lock_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            # either released, or the holder has not finished writing it
+            return None
+
+    def _is_stale(self, holder: Optional[dict]) -> bool:
+        if holder is None:
+            return False
+        if self.stale_after is not None and \
+                time.time() - holder["time"] > self.stale_after:
+            return True
+        if holder["host"] == socket.gethostname():
+            return not _pid_alive(holder["pid"])
+        return False
+
+    def _break(self, stale_holder: dict) -> None:
+        # the lock file is moved aside before being deleted, so that if
+        #  another process broke the same stale lock and acquired it in
+        #  the meantime, its lock can be put back rather than deleted
+        aside = f"{self.lock_path}.{os.getpid()}.stale"
+        try:
+            os.rename(self.lock_path, aside)
+        except FileNotFoundError:
+            return
+        try:
+            with open(aside) as f:
+                moved_holder = json.load(f)
+        except ValueError:
+            moved_holder = None
+        if moved_holder == stale_holder:
+            logger.warning(f"broke stale lock {self.lock_path},"
+                           f" held by {stale_holder}")
+        else:
+            try:
+                os.link(aside, self.lock_path)
+            except FileExistsError:
+                pass
+        os.remove(aside)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but owned by another user
+        return True
+    return True
@@ -0,0 +1,366 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+import h3
+import pyarrow
+
+from common import connection_manager, dataset_statistics, \
+    dataset_utilities, duckdbutils, const
+from common.const import LOGGING_FORMAT
+from geoserver import metadata
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+VALID_JOINS = {
+    "inner": "JOIN",
+    "left": "LEFT JOIN",
+    "full": "FULL OUTER JOIN",
+}
+
+_PYRAMID_TABLE_PATTERN = re.compile("(.*)_([0-9]+)")
+
+
+class DatasetCorrelator:
+    """
+    Joins several datasets cell by cell, entirely in duckdb.
+
+    The datasets' databases are attached to a single duckdb session, and
+    each dataset is aligned to a common resolution:
+     - point datasets by their res<n> cell columns
+     - h3 datasets by their per-resolution tables
+     - h3_index datasets by their base table or pyramid levels
+
+    If a dataset has no data at the common resolution, the nearest finer
+    resolution is rolled up to it, averaging values over each cell's
+    children, or failing that the nearest coarser resolution is rolled
+    down, giving each cell its parent's value. Values of a dataset are
+    averaged over the rows in each cell.
+
+    Rows are joined on the cell and on the key columns all datasets share,
+    such as year. Key columns that only some datasets have are averaged
+    over, unless fixed with the year, month and day filters.
+    """
+
+    def __init__(self, database_dir: str):
+        self.database_dir = database_dir
+        self.metadb = metadata.MetadataDB(database_dir)
+
+    def correlate_table(
+            self,
+            dataset_names: List[str],
+            resolution: int,
+            value_columns: Optional[Dict[str, List[str]]] = None,
+            how: str = "inner",
+            year: Optional[int] = None,
+            month: Optional[int] = None,
+            day: Optional[int] = None
+    ) -> pyarrow.Table:
+        """
+        Join datasets cell by cell, returning the result as an arrow table.
+
+        :param dataset_names: the datasets to join
+        :type dataset_names: List[str]
+        :param resolution: the resolution of the cells to join on
+        :type resolution: int
+        :param value_columns:
+            the value columns to include for each dataset. Every numeric
+            value column is included for datasets not listed.
+        :type value_columns: Optional[Dict[str, List[str]]]
+        :param how:
+            how to join. inner keeps cells in every dataset, left keeps
+            cells in the first dataset, full keeps cells in any dataset.
+            Options: [inner, left, full]
+        :type how: str
+        :return:
+            a table with columns h3_cell, the shared key columns, then
+            <dataset>_<value column> for each value column of each dataset
+        :rtype: pyarrow.Table
+        """
+        connection = duckdb.connect()
+        try:
+            sql = self._build_query(
+                connection, dataset_names, resolution, value_columns, how,
+                year, month, day)
+            return connection.execute(sql).fetch_arrow_table()
+        finally:
+            connection.close()
+
+    def correlate_to_parquet(
+            self,
+            dataset_names: List[str],
+            resolution: int,
+            output_file: str,
+            value_columns: Optional[Dict[str, List[str]]] = None,
+            how: str = "inner",
+            year: Optional[int] = None,
+            month: Optional[int] = None,
+            day: Optional[int] = None
+    ) -> int:
+        """
+        Same as correlate_table, but streams the result into a parquet
+        file, so it never has to fit in memory.
+
+        :return: the number of rows written
+        :rtype: int
+        """
+        if os.path.exists(output_file):
+            raise ValueError(f"output file {output_file} already exists")
+        connection = duckdb.connect()
+        try:
+            sql = self._build_query(
+                connection, dataset_names, resolution, value_columns, how,
+                year, month, day)
+            out_path = output_file.replace("'", "''")
+            return connection.execute(
+                f"COPY ({sql}) TO '{out_path}' (FORMAT PARQUET)"
+            ).fetchone()[0]
+        finally:
+            connection.close()
+
+    def _build_query(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            dataset_names: List[str],
+            resolution: int,
+            value_columns: Optional[Dict[str, List[str]]],
+            how: str,
+            year: Optional[int],
+            month: Optional[int],
+            day: Optional[int]
+    ) -> str:
+        if len(dataset_names) == 0:
+            raise ValueError("at least one dataset must be provided")
+        if len(set(dataset_names)) != len(dataset_names):
+            raise ValueError(
+                f"datasets may only be listed once: {dataset_names}")
+        if how not in VALID_JOINS:
+            raise ValueError(
+                f"unrecognized join {how}. valid joins are"
+                f" {list(VALID_JOINS.keys())}")
+        value_columns = value_columns or {}
+
+        metas = dict(
+            (name, self.metadb.get_ds_metadata(name))
+            for name in dataset_names)
+        shared_keys = [
+            k for k in metas[dataset_names[0]]["key_columns"]["key"]
+            if all(k in m["key_columns"]["key"] for m in metas.values())
+        ]
+        time_values = {"year": year, "month": month, "day": day}
+
+        ctes = []
+        select_values = []
+        for i, name in enumerate(dataset_names):
+            alias = f"ds{i}"
+            meta = metas[name]
+            source, cell_col, cell_expr, mapping = self._align(
+                connection, alias, name, meta, resolution)
+            cols = self._get_value_columns(meta, value_columns.get(name))
+
+            aggs = []
+            for c, t in cols:
+                out_col = f"{name}_{c}"
+                select_values.append(out_col)
+                if duckdbutils.is_numeric_type(t):
+                    aggs.append(f'avg(d."{c}") AS "{out_col}"')
+                else:
+                    aggs.append(f'first(d."{c}") AS "{out_col}"')
+
+            filters = [
+                f"d.{k} = {int(v)}" for k, v in time_values.items()
+                if v is not None and k in meta["key_columns"]["key"]
+            ]
+            where = "" if len(filters) == 0 \
+                else f"WHERE {' AND '.join(filters)}"
+            join = "" if mapping is None \
+                else f"JOIN {mapping} m ON d.{cell_col} = m.cell"
+            group_cols = [cell_expr] + [f'd."{k}"' for k in shared_keys]
+            ctes.append(f"""
+                {alias} AS (
+                    SELECT {cell_expr} AS cell,
+                        {"".join(f'd."{k}", ' for k in shared_keys)}
+                        {", ".join(aggs) if len(aggs) > 0 else "1 AS _one"}
+                    FROM {source} d
+                    {join}
+                    {where}
+                    GROUP BY {", ".join(group_cols)}
+                )
+            """)
+
+        join_cols = ", ".join(["cell"] + shared_keys)
+        from_clause = "ds0" + "".join(
+            f" {VALID_JOINS[how]} ds{i} USING ({join_cols})"
+            for i in range(1, len(dataset_names))
+        )
+        select_cols = [f"cell AS {const.CELL_COL}"] + \
+            [f'"{k}"' for k in shared_keys] + \
+            [f'"{v}"' for v in select_values]
+        return f"""
+            WITH {", ".join(ctes)}
+            SELECT {", ".join(select_cols)}
+            FROM {from_clause}
+        """
+
+    def _align(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            alias: str,
+            dataset_name: str,
+            meta: Dict,
+            resolution: int
+    ) -> Tuple[str, str, str, Optional[str]]:
+        """
+        Make a dataset readable in the session and work out how to get its
+        cells at the common resolution.
+
+        :return:
+            the table to read, its cell column, the sql expression giving
+            each row's cell at the common resolution, and the name of the
+            registered table mapping the dataset's cells to cells at the
+            common resolution, if one is needed
+        """
+        ds_type = meta["dataset_type"]
+        levels = self._get_levels(connection, alias, dataset_name, ds_type)
+        if len(levels) == 0:
+            raise ValueError(
+                f"dataset {dataset_name} has no cells to correlate on")
+
+        if resolution in levels:
+            level_res = resolution
+        elif any(r > resolution for r in levels):
+            level_res = min(r for r in levels if r > resolution)
+        else:
+            level_res = max(levels)
+        source, cell_col = levels[level_res]
+        if level_res == resolution:
+            return source, cell_col, f"d.{cell_col}", None
+
+        mapping = f"{alias}_cells"
+        if level_res > resolution:
+            logger.info(f"rolling {dataset_name} up from resolution"
+                        f" {level_res} to {resolution}")
+            cells = connection.execute(f"""
+                SELECT DISTINCT {cell_col} AS cell,
+                    ('0x' || {cell_col})::UBIGINT AS id
+                FROM {source}
+                WHERE {cell_col} IS NOT NULL
+            """).fetch_arrow_table()
+            parents = dataset_utilities.get_parent_cell_ids(
+                cells["id"].to_numpy(), resolution)
+            connection.register(mapping, pyarrow.table({
+                "cell": cells["cell"],
+                "target": pyarrow.array(parents)
+            }))
+            return source, cell_col, "lower(hex(m.target))", mapping
+
+        logger.info(f"rolling {dataset_name} down from resolution"
+                    f" {level_res} to {resolution}")
+        cells = [
+            r[0] for r in connection.execute(
+                f"SELECT DISTINCT {cell_col} FROM {source}"
+                f" WHERE {cell_col} IS NOT NULL").fetchall()
+        ]
+        pairs = [
+            (c, child) for c in cells
+            for child in h3.h3_to_children(c, resolution)
+        ]
+        connection.register(mapping, pyarrow.table({
+            "cell": pyarrow.array([p[0] for p in pairs], pyarrow.string()),
+            "target": pyarrow.array([p[1] for p in pairs], pyarrow.string())
+        }))
+        return source, cell_col, "m.target", mapping
+
+    def _get_levels(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            alias: str,
+            dataset_name: str,
+            ds_type: str
+    ) -> Dict[int, Tuple[str, str]]:
+        """
+        Get the resolutions a dataset has data for, mapped to the table
+        and cell column holding each.
+        """
+        storage = self.metadb.get_storage_info(dataset_name)
+        if storage["storage_type"] == "parquet":
+            options = storage["storage_options"]
+            glob = os.path.join(
+                self.database_dir, options["path"], "**", "*.parquet"
+            ).replace("'", "''")
+            tables = {
+                dataset_name:
+                    f"read_parquet('{glob}', hive_partitioning=1)"
+            }
+        else:
+            db_path = os.path.join(
+                self.database_dir, f"{dataset_name}.duckdb")
+            # written data may still be held by a connection of this
+            #  process, in its write-ahead log rather than the file
+            connection_manager.checkpoint(db_path)
+            connection.execute(
+                f"ATTACH '{db_path.replace(chr(39), chr(39) * 2)}'"
+                f" AS {alias} (READ_ONLY)")
+            tables = dict(
+                (r[0], f"{alias}.{r[0]}") for r in connection.execute(
+                    "SELECT table_name FROM duckdb_tables()"
+                    " WHERE database_name = ?", [alias]).fetchall()
+            )
+
+        levels = {}
+        if ds_type == "point":
+            source = tables[dataset_utilities.get_table_name(
+                dataset_name, ds_type)]
+            for row in connection.execute(
+                    f"DESCRIBE SELECT * FROM {source}").fetchall():
+                if re.fullmatch("res[0-9]+", row[0]):
+                    levels[int(row[0][3:])] = (source, row[0])
+            return levels
+
+        for table, source in tables.items():
+            match = _PYRAMID_TABLE_PATTERN.fullmatch(table)
+            if match is not None and match.group(1) == dataset_name:
+                # per-resolution tables of h3 datasets, or pyramid levels
+                #  of h3_index datasets
+                levels[int(match.group(2))] = (source, const.CELL_COL)
+        if dataset_name in tables:
+            # base table of h3_index datasets, or the single table of
+            #  datasets stored in parquet
+            source = tables[dataset_name]
+            base_res = dataset_statistics.get_cell_resolution(
+                connection, source)
+            if base_res is not None:
+                levels[base_res] = (source, const.CELL_COL)
+        return levels
+
+    def _get_value_columns(
+            self,
+            meta: Dict,
+            columns: Optional[List[str]]
+    ) -> List[Tuple[str, str]]:
+        types = dict(zip(meta["value_columns"]["key"],
+                         meta["value_columns"]["value"]))
+        if columns is None:
+            return [
+                (c, t) for c, t in types.items()
+                if duckdbutils.is_numeric_type(t)
+                and not dataset_utilities.is_cell_col(c)
+                and c not in [const.LATITUDE_COL, const.LONGITUDE_COL]
+            ]
+        for c in columns:
+            if c not in types:
+                raise ValueError(
+                    f"{c} is not a value column of {meta['dataset_name']}."
+                    f" value columns are {list(types.keys())}")
+        return [(c, types[c]) for c in columns]
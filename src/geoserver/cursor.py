@@ -0,0 +1,248 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import base64
+import binascii
+import bisect
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import duckdb
+import pyarrow
+import pyarrow.compute
+
+from common.const import CELL_COL, LOGGING_FORMAT
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# cells queried at a time by a cursor. Only the rows of these cells are
+#  sorted at once, so memory use depends on this rather than the size of
+#  the whole result
+DEFAULT_CELLS_PER_QUERY = 10000
+
+# runs the query for a chunk of cells, ordered by cell, skipping the first
+#  offset rows. Returns the connection it was run on and the pending result
+ChunkQuery = Callable[
+    [List[str], int],
+    Tuple[duckdb.DuckDBPyConnection, duckdb.DuckDBPyConnection]
+]
+
+
+class QueryCursor:
+    """
+    Streams the result of a query as arrow record batches, in order of
+    cell, and can be resumed from where it stopped with a continuation
+    token, including by another process.
+
+    The query's cells are sorted and queried a chunk at a time, so the
+    first rows are available once the first chunk is read, and memory
+    use stays flat however large the result is. The token records the
+    last cell returned and how many of its rows were returned. Tokens are
+    rejected if used with a different query, or once the dataset has
+    been rewritten, as the rows after the token may have changed.
+    """
+
+    def __init__(
+            self,
+            query: ChunkQuery,
+            cells: List[str],
+            query_id: str,
+            version: int,
+            batch_size: int,
+            cells_per_query: int = DEFAULT_CELLS_PER_QUERY,
+            token: Optional[str] = None
+    ):
+        """
+        :param query: runs the query for a chunk of cells
+        :type query: ChunkQuery
+        :param cells: every cell the query covers
+        :type cells: List[str]
+        :param query_id:
+            identifies the query and its parameters, so tokens from other
+            queries can be rejected
+        :type query_id: str
+        :param version: version of the dataset being queried
+        :type version: int
+        :param batch_size: maximum rows per record batch
+        :type batch_size: int
+        :param cells_per_query: cells to query at a time
+        :type cells_per_query: int
+        :param token: continuation token to resume from
+        :type token: Optional[str]
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch size must be positive, was {batch_size}")
+        if cells_per_query < 1:
+            raise ValueError(f"cells per query must be positive, was"
+                             f" {cells_per_query}")
+        self._query = query
+        self._query_id = query_id
+        self._version = version
+        self._batch_size = batch_size
+        self._cells_per_query = cells_per_query
+
+        self._cells = sorted(cells)
+        # the last cell returned, and the number of its rows returned
+        self._cell: Optional[str] = None
+        self._skip = 0
+        if token is not None:
+            self._cell, self._skip = self._decode(token)
+        self._next_cell = 0 if self._cell is None \
+            else bisect.bisect_left(self._cells, self._cell)
+        self._connection: Optional[duckdb.DuckDBPyConnection] = None
+        self._reader: Optional[pyarrow.RecordBatchReader] = None
+        self._pending: Optional[pyarrow.RecordBatch] = None
+        self._schema: Optional[pyarrow.Schema] = None
+        self._done = False
+        self._closed = False
+
+    @property
+    def token(self) -> Optional[str]:
+        """
+        Continuation token resuming after the rows returned so far, or None
+        once every row has been returned. Remains usable after the cursor
+        is closed.
+        """
+        if not self._closed and not self._fill_pending():
+            return None
+        if self._done:
+            return None
+        payload = {
+            "query": self._query_id,
+            "version": self._version,
+            "cell": self._cell,
+            "skip": self._skip
+        }
+        return base64.urlsafe_b64encode(
+            json.dumps(payload).encode("utf-8")).decode("ascii")
+
+    def __iter__(self) -> Iterator[pyarrow.RecordBatch]:
+        while True:
+            batch = self._next_batch(self._batch_size)
+            if batch is None:
+                return
+            yield batch
+
+    def read(self, max_rows: int) -> pyarrow.Table:
+        """
+        Read up to max_rows rows, as a page of the result. Fewer rows are
+        returned only at the end of the result.
+        """
+        batches = []
+        remaining = max_rows
+        while remaining > 0:
+            batch = self._next_batch(min(remaining, self._batch_size))
+            if batch is None:
+                break
+            batches.append(batch)
+            remaining -= batch.num_rows
+        if len(batches) == 0:
+            return self._empty_table()
+        return pyarrow.Table.from_batches(batches)
+
+    def close(self) -> None:
+        self._closed = True
+        self._close_connection()
+
+    def __enter__(self) -> "QueryCursor":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _next_batch(self, max_rows: int) -> Optional[pyarrow.RecordBatch]:
+        if not self._fill_pending():
+            return None
+        batch = self._pending.slice(0, max_rows)
+        self._pending = self._pending.slice(max_rows) \
+            if self._pending.num_rows > max_rows else None
+        self._advance(batch)
+        return batch
+
+    def _fill_pending(self) -> bool:
+        """
+        Read ahead to the next rows, if there are any left.
+        """
+        while self._pending is None or self._pending.num_rows == 0:
+            if self._done or self._closed:
+                return False
+            self._pending = self._read_reader()
+        return True
+
+    def _read_reader(self) -> Optional[pyarrow.RecordBatch]:
+        """
+        Read the next batch of the current chunk's result, starting the
+        next chunk if it is exhausted.
+        """
+        if self._reader is None:
+            # an empty query is still run once, for the result's schema
+            if self._next_cell >= len(self._cells) and \
+                    self._schema is not None:
+                self._done = True
+                return None
+            chunk = self._cells[
+                self._next_cell:self._next_cell + self._cells_per_query]
+            self._next_cell += len(chunk)
+            # rows of the last cell returned come first in the chunk, so
+            #  those already returned are skipped with an offset
+            offset = self._skip \
+                if len(chunk) > 0 and chunk[0] == self._cell else 0
+            self._connection, result = self._query(chunk, offset)
+            self._reader = result.fetch_record_batch(self._batch_size)
+            self._schema = self._reader.schema
+        try:
+            return self._reader.read_next_batch()
+        except StopIteration:
+            self._close_connection()
+            return None
+
+    def _close_connection(self) -> None:
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+            self._reader = None
+
+    def _advance(self, batch: pyarrow.RecordBatch) -> None:
+        cells = batch.column(CELL_COL)
+        last = cells[-1].as_py()
+        count = pyarrow.compute.sum(
+            pyarrow.compute.equal(cells, last)).as_py()
+        if last == self._cell and count == batch.num_rows:
+            self._skip += count
+        else:
+            self._cell, self._skip = last, count
+
+    def _empty_table(self) -> pyarrow.Table:
+        return self._schema.empty_table()
+
+    def _decode(self, token: str) -> Tuple[Optional[str], int]:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode(
+                "ascii")))
+            query_id, version = payload["query"], payload["version"]
+            cell, skip = payload["cell"], int(payload["skip"])
+        except (ValueError, KeyError, TypeError, binascii.Error):
+            raise ValueError("invalid continuation token")
+        if query_id != self._query_id:
+            raise ValueError(
+                "continuation token is for a different query")
+        if version != self._version:
+            raise ValueError(
+                "continuation token is no longer valid, as the dataset has"
+                " changed since it was issued")
+        return cell, skip
+
+
+def get_query_id(*params: Any) -> str:
+    """
+    Identify a query by its parameters, for continuation tokens.
+    """
+    return hashlib.sha256(repr(params).encode("utf-8")).hexdigest()[:16]
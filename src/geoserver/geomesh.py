@@ -6,17 +6,27 @@ import logging
 import math
 import os
 from math import sqrt
-from typing import Tuple, List, Any, Dict, Optional, Set
+from typing import Tuple, List, Any, Callable, Dict, Iterable, Iterator, \
+    Optional, Set, Union
 
 import duckdb
 import h3
+import numpy
+import pyarrow
+import pyarrow.compute
+import shapely
+from pandas import DataFrame
 from pydantic import BaseModel, Field
 from shapely.geometry import Polygon
+from shapely.geometry.base import BaseGeometry
 
 import re
 
-from geoserver import metadata
-from common import dataset_utilities, const
+from geoserver import cursor, metadata, query_planner, time_filter
+from geoserver.query_cache import QueryResultCache
+from geoserver.time_filter import TimeValue
+from common import connection_manager, dataset_statistics, \
+    dataset_utilities, duckdbutils, const
 from cli import visualizer
 from shape import shape
 
@@ -44,6 +54,36 @@ INT_TO_MONTH = {
 
 NUM_NEIGHBOURS = 3
 KM_PER_DEGREE = 110  # Each degree is about 110 KM
+# rows per record batch when streaming query results
+DEFAULT_BATCH_SIZE = 100000
+
+# aggregations available for zonal statistics, as the sql computing them
+#  from a value column
+ZONAL_AGGREGATIONS = {
+    "count": "count({c})",
+    "sum": "sum({c})",
+    "mean": "avg({c})",
+    "min": "min({c})",
+    "max": "max({c})",
+    "std": "stddev_samp({c})",
+    "median": "median({c})",
+}
+# aggregations that can be computed from the statistics stored in pyramid
+#  levels of h3_index datasets, as the sql computing them
+PYRAMID_ZONAL_AGGREGATIONS = {
+    "count": "CAST(sum({c}_count) AS BIGINT)",
+    "sum": "sum({c}_sum)",
+    "mean": "sum({c}_sum) / sum({c}_count)",
+    "min": "min({c}_min)",
+    "max": "max({c}_max)",
+}
+DEFAULT_ZONAL_AGGREGATIONS = ["count", "mean", "min", "max"]
+
+# key columns identifying the time slice a row belongs to, coarsest first
+TIME_COLUMNS = ["year", "month", "day"]
+# layouts time series can be returned in. long has a row per cell and time
+#  slice, wide has a row per cell and a column per value column and slice
+TIME_SERIES_LAYOUTS = ["long", "wide"]
 
 MIN_LAT, MAX_LAT = -60.0, 85.0  # Excluding Antarctica
 MIN_LONG, MAX_LONG = -180.0, 180.0  # Full range of longitudes
@@ -92,7 +132,8 @@ class Geomesh:
 
     def __init__(
             self,
-            geo_out_db_dir: str | None
+            geo_out_db_dir: str | None,
+            cache: Optional[QueryResultCache] = None
     ):
         """
         Initialize class
@@ -101,9 +142,16 @@ class Geomesh:
             The directory where databases containing processed data
             will be created
         :type geo_out_db_dir: str
+        :param cache:
+            cache for query results. Can be shared between Geomesh
+            instances. Results are not cached if unset.
+        :type cache: Optional[QueryResultCache]
         """
 
         self.geo_out_db_dir = geo_out_db_dir
+        self.cache = cache
+        self.planner = query_planner.QueryPlanner(
+            Geomesh.CELLS_AT_RESOLUTION, Geomesh.CELLS_KM2_AT_RESOLUTION)
 
         # some commands don't need database, so allow None in that case
         if geo_out_db_dir is not None:
@@ -123,29 +171,979 @@ class Geomesh:
             max_lat: float,
             min_long: float,
             max_long: float,
-            year: Optional[int],
-            month: Optional[int],
-            day: Optional[int]
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
     ) -> List[Dict[str, Any]]:
-        if not self.metadb.ds_meta_exists(dataset_name):
-            raise Exception(f"dataset {dataset_name} not registered"
-                            f" in metadata.")
+        """
+        Get the rows of a dataset within a bounding box, as one dictionary
+        per row. Building a python object for every value is slow for large
+        results; bounding_box_get_table, bounding_box_get_df and
+        bounding_box_get_batches return columnar results instead.
+        """
+        return self.bounding_box_get_table(
+            dataset_name,
+            resolution,
+            min_lat,
+            max_lat,
+            min_long,
+            max_long,
+            year,
+            month,
+            day
+        ).to_pylist()
 
-        meta = self.metadb.get_ds_metadata(dataset_name)
-        col_names: List[str] = meta["value_columns"]["key"]
-        ds_type = meta["dataset_type"]
+    def bounding_box_get_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        """
+        Get the rows of a dataset within a bounding box, as an arrow table
+        with columns h3_cell, latitude, longitude, then the dataset's value
+        columns. For point datasets, h3_cell is the cell at the requested
+        resolution containing the point.
+        """
+        return self._get_table(
+            dataset_name,
+            ("bounding_box", dataset_name, resolution, min_lat, max_lat,
+             min_long, max_long) + self._time_key(year, month, day),
+            lambda: self._fetch_table(self._execute_bounding_box(
+                dataset_name,
+                resolution,
+                min_lat,
+                max_lat,
+                min_long,
+                max_long,
+                year,
+                month,
+                day
+            ))
+        )
+
+    def bounding_box_get_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> DataFrame:
+        """
+        Same as bounding_box_get_table, but returns a DataFrame.
+        """
+        if self.cache is not None:
+            return self.bounding_box_get_table(
+                dataset_name,
+                resolution,
+                min_lat,
+                max_lat,
+                min_long,
+                max_long,
+                year,
+                month,
+                day
+            ).to_pandas()
 
-        table_name = self._table_name_from_ds_type(
-            dataset_name, ds_type, resolution
+        connection, result = self._execute_bounding_box(
+            dataset_name,
+            resolution,
+            min_lat,
+            max_lat,
+            min_long,
+            max_long,
+            year,
+            month,
+            day
         )
+        try:
+            return result.df()
+        finally:
+            connection.close()
 
-        ds_db_path = self._get_db_path(dataset_name)
-        connection = duckdb.connect(database=ds_db_path)
+    def bounding_box_get_batches(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> Iterator[pyarrow.RecordBatch]:
+        """
+        Same as bounding_box_get_table, but streams the result as record
+        batches of up to batch_size rows, so memory use does not depend on
+        the size of the result. The query is run when this is called; the
+        dataset stays open until the iterator is exhausted or closed.
+        Streamed results are not cached.
+        """
+        connection, result = self._execute_bounding_box(
+            dataset_name,
+            resolution,
+            min_lat,
+            max_lat,
+            min_long,
+            max_long,
+            year,
+            month,
+            day
+        )
+        return self._iter_batches(connection, result, batch_size)
 
-        col_names: List[str] = meta["value_columns"]["key"]
-        value_columns = ", ".join(col_names)
+    def bounding_box_get_cursor(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            batch_size: int = DEFAULT_BATCH_SIZE,
+            token: Optional[str] = None,
+            cells_per_query: int = cursor.DEFAULT_CELLS_PER_QUERY
+    ) -> cursor.QueryCursor:
+        """
+        Same as bounding_box_get_batches, but returns a cursor that can be
+        resumed. Rows are returned in order of cell, a chunk of cells at a
+        time, and the cursor's token resumes after the rows returned so
+        far, in this or a later call. Cursors are not cached.
+
+        Cursors always join the dataset against the cells covering the
+        box, and are not planned by self.planner, as their tokens record
+        a position in the ordered list of those cells. For boxes covering
+        very many cells, bounding_box_get_batches may read less.
+
+        :param token:
+            continuation token of a previous cursor for the same query.
+            Starts from the first row if unset.
+        :type token: Optional[str]
+        :param cells_per_query:
+            cells to query at a time. Memory use grows with the number of
+            rows in these cells, not with the size of the result.
+        :type cells_per_query: int
+        :rtype: cursor.QueryCursor
+        """
+        meta, ds_type, table_name, level_res = self._get_query_level(
+            dataset_name, resolution)
+        cells = self._get_bounding_box_cells(
+            dataset_name, level_res, min_lat, max_lat, min_long, max_long)
+        box = (min_lat, max_lat, min_long, max_long)
+
+        def query(chunk: List[str], offset: int):
+            return self._execute_cells_query(
+                dataset_name, meta, ds_type, table_name, level_res, chunk,
+                box, year, month, day, ordered=True, offset=offset)
+
+        return cursor.QueryCursor(
+            query,
+            cells,
+            cursor.get_query_id(
+                "bounding_box", dataset_name, resolution, box,
+                self._time_key(year, month, day)),
+            self.metadb.get_dataset_version(dataset_name),
+            batch_size,
+            cells_per_query,
+            token
+        )
+
+    def bounding_box_get_page(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            page_size: int,
+            token: Optional[str] = None
+    ) -> Tuple[pyarrow.Table, Optional[str]]:
+        """
+        Get one page of the rows of a dataset within a bounding box, for
+        paged access to large results. Pages are read with a cursor, so
+        like bounding_box_get_cursor always join against the cells
+        covering the box.
+
+        :param page_size: maximum rows in the page
+        :type page_size: int
+        :param token:
+            the token returned with the previous page. Gets the first page
+            if unset.
+        :type token: Optional[str]
+        :return:
+            the page, with the same columns as bounding_box_get_table, and
+            the token for the next page, or None if this is the last page
+        :rtype: Tuple[pyarrow.Table, Optional[str]]
+        """
+        with self.bounding_box_get_cursor(
+                dataset_name, resolution, min_lat, max_lat, min_long,
+                max_long, year, month, day,
+                batch_size=min(page_size, DEFAULT_BATCH_SIZE),
+                token=token) as page_cursor:
+            page = page_cursor.read(page_size)
+            return page, page_cursor.token
+
+    def explain(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float
+    ) -> Dict[str, Any]:
+        """
+        Describe how a bounding box query would read a dataset, without
+        running it.
+
+        :return:
+            the plan, with keys strategy, one of [cells, range, parent,
+            scan], reason, resolution, the table read, estimated_cells
+            covering the box, estimated_rows, if the dataset's statistics
+            are known, and parent_resolution for parent plans
+        :rtype: Dict[str, Any]
+        """
+        _, ds_type, table_name, level_res = self._get_query_level(
+            dataset_name, resolution)
+        plan = self._plan_bounding_box(
+            dataset_name, ds_type, level_res,
+            (min_lat, max_lat, min_long, max_long))
+        return {
+            "dataset_name": dataset_name,
+            "table": table_name,
+            "strategy": plan.strategy,
+            "reason": plan.reason,
+            "resolution": plan.resolution,
+            "estimated_cells": plan.estimated_cells,
+            "estimated_rows": plan.estimated_rows,
+            "parent_resolution": plan.parent_resolution,
+        }
+
+    def radius_get(
+            self,
+            dataset_name: str,
+            resolution: int,
+            latitude: float,
+            longitude: float,
+            radius_km: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            exact: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Get the rows of a dataset within a radius of a point, as one
+        dictionary per row. See radius_get_table.
+        """
+        return self.radius_get_table(
+            dataset_name,
+            resolution,
+            latitude,
+            longitude,
+            radius_km,
+            year,
+            month,
+            day,
+            exact
+        ).to_pylist()
+
+    def radius_get_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            latitude: float,
+            longitude: float,
+            radius_km: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            exact: bool = True
+    ) -> pyarrow.Table:
+        """
+        Get the rows of a dataset within a radius of a point, as an arrow
+        table with the same columns as bounding_box_get_table.
+
+        Rows are returned for the cells at the requested resolution whose
+        center is within radius_km of the point, and for the cell
+        containing the point. If exact is False, every cell in the k ring
+        around the point's cell that covers the radius is used instead,
+        which avoids computing distances but includes more cells.
+        """
+        return self._get_table(
+            dataset_name,
+            ("radius", dataset_name, resolution, latitude, longitude,
+             radius_km, exact) + self._time_key(year, month, day),
+            lambda: self._fetch_table(self._execute_radius(
+                dataset_name,
+                resolution,
+                [(latitude, longitude)],
+                radius_km,
+                exact,
+                False,
+                year,
+                month,
+                day
+            ))
+        )
+
+    def radius_get_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            latitude: float,
+            longitude: float,
+            radius_km: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            exact: bool = True
+    ) -> DataFrame:
+        """
+        Same as radius_get_table, but returns a DataFrame.
+        """
+        return self.radius_get_table(
+            dataset_name,
+            resolution,
+            latitude,
+            longitude,
+            radius_km,
+            year,
+            month,
+            day,
+            exact
+        ).to_pandas()
+
+    def radius_get_many_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            centers: List[Tuple[float, float]],
+            radius_km: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            exact: bool = True
+    ) -> pyarrow.Table:
+        """
+        Get the rows of a dataset within a radius of each of several
+        (latitude, longitude) centers, in one query. The result has the
+        columns of radius_get_table, preceded by center_index, the
+        position in centers of the center the row is near. Rows near
+        several centers are returned once for each.
+        """
+        return self._get_table(
+            dataset_name,
+            ("radius_many", dataset_name, resolution, tuple(centers),
+             radius_km, exact) + self._time_key(year, month, day),
+            lambda: self._fetch_table(self._execute_radius(
+                dataset_name,
+                resolution,
+                list(centers),
+                radius_km,
+                exact,
+                True,
+                year,
+                month,
+                day
+            ))
+        )
+
+    def radius_get_many_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            centers: List[Tuple[float, float]],
+            radius_km: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            exact: bool = True
+    ) -> DataFrame:
+        """
+        Same as radius_get_many_table, but returns a DataFrame.
+        """
+        return self.radius_get_many_table(
+            dataset_name,
+            resolution,
+            centers,
+            radius_km,
+            year,
+            month,
+            day,
+            exact
+        ).to_pandas()
+
+    def region_get_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: BaseGeometry,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        """
+        Get the rows of a dataset within a region, as an arrow table with
+        the same columns as bounding_box_get_table.
+
+        Rows are matched by the cells at the requested resolution that
+        overlap the region. Rows in cells entirely inside the region are
+        returned without further checks; rows in cells crossing its
+        boundary are returned if their latitude/longitude is inside the
+        region. For h3 datasets, that is the center of the row's cell.
+
+        :param region:
+            the region, with coordinates in (longitude, latitude) order,
+            as read from a shapefile
+        :type region: BaseGeometry
+        """
+        return self._get_table(
+            dataset_name,
+            ("region", dataset_name, resolution, shapely.to_wkb(region))
+            + self._time_key(year, month, day),
+            lambda: self._get_region_table(
+                dataset_name, resolution, region, year, month, day)
+        )
+
+    def region_get_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: BaseGeometry,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> DataFrame:
+        """
+        Same as region_get_table, but returns a DataFrame.
+        """
+        return self.region_get_table(
+            dataset_name, resolution, region, year, month, day).to_pandas()
+
+    def shapefile_get_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            shapefile: str,
+            region: Optional[str],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        """
+        Get the rows of a dataset within a region of a shapefile. See
+        region_get_table.
+
+        :param region:
+            the name of the region in the shapefile. If absent, every
+            region in the shapefile is included.
+        :type region: Optional[str]
+        """
+        shp = shape.Shape(shapefile)
+        shp.transform_to_epsg_4326()
+        return self.region_get_table(
+            dataset_name,
+            resolution,
+            shp.get_region_geometry(region),
+            year,
+            month,
+            day
+        )
+
+    def shapefile_get_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            shapefile: str,
+            region: Optional[str],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> DataFrame:
+        """
+        Same as shapefile_get_table, but returns a DataFrame.
+        """
+        return self.shapefile_get_table(
+            dataset_name, resolution, shapefile, region, year, month, day
+        ).to_pandas()
+
+    def zonal_stats(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]],
+            aggregations: Optional[List[str]] = None,
+            value_columns: Optional[List[str]] = None,
+            group_by: Optional[List[str]] = None,
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None
+    ) -> pyarrow.Table:
+        """
+        Aggregate the values of a dataset over a region, in the database,
+        returning only the summary rows.
+
+        :param region:
+            the area to aggregate over. One of: a (min_lat, max_lat,
+            min_long, max_long) bounding box, matched as by
+            bounding_box_get_table; a shapely geometry in (longitude,
+            latitude) order, matched as by region_get_table; or a
+            collection of h3 cells at the requested resolution or coarser.
+        :type region:
+            Union[Tuple[float, float, float, float], BaseGeometry,
+            Iterable[str]]
+        :param aggregations:
+            the aggregations to compute for each value column. Options:
+            [count, sum, mean, min, max, std, median].
+            Defaults to [count, mean, min, max]
+        :type aggregations: Optional[List[str]]
+        :param value_columns:
+            the columns to aggregate. Defaults to every numeric value
+            column of the dataset.
+        :type value_columns: Optional[List[str]]
+        :param group_by:
+            key columns, such as year and month, to compute separate
+            statistics for each value of. Statistics cover the whole
+            region and all key values if unset.
+        :type group_by: Optional[List[str]]
+        :param year:
+            only include rows for this year. Unlike the other queries,
+            time filters are optional, so series of values can be
+            aggregated.
+        :type year: Optional[TimeValue]
+        :return:
+            a table with the group_by columns, then a column
+            <value column>_<aggregation> for each value column and
+            aggregation, with one row per group, ordered by group.
+        :rtype: pyarrow.Table
+        """
+        aggregations = list(aggregations or DEFAULT_ZONAL_AGGREGATIONS)
+        group_by = list(group_by or [])
+        for agg in aggregations:
+            if agg not in ZONAL_AGGREGATIONS:
+                raise ValueError(
+                    f"unrecognized aggregation {agg}. valid aggregations"
+                    f" are {list(ZONAL_AGGREGATIONS.keys())}")
+
+        meta, ds_type, table_name, level_res = self._get_zonal_level(
+            dataset_name, resolution, aggregations)
+        k_cols = meta["key_columns"]["key"]
+        for g in group_by:
+            if g not in k_cols:
+                raise ValueError(
+                    f"can only group by key columns of {dataset_name}:"
+                    f" {k_cols}. {g} is not a key column")
+        value_columns = self._get_zonal_value_columns(meta, value_columns)
+        use_pyramid = ds_type == "h3_index" and table_name != dataset_name
+        agg_sql = PYRAMID_ZONAL_AGGREGATIONS if use_pyramid \
+            else ZONAL_AGGREGATIONS
+
+        box, interior, boundary = self._resolve_region(
+            dataset_name, level_res, region)
+
+        # the columns the aggregations read
+        if use_pyramid:
+            stats = self.metadb.get_storage_info(
+                dataset_name)["storage_options"]["pyramid_statistics"]
+            input_cols = [
+                f"{c}_{stat}" for c in value_columns for stat in stats]
+        else:
+            input_cols = list(value_columns)
+        input_cols = group_by + input_cols
+
+        cell_column = self._get_cell_column(ds_type, level_res)
+        key_filter, key_params = self._get_key_filters(
+            k_cols, year, month, day)
+        lat_long_filter, lat_long_params = None, []
+        if box is not None:
+            lat_long_filter, lat_long_params = self._get_lat_long_prefilter(
+                level_res, *box)
+
+        connection, source, partition_filter, partition_params = \
+            self._get_source(dataset_name, ds_type, table_name, level_res,
+                             interior + boundary)
+        where = self._combine_where_clauses(
+            [key_filter, partition_filter, lat_long_filter])
+        params = key_params + partition_params + lat_long_params
+
+        try:
+            rows_sql = self._register_region_rows(
+                connection, source, cell_column, where, params, region,
+                interior, boundary, input_cols)
+            select_cols = list(group_by) + [
+                f"{agg_sql[agg].format(c=c)} AS {c}_{agg}"
+                for c in value_columns for agg in aggregations
+            ]
+            group_clause = ""
+            if len(group_by) > 0:
+                group_clause = f"GROUP BY {', '.join(group_by)}" \
+                               f" ORDER BY {', '.join(group_by)}"
+            sql = f"""
+                SELECT {", ".join(select_cols)}
+                FROM ({rows_sql}) r
+                {group_clause}
+            """
+            return connection.execute(sql, params).fetch_arrow_table()
+        finally:
+            connection.close()
+
+    def zonal_stats_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]],
+            aggregations: Optional[List[str]] = None,
+            value_columns: Optional[List[str]] = None,
+            group_by: Optional[List[str]] = None,
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None
+    ) -> DataFrame:
+        """
+        Same as zonal_stats, but returns a DataFrame.
+        """
+        return self.zonal_stats(
+            dataset_name, resolution, region, aggregations, value_columns,
+            group_by, year, month, day).to_pandas()
+
+    def zonal_stats_shapefile(
+            self,
+            dataset_name: str,
+            resolution: int,
+            shapefile: str,
+            region: Optional[str],
+            aggregations: Optional[List[str]] = None,
+            value_columns: Optional[List[str]] = None,
+            group_by: Optional[List[str]] = None,
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None
+    ) -> pyarrow.Table:
+        """
+        Same as zonal_stats, over a region of a shapefile. If region is
+        absent, every region in the shapefile is included.
+        """
+        shp = shape.Shape(shapefile)
+        shp.transform_to_epsg_4326()
+        return self.zonal_stats(
+            dataset_name, resolution, shp.get_region_geometry(region),
+            aggregations, value_columns, group_by, year, month, day)
+
+    def time_series_get_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]],
+            value_columns: Optional[List[str]] = None,
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None,
+            layout: str = "long"
+    ) -> pyarrow.Table:
+        """
+        Get every time slice of a dataset's values over a region, reading
+        the dataset once, rather than once per slice. Values of point
+        datasets are averaged over the points in each cell.
+
+        :param region:
+            the area to get values for, as accepted by zonal_stats
+        :type region:
+            Union[Tuple[float, float, float, float], BaseGeometry,
+            Iterable[str]]
+        :param value_columns:
+            the columns to get. Defaults to every numeric value column of
+            the dataset.
+        :type value_columns: Optional[List[str]]
+        :param year:
+            only include these years. A single year, a TimeRange, or a
+            list of years. Every year is included if unset, and likewise
+            for month and day.
+        :type year: Optional[TimeValue]
+        :param layout:
+            long returns columns h3_cell, the dataset's time key columns,
+            then the value columns, with a row per cell and time slice.
+            wide returns one row per cell, with a column
+            <value column>_<year>[_<month>[_<day>]] per value column and
+            time slice. Both are ordered by cell, then time.
+            Options: [long, wide]
+        :type layout: str
+        :rtype: pyarrow.Table
+        """
+        if layout not in TIME_SERIES_LAYOUTS:
+            raise ValueError(
+                f"unrecognized layout {layout}. valid layouts are"
+                f" {TIME_SERIES_LAYOUTS}")
+        meta, ds_type, table_name, level_res = self._get_query_level(
+            dataset_name, resolution)
+        time_cols = [
+            c for c in TIME_COLUMNS if c in meta["key_columns"]["key"]]
+        if len(time_cols) == 0:
+            raise ValueError(
+                f"dataset {dataset_name} has no time key columns. time"
+                f" key columns are {TIME_COLUMNS}")
+        value_columns = self._get_zonal_value_columns(meta, value_columns)
+
+        if isinstance(region, BaseGeometry):
+            region_key = shapely.to_wkb(region)
+        else:
+            region = tuple(region)
+            region_key = region
+        return self._get_table(
+            dataset_name,
+            ("time_series", dataset_name, resolution, region_key,
+             tuple(value_columns), layout)
+            + self._time_key(year, month, day),
+            lambda: self._get_time_series(
+                dataset_name, meta, ds_type, table_name, level_res, region,
+                value_columns, time_cols, layout, year, month, day)
+        )
+
+    def time_series_get_df(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]],
+            value_columns: Optional[List[str]] = None,
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None,
+            layout: str = "long"
+    ) -> DataFrame:
+        """
+        Same as time_series_get_table, but returns a DataFrame.
+        """
+        return self.time_series_get_table(
+            dataset_name, resolution, region, value_columns, year, month,
+            day, layout).to_pandas()
+
+    def point_lookup_table(
+            self,
+            points: DataFrame | pyarrow.Table,
+            datasets: List[Tuple[str, int]],
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None,
+            id_column: str = "id"
+    ) -> pyarrow.Table:
+        """
+        Get the values of several datasets at each of many points, such as
+        the locations of a portfolio of assets.
+
+        Each point is assigned the cell containing it at each dataset's
+        resolution, then each dataset is joined against the distinct cells
+        of all points in a single query. Values of point datasets are
+        averaged over the points in each cell.
+
+        :param points:
+            the points to look up, with id_column, latitude and longitude
+            columns
+        :type points: DataFrame | pyarrow.Table
+        :param datasets:
+            (dataset name, resolution) of each dataset to look up. Each
+            dataset may only be listed once.
+        :type datasets: List[Tuple[str, int]]
+        :param id_column: the column identifying each point
+        :type id_column: str
+        :return:
+            a table with one row per point, in the same order as points.
+            The columns are id_column, then <dataset>_<value column> for
+            each value column of each dataset. Values are null for points
+            with no data.
+        :rtype: pyarrow.Table
+        """
+        if isinstance(points, DataFrame):
+            points = pyarrow.Table.from_pandas(points, preserve_index=False)
+        for col in [id_column, const.LATITUDE_COL, const.LONGITUDE_COL]:
+            if col not in points.column_names:
+                raise ValueError(f"points must have a {col} column")
+        names = [name for name, _ in datasets]
+        if len(set(names)) != len(names):
+            raise ValueError(f"datasets may only be listed once: {names}")
+
+        levels = [
+            (name,) + self._get_query_level(name, res)
+            for name, res in datasets
+        ]
+        resolutions = sorted(set(level[4] for level in levels))
+
+        # cells are computed once at the finest resolution, and coarser
+        #  ones derived from those
+        latitudes = points[const.LATITUDE_COL].to_numpy(zero_copy_only=False)
+        longitudes = points[const.LONGITUDE_COL].to_numpy(
+            zero_copy_only=False)
+        cell_ids = {}
+        if len(resolutions) > 0:
+            finest = dataset_utilities.get_cell_ids(
+                latitudes, longitudes, resolutions[-1])
+            for res in resolutions:
+                cell_ids[res] = finest if res == resolutions[-1] else \
+                    dataset_utilities.get_parent_cell_ids(finest, res)
+        lookup_points = pyarrow.table(dict(
+            [("row_index", pyarrow.array(numpy.arange(len(points))))] +
+            [(f"cell_{res}", pyarrow.array(ids))
+             for res, ids in cell_ids.items()]
+        ))
+
+        out = pyarrow.table({id_column: points[id_column]})
+        for name, meta, ds_type, table_name, res in levels:
+            values = self._lookup_dataset(
+                name, meta, ds_type, table_name, res, lookup_points,
+                cell_ids[res], year, month, day)
+            for col in values.column_names:
+                out = out.append_column(f"{name}_{col}", values[col])
+        return out
+
+    def point_lookup_df(
+            self,
+            points: DataFrame | pyarrow.Table,
+            datasets: List[Tuple[str, int]],
+            year: Optional[TimeValue] = None,
+            month: Optional[TimeValue] = None,
+            day: Optional[TimeValue] = None,
+            id_column: str = "id"
+    ) -> DataFrame:
+        """
+        Same as point_lookup_table, but returns a DataFrame.
+        """
+        return self.point_lookup_table(
+            points, datasets, year, month, day, id_column).to_pandas()
+
+    #####
+    # INTERNAL
+    #####
+
+    def _get_table(
+            self,
+            dataset_name: str,
+            key: Tuple,
+            compute: Callable[[], pyarrow.Table]
+    ) -> pyarrow.Table:
+        """
+        Get a query's result as an arrow table, from the cache if it holds
+        the result for the current version of the dataset, otherwise by
+        running it with compute.
+        """
+        if self.cache is not None:
+            version = self.metadb.get_dataset_version(dataset_name)
+            table = self.cache.get(key, version)
+            if table is not None:
+                return table
 
-        cells = list(self._get_h3_in_boundary(
+        table = compute()
+
+        if self.cache is not None:
+            self.cache.put(key, version, table)
+        return table
+
+    @staticmethod
+    def _fetch_table(
+            query: Tuple[duckdb.DuckDBPyConnection,
+                         duckdb.DuckDBPyConnection]
+    ) -> pyarrow.Table:
+        """
+        Fetch the whole result of a query run by one of the _execute
+        methods, closing its connection.
+        """
+        connection, result = query
+        try:
+            return result.fetch_arrow_table()
+        finally:
+            connection.close()
+
+    def _execute_bounding_box(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple[duckdb.DuckDBPyConnection, duckdb.DuckDBPyConnection]:
+        """
+        Run a bounding box query, returning the connection it was run on,
+        which the caller must close, and the pending result.
+        """
+        meta, ds_type, table_name, resolution = self._get_query_level(
+            dataset_name, resolution)
+        box = (min_lat, max_lat, min_long, max_long)
+        plan = self._plan_bounding_box(dataset_name, ds_type, resolution, box)
+        if plan.strategy != query_planner.CELL_SET:
+            return self._execute_planned_query(
+                dataset_name, meta, ds_type, table_name, plan, box,
+                year, month, day)
+        cells = self._get_bounding_box_cells(
+            dataset_name, resolution, min_lat, max_lat, min_long, max_long)
+
+        return self._execute_cells_query(
+            dataset_name, meta, ds_type, table_name, resolution, cells,
+            (min_lat, max_lat, min_long, max_long), year, month, day)
+
+    def _plan_bounding_box(
+            self,
+            dataset_name: str,
+            ds_type: str,
+            resolution: int,
+            box: Tuple[float, float, float, float]
+    ) -> query_planner.QueryPlan:
+        storage = self.metadb.get_storage_info(dataset_name)
+        partition_res = None
+        if storage["storage_type"] == "parquet":
+            partition_res = storage["storage_options"].get(
+                "partition_resolution")
+        plan = self.planner.plan_bounding_box(
+            ds_type,
+            resolution,
+            box,
+            self.metadb.get_dataset_statistics(dataset_name),
+            partition_res
+        )
+        logger.info(f"bounding box query of {dataset_name} planned as"
+                    f" {plan.strategy}: {plan.reason}")
+        return plan
+
+    def _get_bounding_box_cells(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float
+    ) -> List[str]:
+        if self._outside_extent(
+                dataset_name, resolution, min_lat, max_lat, min_long,
+                max_long):
+            # nothing to find, but the query still runs, so the result has
+            #  the dataset's columns
+            return []
+        return list(self._get_h3_in_boundary(
             resolution,
             min_lat,
             max_lat,
@@ -153,6 +1151,564 @@ class Geomesh:
             max_long,
         ))
 
+    def _execute_radius(
+            self,
+            dataset_name: str,
+            resolution: int,
+            centers: List[Tuple[float, float]],
+            radius_km: float,
+            exact: bool,
+            with_center_index: bool,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple[duckdb.DuckDBPyConnection, duckdb.DuckDBPyConnection]:
+        """
+        Run a radius query around one or more centers, returning the
+        connection it was run on, which the caller must close, and the
+        pending result.
+        """
+        if radius_km < 0:
+            raise ValueError(f"radius must not be negative, was {radius_km}")
+        meta, ds_type, table_name, resolution = self._get_query_level(
+            dataset_name, resolution)
+
+        box = self._get_radius_box(centers, radius_km)
+        if box is not None and self._outside_extent(
+                dataset_name, resolution, *box):
+            center_cells = []
+        else:
+            center_cells = self._get_cells_in_radius(
+                resolution, centers, radius_km, exact)
+        # centers close together share most of their cells, which are only
+        #  joined against the dataset once
+        cells = sorted(set(c for _, c in center_cells))
+
+        return self._execute_cells_query(
+            dataset_name, meta, ds_type, table_name, resolution, cells, box,
+            year, month, day,
+            center_cells if with_center_index else None)
+
+    def _get_region_table(
+            self,
+            dataset_name: str,
+            resolution: int,
+            region: BaseGeometry,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        meta, ds_type, table_name, resolution = self._get_query_level(
+            dataset_name, resolution)
+        min_long, min_lat, max_long, max_lat = region.bounds
+        box = (min_lat, max_lat, min_long, max_long)
+
+        if region.is_empty or self._outside_extent(
+                dataset_name, resolution, *box):
+            interior, boundary = [], []
+        else:
+            interior, boundary = self._get_cells_in_region(
+                resolution, region)
+
+        table = self._fetch_table(self._execute_cells_query(
+            dataset_name, meta, ds_type, table_name, resolution,
+            interior + boundary, box, year, month, day))
+
+        # only rows in cells crossing the boundary need an exact check
+        on_boundary = pyarrow.compute.is_in(
+            table[const.CELL_COL],
+            value_set=pyarrow.array(boundary, pyarrow.string())
+        ).to_numpy(zero_copy_only=False)
+        if on_boundary.any():
+            shapely.prepare(region)
+            longitudes = table[const.LONGITUDE_COL].to_numpy(
+                zero_copy_only=False)
+            latitudes = table[const.LATITUDE_COL].to_numpy(
+                zero_copy_only=False)
+            inside = numpy.zeros(len(on_boundary), dtype=bool)
+            inside[on_boundary] = shapely.contains_xy(
+                region, longitudes[on_boundary], latitudes[on_boundary])
+            table = table.filter(pyarrow.array(~on_boundary | inside))
+        return table
+
+    def _get_cells_in_region(
+            self,
+            res: int,
+            region: BaseGeometry
+    ) -> Tuple[List[str], List[str]]:
+        """
+        Get the cells overlapping a region, split into those entirely
+        inside it and those crossing its boundary. Candidate cells are
+        found by filling the region widened by a cell, then each is
+        tested against the region in a single vectorized call.
+        """
+        margin_km = 2 * h3.edge_length(res, unit="km")
+        min_long, min_lat, max_long, max_lat = region.bounds
+        cos_lat = max(
+            math.cos(math.radians(max(abs(min_lat), abs(max_lat)))), 0.01)
+        widened = region.buffer(margin_km / (KM_PER_DEGREE * cos_lat))
+
+        candidates = set()
+        for poly in shapely.get_parts(widened):
+            candidates.update(h3.polyfill(
+                poly.__geo_interface__, res, geo_json_conformant=True))
+        candidates = sorted(candidates)
+        if len(candidates) == 0:
+            return [], []
+
+        cell_polys = numpy.array([
+            shapely.Polygon(h3.h3_to_geo_boundary(c, geo_json=True))
+            for c in candidates
+        ])
+        shapely.prepare(region)
+        within = shapely.contains(region, cell_polys)
+        crossing = ~within & shapely.intersects(region, cell_polys)
+        cells = numpy.array(candidates)
+        return cells[within].tolist(), cells[crossing].tolist()
+
+    def _resolve_region(
+            self,
+            dataset_name: str,
+            res: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]]
+    ) -> Tuple[Optional[Tuple[float, float, float, float]], List[str],
+               List[str]]:
+        """
+        Get the cells at a resolution matching a region given as a bounding
+        box, a geometry, or a collection of cells.
+
+        :return:
+            the (min_lat, max_lat, min_long, max_long) box covering the
+            region, if known, the cells entirely inside it, and the cells
+            crossing the boundary of a geometry, whose rows must be checked
+            exactly
+        """
+        if isinstance(region, BaseGeometry):
+            min_long, min_lat, max_long, max_lat = region.bounds
+            box = (min_lat, max_lat, min_long, max_long)
+            if region.is_empty or self._outside_extent(
+                    dataset_name, res, *box):
+                return box, [], []
+            interior, boundary = self._get_cells_in_region(res, region)
+            return box, interior, boundary
+        if isinstance(region, tuple) and len(region) == 4 and \
+                not isinstance(region[0], str):
+            if self._outside_extent(dataset_name, res, *region):
+                return region, [], []
+            return region, list(self._get_h3_in_boundary(res, *region)), []
+        return None, self._cells_at_resolution(region, res), []
+
+    def _register_region_rows(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            source: str,
+            cell_column: str,
+            where: str,
+            params: List[Any],
+            region: Any,
+            interior: List[str],
+            boundary: List[str],
+            cols: List[str]
+    ) -> str:
+        """
+        Register the cells of a region with a connection, returning sql
+        selecting cols from the rows of source within the region. Rows in
+        boundary cells are fetched and checked against the region here.
+        """
+        def region_rows(cells_table: str, row_cols: List[str]) -> str:
+            return f"""
+                SELECT {", ".join(f"d.{c}" for c in row_cols)}
+                FROM {source} d
+                JOIN {cells_table} q ON d.{cell_column} = q.cell
+                {where}
+            """
+
+        connection.register("query_cells", pyarrow.table(
+            {"cell": pyarrow.array(interior, pyarrow.string())}))
+        rows_sql = region_rows("query_cells", cols)
+        if len(boundary) == 0:
+            return rows_sql
+
+        # rows in cells crossing the region's boundary are checked exactly
+        #  before being combined with the others
+        connection.register("boundary_cells", pyarrow.table(
+            {"cell": pyarrow.array(boundary, pyarrow.string())}))
+        boundary_rows = connection.execute(
+            region_rows(
+                "boundary_cells",
+                cols + [const.LATITUDE_COL, const.LONGITUDE_COL]),
+            params
+        ).fetch_arrow_table()
+        shapely.prepare(region)
+        inside = shapely.contains_xy(
+            region,
+            boundary_rows[const.LONGITUDE_COL].to_numpy(
+                zero_copy_only=False),
+            boundary_rows[const.LATITUDE_COL].to_numpy(
+                zero_copy_only=False)
+        )
+        connection.register(
+            "boundary_rows",
+            boundary_rows.select(cols).filter(pyarrow.array(inside))
+        )
+        return f"""
+            {rows_sql}
+            UNION ALL
+            SELECT {", ".join(cols)} FROM boundary_rows
+        """
+
+    def _get_time_series(
+            self,
+            dataset_name: str,
+            meta: Dict[str, Any],
+            ds_type: str,
+            table_name: str,
+            resolution: int,
+            region: Union[Tuple[float, float, float, float], BaseGeometry,
+                          Iterable[str]],
+            value_columns: List[str],
+            time_cols: List[str],
+            layout: str,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        box, interior, boundary = self._resolve_region(
+            dataset_name, resolution, region)
+        types = dict(zip(meta["value_columns"]["key"],
+                         meta["value_columns"]["value"]))
+
+        cell_column = self._get_cell_column(ds_type, resolution)
+        key_filter, key_params = self._get_key_filters(
+            meta["key_columns"]["key"], year, month, day)
+        lat_long_filter, lat_long_params = None, []
+        if box is not None:
+            lat_long_filter, lat_long_params = self._get_lat_long_prefilter(
+                resolution, *box)
+
+        connection, source, partition_filter, partition_params = \
+            self._get_source(dataset_name, ds_type, table_name, resolution,
+                             interior + boundary)
+        where = self._combine_where_clauses(
+            [key_filter, partition_filter, lat_long_filter])
+        params = key_params + partition_params + lat_long_params
+
+        try:
+            rows_sql = self._register_region_rows(
+                connection, source, cell_column, where, params, region,
+                interior, boundary,
+                [cell_column] + time_cols + value_columns)
+            aggs = [
+                f"avg({c}) AS {c}"
+                if duckdbutils.is_numeric_type(types[c])
+                else f"first({c}) AS {c}"
+                for c in value_columns
+            ]
+            series = connection.execute(f"""
+                SELECT {cell_column} AS {const.CELL_COL},
+                    {", ".join(time_cols + aggs)}
+                FROM ({rows_sql}) r
+                GROUP BY {", ".join([cell_column] + time_cols)}
+                ORDER BY {", ".join([const.CELL_COL] + time_cols)}
+            """, params).fetch_arrow_table()
+            if layout == "long":
+                return series
+
+            connection.register("series", series)
+            slices = connection.execute(f"""
+                SELECT DISTINCT {", ".join(time_cols)}
+                FROM series
+                ORDER BY {", ".join(time_cols)}
+            """).fetchall()
+            pivot_cols = []
+            for c in value_columns:
+                for time_slice in slices:
+                    condition = " AND ".join(
+                        f"{t} IS NULL" if v is None else f"{t} = {int(v)}"
+                        for t, v in zip(time_cols, time_slice))
+                    suffix = "_".join(
+                        "null" if v is None
+                        else str(v) if t == "year" else f"{v:02d}"
+                        for t, v in zip(time_cols, time_slice))
+                    pivot_cols.append(
+                        f'first({c}) FILTER (WHERE {condition})'
+                        f' AS "{c}_{suffix}"')
+            return connection.execute(f"""
+                SELECT {", ".join([const.CELL_COL] + pivot_cols)}
+                FROM series
+                GROUP BY {const.CELL_COL}
+                ORDER BY {const.CELL_COL}
+            """).fetch_arrow_table()
+        finally:
+            connection.close()
+
+    def _get_zonal_level(
+            self,
+            dataset_name: str,
+            resolution: int,
+            aggregations: List[str]
+    ) -> Tuple[Dict[str, Any], str, str, int]:
+        """
+        Get the table and resolution to compute zonal statistics from. For
+        h3_index datasets, a pyramid level is used only if it is at the
+        requested resolution and stores the statistics needed; otherwise
+        the base table is used, so results are always exact.
+        """
+        meta, ds_type, table_name, level_res = self._get_query_level(
+            dataset_name, resolution)
+        if ds_type != "h3_index" or table_name == dataset_name:
+            return meta, ds_type, table_name, level_res
+        if level_res == resolution and \
+                all(a in PYRAMID_ZONAL_AGGREGATIONS for a in aggregations):
+            return meta, ds_type, table_name, level_res
+        base_res = self.metadb.get_storage_info(
+            dataset_name)["storage_options"]["base_resolution"]
+        logger.info(f"computing statistics for {dataset_name} from its"
+                    f" base table at resolution {base_res}")
+        return meta, ds_type, dataset_name, base_res
+
+    def _get_zonal_value_columns(
+            self,
+            meta: Dict[str, Any],
+            value_columns: Optional[List[str]]
+    ) -> List[str]:
+        types = dict(zip(meta["value_columns"]["key"],
+                         meta["value_columns"]["value"]))
+        if value_columns is None:
+            return [
+                c for c, t in types.items()
+                if duckdbutils.is_numeric_type(t)
+                and not dataset_utilities.is_cell_col(c)
+                and c not in [const.LATITUDE_COL, const.LONGITUDE_COL]
+            ]
+        for c in value_columns:
+            if c not in types:
+                raise ValueError(
+                    f"{c} is not a value column of the dataset. value"
+                    f" columns are {list(types.keys())}")
+        return list(value_columns)
+
+    def _cells_at_resolution(
+            self,
+            cells: Iterable[str],
+            res: int
+    ) -> List[str]:
+        """
+        Get the cells at a resolution covering the same area as a
+        collection of cells at that resolution or coarser.
+        """
+        out = set()
+        for cell in cells:
+            cell_res = h3.h3_get_resolution(cell)
+            if cell_res == res:
+                out.add(cell)
+            elif cell_res < res:
+                out.update(h3.h3_to_children(cell, res))
+            else:
+                raise ValueError(
+                    f"cell {cell} is at resolution {cell_res}, finer than"
+                    f" the resolution {res} being queried")
+        return sorted(out)
+
+    def _get_key_filters(
+            self,
+            k_cols: List[str],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple[Optional[str], List[Any]]:
+        """
+        Get a filter on whichever of year, month and day are set. Unlike
+        _get_time_filters, none are required.
+        """
+        filters = []
+        params = []
+        for name, value in [("year", year), ("month", month), ("day", day)]:
+            if value is None:
+                continue
+            if name not in k_cols:
+                raise ValueError(
+                    f"{name} was provided, but is not a key column of the"
+                    f" dataset. key columns are {k_cols}")
+            f, p = time_filter.get_filter(name, value)
+            filters.append(f)
+            params.extend(p)
+        if len(filters) == 0:
+            return None, []
+        return " AND ".join(filters), params
+
+    def _get_query_level(
+            self,
+            dataset_name: str,
+            resolution: int
+    ) -> Tuple[Dict[str, Any], str, str, int]:
+        """
+        Get a dataset's metadata, type, and the table and resolution that
+        a query at the given resolution reads from.
+        """
+        if not self.metadb.ds_meta_exists(dataset_name):
+            raise Exception(f"dataset {dataset_name} not registered"
+                            f" in metadata.")
+
+        meta = self.metadb.get_ds_metadata(dataset_name)
+        ds_type = meta["dataset_type"]
+
+        if ds_type == "h3_index":
+            table_name, resolution = self._get_h3_index_level(
+                dataset_name, resolution)
+        else:
+            table_name = self._table_name_from_ds_type(
+                dataset_name, ds_type, resolution
+            )
+        return meta, ds_type, table_name, resolution
+
+    def _execute_cells_query(
+            self,
+            dataset_name: str,
+            meta: Dict[str, Any],
+            ds_type: str,
+            table_name: str,
+            resolution: int,
+            cells: List[str],
+            box: Optional[Tuple[float, float, float, float]],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
+            center_cells: Optional[List[Tuple[int, str]]] = None,
+            ordered: bool = False,
+            offset: int = 0
+    ) -> Tuple[duckdb.DuckDBPyConnection, duckdb.DuckDBPyConnection]:
+        """
+        Run a query for the rows of a dataset in the given cells. box, if
+        set, is the (min_lat, max_lat, min_long, max_long) area the cells
+        cover. If center_cells is set, each row is returned once for every
+        center whose cells contain it, with the center's index. If ordered
+        is set, rows are ordered by cell, then by their other columns, and
+        the first offset rows are skipped.
+        """
+        time_filter, time_params = self._get_dataset_time_filters(
+            meta, year, month, day)
+
+        cell_column = self._get_cell_column(ds_type, resolution)
+
+        # the latitude/longitude prefilter is redundant with the cell join,
+        #  but lets duckdb skip row groups using their min/max statistics
+        #  before joining
+        lat_long_filter, lat_long_params = None, []
+        if box is not None:
+            lat_long_filter, lat_long_params = self._get_lat_long_prefilter(
+                resolution, *box)
+        connection, table_name, partition_filter, partition_params = \
+            self._get_source(dataset_name, ds_type, table_name, resolution,
+                             cells)
+        full_where = self._combine_where_clauses(
+            [time_filter, partition_filter, lat_long_filter])
+
+        select_cols = self._get_select_cols(meta, cell_column)
+        center_join = ""
+        if center_cells is not None:
+            select_cols.insert(0, "c.center_index")
+            center_join = "JOIN query_centers c ON q.cell = c.cell"
+        order_clause = ""
+        order_params = []
+        if ordered:
+            order_clause = "ORDER BY ALL OFFSET ?"
+            order_params = [offset]
+        sql = f"""
+                   SELECT {", ".join(select_cols)}
+                   FROM {table_name} d
+                   JOIN query_cells q ON d.{cell_column} = q.cell
+                   {center_join}
+                   {full_where}
+                   {order_clause}
+               """
+
+        try:
+            connection.register(
+                "query_cells",
+                pyarrow.table({"cell": pyarrow.array(cells, pyarrow.string())})
+            )
+            if center_cells is not None:
+                connection.register("query_centers", pyarrow.table({
+                    "center_index": pyarrow.array(
+                        [i for i, _ in center_cells], pyarrow.int64()),
+                    "cell": pyarrow.array(
+                        [c for _, c in center_cells], pyarrow.string())
+                }))
+            result = connection.execute(
+                sql,
+                time_params + partition_params + lat_long_params
+                + order_params)
+        except Exception:
+            connection.close()
+            raise
+        return connection, result
+
+    def _execute_planned_query(
+            self,
+            dataset_name: str,
+            meta: Dict[str, Any],
+            ds_type: str,
+            table_name: str,
+            plan: query_planner.QueryPlan,
+            box: Tuple[float, float, float, float],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple[duckdb.DuckDBPyConnection, duckdb.DuckDBPyConnection]:
+        """
+        Run a bounding box query planned to filter on latitude and
+        longitude rather than join against the cells covering the box.
+        Such plans are only made for datasets whose rows are located at
+        their cell's center, which is in the box exactly when the cell is
+        one of those covering it.
+        """
+        time_filter, time_params = self._get_dataset_time_filters(
+            meta, year, month, day)
+        box_filter, box_params = None, []
+        if plan.strategy != query_planner.SCAN:
+            box_filter = f"d.{const.LATITUDE_COL} BETWEEN ? AND ?" \
+                         f" AND d.{const.LONGITUDE_COL} BETWEEN ? AND ?"
+            box_params = list(box)
+        parent_filter, parent_params = None, []
+        if plan.strategy == query_planner.PARENT:
+            parents = self._get_h3_in_boundary(
+                plan.parent_resolution,
+                *self.planner.widen(plan.parent_resolution, box))
+            parent_filter, parent_params = \
+                self._get_partition_filter(parents) \
+                if len(parents) > 0 else ("false", [])
+
+        connection, table_name, _, _ = self._get_source(
+            dataset_name, ds_type, table_name, plan.resolution, [])
+        full_where = self._combine_where_clauses(
+            [time_filter, parent_filter, box_filter])
+        cell_column = self._get_cell_column(ds_type, plan.resolution)
+        sql = f"""
+                   SELECT {", ".join(self._get_select_cols(meta, cell_column))}
+                   FROM {table_name} d
+                   {full_where}
+               """
+        try:
+            result = connection.execute(
+                sql, time_params + parent_params + box_params)
+        except Exception:
+            connection.close()
+            raise
+        return connection, result
+
+    def _get_dataset_time_filters(
+            self,
+            meta: Dict[str, Any],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple[Optional[str], List[Any]]:
+        """
+        Get the time filter for a dataset, requiring the time values its
+        key columns call for.
+        """
         k_cols = meta["key_columns"]["key"]
         if "day" in k_cols:
             interval = "daily"
@@ -163,76 +1719,111 @@ class Geomesh:
         else:
             interval = "one_time"
 
-        time_filter, time_params = self._get_time_filters(
-            interval, year, month, day)
+        return self._get_time_filters(interval, year, month, day)
 
-        cells_per_part = 20000
-        if len(cells) > cells_per_part:
-            num_parts = math.ceil(float(len(cells)) / float(20000))
-
-            cells_split = []
-            for index in range(num_parts):
-                cells_split.append(
-                    cells[
-                    index * cells_per_part:
-                    cells_per_part * (index + 1)
-                    ])
-        else:
-            cells_split = [list(cells)]
-
-        data = []
+    def _get_select_cols(
+            self,
+            meta: Dict[str, Any],
+            cell_column: str
+    ) -> List[str]:
+        col_names: List[str] = meta["value_columns"]["key"]
+        return [
+            f"d.{cell_column} AS {const.CELL_COL}",
+            f"d.{const.LATITUDE_COL}",
+            f"d.{const.LONGITUDE_COL}"
+        ] + [
+            # h3_index datasets list latitude and longitude as value columns
+            f"d.{c}" for c in col_names
+            if c not in [const.CELL_COL, const.LATITUDE_COL,
+                         const.LONGITUDE_COL]
+        ]
 
-        if ds_type == "h3":
-            cell_column = const.CELL_COL
-        elif ds_type == "point":
-            cell_column = dataset_utilities.get_point_res_col(resolution)
-        else:
-            raise ValueError(
-                "only h3 and point dataset types are supported"
-                " for retrieving values within radius."
-                f" Provided type was: {ds_type}"
-            )
+    def _lookup_dataset(
+            self,
+            dataset_name: str,
+            meta: Dict[str, Any],
+            ds_type: str,
+            table_name: str,
+            resolution: int,
+            lookup_points: pyarrow.Table,
+            cell_ids: numpy.ndarray,
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> pyarrow.Table:
+        """
+        Get the values of a dataset at each point of a point lookup, in
+        the order of lookup_points.
+        """
+        value_cols = [
+            (c, t) for c, t in zip(meta["value_columns"]["key"],
+                                   meta["value_columns"]["value"])
+            if not dataset_utilities.is_cell_col(c)
+            and c not in [const.LATITUDE_COL, const.LONGITUDE_COL]
+        ]
+        if len(value_cols) == 0:
+            return pyarrow.table({})
+        time_filter, time_params = self._get_dataset_time_filters(
+            meta, year, month, day)
 
-        for cell_part in cells_split:
-            part_str = ""
-            for cell in cell_part:
-                part_str = part_str + f"'{cell}',"
-            part_str = part_str[:-1]
-            in_clause = f"""
-                          {cell_column} IN ({part_str})
-                       """
+        # only the partitions holding the points' cells are read
+        partition_cells = []
+        storage = self.metadb.get_storage_info(dataset_name)
+        partition_res = storage["storage_options"].get("partition_resolution")
+        if storage["storage_type"] == "parquet" and \
+                partition_res is not None and resolution >= partition_res:
+            parents = numpy.unique(
+                dataset_utilities.get_parent_cell_ids(cell_ids, partition_res))
+            partition_cells = [h3.h3_to_string(int(p)) for p in parents if p]
 
-            full_where = self._combine_where_clauses([time_filter, in_clause])
+        cell_column = self._get_cell_column(ds_type, resolution)
+        connection, source, partition_filter, partition_params = \
+            self._get_source(dataset_name, ds_type, table_name, resolution,
+                             partition_cells)
+        full_where = self._combine_where_clauses(
+            [time_filter, partition_filter])
 
-            sql = f"""
-                       SELECT {cell_column}, latitude, longitude, {value_columns}
-                       FROM {table_name}
-                       {full_where}
-                   """
-
-            res = connection.execute(sql, time_params).fetchall()
-
-            for res_row in res:
-                data.append(res_row)
-
-        # format output as a json object
-        out = []
-        for row in data:
-            num_val_cols = len(col_names)
-            out_json = {
-                const.CELL_COL: row[0],
-                const.LATITUDE_COL: row[1],
-                const.LONGITUDE_COL: row[2],
-            }
-            for i in range(0, num_val_cols):
-                index = i + 3
-                out_json[col_names[i]] = row[index]
-            out.append(out_json)
-        return out
+        # values are aggregated per cell, so each point matches one row
+        aggs = ", ".join(
+            f"avg(d.{c}) AS {c}" if duckdbutils.is_numeric_type(t)
+            else f"first(d.{c}) AS {c}"
+            for c, t in value_cols
+        )
+        cell_expr = f"lower(hex(p.cell_{resolution}))"
+        sql = f"""
+            WITH point_cells AS (
+                SELECT DISTINCT {cell_expr} AS cell FROM lookup_points p
+            ),
+            cell_values AS (
+                SELECT d.{cell_column} AS cell, {aggs}
+                FROM {source} d
+                JOIN point_cells q ON d.{cell_column} = q.cell
+                {full_where}
+                GROUP BY d.{cell_column}
+            )
+            SELECT {", ".join(f"v.{c}" for c, _ in value_cols)}
+            FROM lookup_points p
+            LEFT JOIN cell_values v ON {cell_expr} = v.cell
+            ORDER BY p.row_index
+        """
+        try:
+            connection.register("lookup_points", lookup_points)
+            return connection.execute(
+                sql, time_params + partition_params).fetch_arrow_table()
+        finally:
+            connection.close()
 
-    #####
-    # INTERNAL
-    #####
+    def _iter_batches(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            result: duckdb.DuckDBPyConnection,
+            batch_size: int
+    ) -> Iterator[pyarrow.RecordBatch]:
+        try:
+            for batch in result.fetch_record_batch(batch_size):
+                yield batch
+        finally:
+            connection.close()
 
     def _get_h3_in_boundary(
             self,
@@ -257,14 +1848,233 @@ class Geomesh:
         return set(overlap_cells)
 
 
+    def _get_cells_in_radius(
+            self,
+            res: int,
+            centers: List[Tuple[float, float]],
+            radius_km: float,
+            exact: bool
+    ) -> List[Tuple[int, str]]:
+        """
+        Get the cells within radius_km of each center, as (center index,
+        cell) pairs. The cell containing a center is always included.
+        Cells are found with a k ring around the cell containing the
+        center; if exact, only those whose center is within radius_km of
+        the center are kept.
+        """
+        k = self.get_ring_size(res, radius_km)
+        center_cells = []
+        for index, (lat, long) in enumerate(centers):
+            center_cell = h3.geo_to_h3(lat, long, res)
+            for cell in h3.k_ring(center_cell, k):
+                if exact and cell != center_cell and h3.point_dist(
+                        (lat, long), h3.h3_to_geo(cell),
+                        unit="km") > radius_km:
+                    continue
+                center_cells.append((index, cell))
+        return center_cells
+
+    @staticmethod
+    def get_ring_size(resolution: int, radius_km: float) -> int:
+        """
+        Get the number of rings of cells around a cell needed to cover
+        every cell with a center within radius_km of it, using the average
+        cell area at the resolution.
+        """
+        cell_km2 = Geomesh.CELLS_KM2_AT_RESOLUTION[resolution]
+        # a hexagon's area is 3 * sqrt(3) / 2 times its edge length
+        #  squared. the k'th ring is nearest the center along the middle of
+        #  its sides, where it is 1.5 * k edge lengths away. cells vary in
+        #  size, so one more ring is added
+        edge_km = sqrt(2 * cell_km2 / (3 * sqrt(3)))
+        return math.ceil(radius_km / (1.5 * edge_km)) + 1
+
+    def _get_radius_box(
+            self,
+            centers: List[Tuple[float, float]],
+            radius_km: float
+    ) -> Optional[Tuple[float, float, float, float]]:
+        """
+        Get the (min_lat, max_lat, min_long, max_long) box containing
+        every point within radius_km of the centers, or None if there is
+        no such box that does not cross a pole or the antimeridian.
+        """
+        if len(centers) == 0:
+            return None
+        lat_margin = radius_km / KM_PER_DEGREE
+        min_lat = min(lat for lat, _ in centers) - lat_margin
+        max_lat = max(lat for lat, _ in centers) + lat_margin
+        if min_lat < -90 or max_lat > 90:
+            return None
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        if cos_lat <= 0.01:
+            return None
+        long_margin = radius_km / (KM_PER_DEGREE * cos_lat)
+        min_long = min(long for _, long in centers) - long_margin
+        max_long = max(long for _, long in centers) + long_margin
+        if min_long < -180 or max_long > 180:
+            return None
+        return min_lat, max_lat, min_long, max_long
+
+    def _outside_extent(
+            self,
+            dataset_name: str,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float
+    ) -> bool:
+        """
+        Whether the statistics stored for a dataset show that none of its
+        rows can be in the cells covering a bounding box.
+        """
+        stats = self.metadb.get_dataset_statistics(dataset_name)
+        margin_km = 2 * h3.edge_length(resolution, unit="km")
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        if cos_lat <= 0.01:
+            return False
+        margin = margin_km / (KM_PER_DEGREE * cos_lat)
+        return not dataset_statistics.extent_intersects(
+            stats, min_lat, max_lat, min_long, max_long, margin)
+
+    def _get_lat_long_prefilter(
+            self,
+            resolution: int,
+            min_lat: float,
+            max_lat: float,
+            min_long: float,
+            max_long: float
+    ) -> Tuple[Optional[str], List[Any]]:
+        """
+        Get a filter on latitude and longitude that keeps every row in the
+        cells covering a bounding box. Cells are included when their
+        center is in the box, so rows may lie outside it by up to the size
+        of a cell; the box is widened by twice the cell edge length.
+        """
+        margin_km = 2 * h3.edge_length(resolution, unit="km")
+        lat_margin = margin_km / KM_PER_DEGREE
+        lat_low = max(min_lat - lat_margin, -90.0)
+        lat_high = min(max_lat + lat_margin, 90.0)
+        filters = ["d.latitude BETWEEN ? AND ?"]
+        params = [lat_low, lat_high]
+
+        # a degree of longitude shrinks towards the poles. near them, or
+        #  where the box crosses the antimeridian, only latitude is used
+        cos_lat = math.cos(math.radians(max(abs(lat_low), abs(lat_high))))
+        if cos_lat > 0.01:
+            long_margin = margin_km / (KM_PER_DEGREE * cos_lat)
+            long_low = min_long - long_margin
+            long_high = max_long + long_margin
+            if long_low >= -180 and long_high <= 180:
+                filters.append("d.longitude BETWEEN ? AND ?")
+                params.extend([long_low, long_high])
+        return " AND ".join(filters), params
+
+    def _get_cell_column(self, ds_type: str, resolution: int) -> str:
+        if ds_type == "h3" or ds_type == "h3_index":
+            return const.CELL_COL
+        elif ds_type == "point":
+            return dataset_utilities.get_point_res_col(resolution)
+        else:
+            raise ValueError(
+                "only h3, h3_index and point dataset types are supported"
+                " for retrieving values."
+                f" Provided type was: {ds_type}"
+            )
+
+    def _get_h3_index_level(
+            self,
+            dataset_name: str,
+            resolution: int
+    ) -> Tuple[str, int]:
+        """
+        Get the table and resolution to serve a query on an h3_index
+        dataset from. If pyramid levels were built for the dataset, the
+        level closest to the requested resolution is used, as data is
+        not available at resolutions finer than the base table or coarser
+        than the coarsest level.
+        """
+        options = self.metadb.get_storage_info(
+            dataset_name)["storage_options"]
+        base_res = options.get("base_resolution")
+        levels = options.get("pyramid_resolutions")
+        if base_res is None or levels is None:
+            return dataset_name, resolution
+
+        available = [base_res] + list(levels)
+        level = min(available, key=lambda r: (abs(r - resolution), -r))
+        if level != resolution:
+            logger.info(f"resolution {resolution} not available for dataset"
+                        f" {dataset_name}. using resolution {level}")
+        if level == base_res:
+            return dataset_name, level
+        return dataset_utilities.get_pyramid_table_name(
+            dataset_name, level), level
+
+    def _get_source(
+            self,
+            dataset_name: str,
+            ds_type: str,
+            table_name: str,
+            resolution: int,
+            cells: List[str]
+    ) -> Tuple[duckdb.DuckDBPyConnection, str, Optional[str], List[Any]]:
+        """
+        Get a connection and the table expression to read a dataset from,
+        based on how the dataset is stored. For partitioned parquet
+        datasets, also returns a filter on the partition column, with its
+        parameters, that limits the files read to those that can contain
+        the given cells.
+        """
+        storage = self.metadb.get_storage_info(dataset_name)
+        if storage["storage_type"] != "parquet":
+            ds_db_path = self._get_db_path(dataset_name)
+            return connection_manager.get_reader(ds_db_path), table_name, \
+                None, []
+
+        options = storage["storage_options"]
+        ds_path = os.path.join(self.geo_out_db_dir, options["path"])
+        glob = os.path.join(ds_path, "**", "*.parquet").replace("'", "''")
+        source = f"read_parquet('{glob}', hive_partitioning=1)"
+
+        partition_filter, partition_params = None, []
+        partition_res = options.get("partition_resolution")
+        if partition_res is not None and resolution >= partition_res:
+            parents = set(h3.h3_to_parent(c, partition_res) for c in cells)
+            if ds_type == "point":
+                # a point's partition is the cell containing it at the
+                #  partition resolution, which is not always the parent of
+                #  the cell containing it at the query resolution, but is
+                #  always adjacent to it.
+                parents = set(
+                    n for p in parents for n in h3.k_ring(p, 1))
+            if len(parents) > 0:
+                partition_filter, partition_params = \
+                    self._get_partition_filter(parents)
+
+        return duckdb.connect(), source, partition_filter, partition_params
+
+    def _get_partition_filter(
+            self,
+            partitions: Iterable[str]
+    ) -> Tuple[str, List[Any]]:
+        """
+        Get the filter limiting a partitioned parquet dataset to the given
+        partitions. The partitions are passed as a single list parameter,
+        which duckdb still uses to skip the files of other partitions.
+        """
+        return f"list_contains(?, {const.PARTITION_COL})", \
+            [sorted(partitions)]
+
     # TODO: have to replace this with more generic get_key_col_filters
     #   or something like that
     def _get_time_filters(
             self,
             interval: str,
-            year: Optional[int],
-            month: Optional[int],
-            day: Optional[int],
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue],
 
     ) -> Tuple[Optional[str], List[Any]]:
         valid_intervals = ["yearly", "monthly", "daily", "one_time"]
@@ -276,7 +2086,7 @@ class Geomesh:
 
         has_year = ["yearly", "monthly", "daily"]
 
-        f = None
+        filters = []
         params = []
         if interval in has_year:
             if year is None:
@@ -285,8 +2095,9 @@ class Geomesh:
                     f" interval: {interval}"
                 )
             else:
-                params = [year]
-                f = "year = ?"
+                f, p = time_filter.get_filter("year", year)
+                filters.append(f)
+                params.extend(p)
 
         if interval == "monthly" or interval == "daily":
             if month is None:
@@ -295,8 +2106,9 @@ class Geomesh:
                     f" interval: {interval}"
                 )
             else:
-                f = f"{f} AND month = ?"
-                params.append(month)
+                f, p = time_filter.get_filter("month", month)
+                filters.append(f)
+                params.extend(p)
 
         if interval == "daily":
             if day is None:
@@ -305,10 +2117,24 @@ class Geomesh:
                     f" interval: {interval}"
                 )
             else:
-                f = f"{f} AND day = ?"
-                params.append(day)
+                f, p = time_filter.get_filter("day", day)
+                filters.append(f)
+                params.extend(p)
 
-        return f, params
+        if len(filters) == 0:
+            return None, params
+        return " AND ".join(filters), params
+
+    @staticmethod
+    def _time_key(
+            year: Optional[TimeValue],
+            month: Optional[TimeValue],
+            day: Optional[TimeValue]
+    ) -> Tuple:
+        """
+        Get the part of a cache key identifying a query's time filters.
+        """
+        return tuple(time_filter.to_key(v) for v in [year, month, day])
 
     def _table_name_from_ds_type(
             self,
@@ -322,19 +2148,8 @@ class Geomesh:
                 f" Valid types: {metadata.VALID_DATASET_TYPES}"
             )
 
-        if ds_type == "h3":
-            if resolution is None:
-                raise ValueError(
-                    "resolution parameter cannot be None for h3 dataset"
-                )
-            table_name = dataset_name + f"_{resolution}"
-        elif ds_type == "point":
-            table_name = dataset_name
-        else:
-            raise ValueError(
-                f"dataset type: {ds_type} not yet implemented"
-            )
-        return table_name
+        return dataset_utilities.get_table_name(
+            dataset_name, ds_type, resolution)
 
     def _combine_where_clauses(self, clauses: List[Optional[str]]) -> str:
         joined = " AND ".join(
@@ -343,6 +2158,8 @@ class Geomesh:
                 clauses
             )
         )
+        if joined == "":
+            return ""
         return f"WHERE {joined}"
 
     @staticmethod
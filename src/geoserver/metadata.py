@@ -5,18 +5,38 @@
 # https://opensource.org/licenses/MIT.
 #
 # Created: 2024-03-08 by davis.broda@brodagroupsoftware.com
+import copy
+import json
 import logging
 import os
-from typing import Dict, List, Any
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Any, Optional, Tuple
 
 import duckdb
 from duckdb.duckdb import ConstraintException
 
 import common
-from common import duckdbutils
+from common import connection_manager, duckdbutils, file_lock
 
 METADATA_DB_NAME = "dataset_metadata"
 METADATA_TABLE_NAME = "dataset_metadata"
+STORAGE_TABLE_NAME = "dataset_storage"
+# version of each dataset's contents, increased on every write to it, so
+#  that cached query results can be invalidated
+VERSION_TABLE_NAME = "dataset_versions"
+# statistics computed when each dataset is written. see
+#  common.dataset_statistics for their format
+STATISTICS_TABLE_NAME = "dataset_statistics"
+
+# lock file in the database directory guarding writes to the metadata
+#  database, so that loaders in separate processes take turns writing
+#  rather than failing on duckdb's file lock
+METADATA_LOCK_NAME = "dataset_metadata.lock"
+# how long to wait for other processes before failing a metadata access
+DEFAULT_LOCK_TIMEOUT = 600
 
 VALID_DATASET_TYPES = [
     "h3",
@@ -24,19 +44,87 @@ VALID_DATASET_TYPES = [
     "h3_index"
 ]
 
+# datasets with no storage entry are stored in <dataset_name>.duckdb
+DEFAULT_STORAGE_TYPE = "duckdb"
+VALID_STORAGE_TYPES = [
+    "duckdb",
+    "parquet"
+]
+
 # Set up logging
 LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 logger = logging.getLogger(__name__)
 
+# metadata connections are closed after each access, so threads of a
+#  process must not share one
+_metadata_lock = threading.RLock()
+
+
+@dataclass
+class _Catalog:
+    """
+    In memory copy of the contents of a metadata database, so that
+    lookups made for every query do not each open the database.
+    """
+    # identifies the state of the database files the copy was read from
+    signature: Tuple
+    # whether a change to the files is certain to change their signature
+    trusted: bool
+    has_metadata_table: bool = False
+    entries: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    # dataset name -> (storage type, storage options json)
+    storage: Dict[str, Tuple[str, str]] = field(default_factory=dict)
+    versions: Dict[str, int] = field(default_factory=dict)
+    # dataset name -> statistics json
+    statistics: Dict[str, str] = field(default_factory=dict)
+
+
+# metadata database path -> catalog read from it
+_catalogs: Dict[str, _Catalog] = {}
+CATALOG_TRUST_DELAY_NS = 2 * 10**9
+
+
+def _file_signature(db_path: str) -> Tuple:
+    """
+    Identifies the state of a database from the modification time, size
+    and inode of its file and write ahead log, so that writes by other
+    processes can be detected without opening it.
+    """
+    signature = []
+    for path in [db_path, db_path + ".wal"]:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
 
 class MetadataDB:
 
     def __init__(
             self,
-            database_dir: str
+            database_dir: str,
+            lock_timeout: float = DEFAULT_LOCK_TIMEOUT,
+            stale_lock_after: Optional[float] = None
     ):
+        """
+        :param database_dir: directory containing the metadata database
+        :type database_dir: str
+        :param lock_timeout:
+            seconds to wait for other processes using the metadata
+            database before an access fails
+        :type lock_timeout: float
+        :param stale_lock_after:
+            seconds after which a write lock is assumed abandoned and is
+            broken. Locks left by dead processes on this host are always
+            broken; this is needed only for locks held from other hosts.
+        :type stale_lock_after: Optional[float]
+        """
         self.database_dir = database_dir
+        self.lock_timeout = lock_timeout
+        self.stale_lock_after = stale_lock_after
         if not os.path.exists(self.database_dir):
             logger.info(f"metadata database directory {database_dir} did not"
                         f"exist. Creating this directory now.")
@@ -122,172 +210,383 @@ class MetadataDB:
                 f" Valid dataset types are: {VALID_DATASET_TYPES}"
             )
 
-        out_db_path = self._get_db_path(METADATA_DB_NAME)
-        connection = duckdb.connect(database=out_db_path)
-
-        # one dataset, with year, month, day
-        # and have a time-reslution thing that says whether monthly, daily, etc. data is available
-        if not duckdbutils.duckdb_check_table_exists(
-                connection, METADATA_TABLE_NAME
-        ):
-            # name to identify
-            # dataset_type to let us know what type of data is in the dataset
-            #   available types: h3, point
-            # interval is for what time period data is available
-            #  (yearly, monthly, daily, etc.)
-            create_sql = f"""
-                CREATE TABLE IF NOT EXISTS {METADATA_TABLE_NAME} (
-                    dataset_name    VARCHAR PRIMARY KEY,
-                    description     VARCHAR,
-                    key_columns     MAP(VARCHAR, VARCHAR),
-                    value_columns   MAP(VARCHAR, VARCHAR),
-                    dataset_type    VARCHAR
-                )
-            """
-            connection.execute(create_sql)
+        with self._writing() as connection:
+            # one dataset, with year, month, day
+            # and have a time-reslution thing that says whether monthly, daily, etc. data is available
+            if not duckdbutils.duckdb_check_table_exists(
+                    connection, METADATA_TABLE_NAME
+            ):
+                # name to identify
+                # dataset_type to let us know what type of data is in the dataset
+                #   available types: h3, point
+                # interval is for what time period data is available
+                #  (yearly, monthly, daily, etc.)
+                create_sql = f"""
+                    CREATE TABLE IF NOT EXISTS {METADATA_TABLE_NAME} (
+                        dataset_name    VARCHAR PRIMARY KEY,
+                        description     VARCHAR,
+                        key_columns     MAP(VARCHAR, VARCHAR),
+                        value_columns   MAP(VARCHAR, VARCHAR),
+                        dataset_type    VARCHAR
+                    )
+                """
+                connection.execute(create_sql)
 
-        insert = f"""
-            INSERT INTO {METADATA_TABLE_NAME} VALUES (?,?,?,?,?)
-        """
+            insert = f"""
+                INSERT INTO {METADATA_TABLE_NAME} VALUES (?,?,?,?,?)
+            """
 
-        # This format is necessary for duckdb to recognize this as a MAP
-        #  instead of a STRUCT
-        val_col_map = {
-            "key": list(value_columns.keys()),
-            "value": list(value_columns.values())
-        }
+            # This format is necessary for duckdb to recognize this as a MAP
+            #  instead of a STRUCT
+            val_col_map = {
+                "key": list(value_columns.keys()),
+                "value": list(value_columns.values())
+            }
 
-        key_col_map = {
-            "key": list(key_columns.keys()),
-            "value": list(key_columns.values())
-        }
+            key_col_map = {
+                "key": list(key_columns.keys()),
+                "value": list(key_columns.values())
+            }
 
-        try:
-            connection.execute(
-                insert,
-                [
-                    dataset_name,
-                    description,
-                    key_col_map,
-                    val_col_map,
-                    dataset_type]
-            )
-        except ConstraintException as e:
-            raise ValueError(
-                f"dataset with name {dataset_name} already exists",
-                e
-            ) from e
-        finally:
-            connection.close()
+            try:
+                connection.execute(
+                    insert,
+                    [
+                        dataset_name,
+                        description,
+                        key_col_map,
+                        val_col_map,
+                        dataset_type]
+                )
+            except ConstraintException as e:
+                raise ValueError(
+                    f"dataset with name {dataset_name} already exists",
+                    e
+                ) from e
 
         logger.info(f"added entry for dataset {dataset_name}")
         return f"{dataset_name}"
 
 
-    def show_meta(self) -> List[Dict[str, Any]]:
-        out_db_path = self._get_db_path(METADATA_DB_NAME)
-        connection = duckdb.connect(database=out_db_path)
+    def check_writable(self) -> None:
+        """
+        Check that the metadata database can be written to, waiting for
+        other processes using it as a write would. Loaders call this
+        before doing any work, so that a load that would be unable to
+        register its dataset fails immediately rather than at the end.
+
+        :raises ValueError:
+            if the metadata database cannot be opened for writing within
+            the lock timeout
+        """
+        with self._writing():
+            pass
 
-        if not duckdbutils.duckdb_check_table_exists(
-                connection, METADATA_TABLE_NAME
-        ):
+    def show_meta(self) -> List[Dict[str, Any]]:
+        catalog = self._get_catalog()
+        if not catalog.has_metadata_table:
             raise ValueError(f"{METADATA_TABLE_NAME} table does not exist")
+        return copy.deepcopy(list(catalog.entries.values()))
 
-        sql = f"""
-            SELECT
-                dataset_name,
-                description,
-                key_columns,
-                value_columns,
-                dataset_type
-            FROM {METADATA_TABLE_NAME}
-        """
-        result_raw = connection.execute(sql).fetchall()
+    def ds_meta_exists(self, dataset_name: str) -> bool:
+        return dataset_name in self._get_catalog().entries
 
-        out = []
+    def get_ds_metadata(self, dataset_name: str) -> Dict[str, Any]:
+        catalog = self._get_catalog()
+        if not catalog.has_metadata_table:
+            raise ValueError(f"{METADATA_TABLE_NAME} table does not exist")
+        if dataset_name not in catalog.entries:
+            raise ValueError(f"dataset {dataset_name} not registered"
+                             f" in metadata.")
+        result = copy.deepcopy(catalog.entries[dataset_name])
 
-        for row in result_raw:
-            result = {
-                "dataset_name": row[0],
-                "description": row[1],
-                "key_columns": row[2],
-                "value_columns": row[3],
-                "dataset_type": row[4]
-            }
-            out.append(result)
+        col_names: List[str] = result["value_columns"]["key"]
 
-        return out
+        for c_name in col_names:
+            non_al_num = self._get_non_alphanum_chars(c_name)
+            if len(non_al_num) > 0:
+                raise ValueError(
+                    f"column names must contain only alphanumeric"
+                    f" characters and underscores."
+                    f" column name: [{c_name}] contained"
+                    f" non-alphanumeric character(s): [{non_al_num}]"
+                )
 
+        return result
 
-    def ds_meta_exists(self, dataset_name: str) -> bool:
-        out_db_path = self._get_db_path(METADATA_DB_NAME)
-        connection = duckdb.connect(database=out_db_path)
+    def set_storage_info(
+            self,
+            dataset_name: str,
+            storage_type: str,
+            storage_options: Dict[str, Any]
+    ) -> None:
+        """
+        Record how a dataset is stored, replacing any previous entry.
 
-        if not duckdbutils.duckdb_check_table_exists(
-                connection, METADATA_TABLE_NAME
-        ):
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :param storage_type:
+            The storage engine holding the dataset.
+            Options: [duckdb, parquet]
+        :type storage_type: str
+        :param storage_options:
+            Engine specific options needed to read the dataset, such as
+            the partitioning of a parquet dataset. Must be json
+            serializable.
+        :type storage_options: Dict[str, Any]
+        """
+        if storage_type not in VALID_STORAGE_TYPES:
             raise ValueError(
-                f"{METADATA_TABLE_NAME} table does not exist"
-                f" in database {out_db_path}")
+                f"storage type: {storage_type} was not valid."
+                f" Valid storage types are: {VALID_STORAGE_TYPES}"
+            )
 
-        sql = f"""
-                    SELECT count(*)
-                    FROM {METADATA_TABLE_NAME}
-                    WHERE dataset_name = ?
-                """
-        result_raw = connection.execute(sql, [dataset_name]).fetchone()
+        with self._writing() as connection:
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {STORAGE_TABLE_NAME} (
+                    dataset_name    VARCHAR PRIMARY KEY,
+                    storage_type    VARCHAR,
+                    storage_options VARCHAR
+                )
+            """)
+            connection.execute(
+                f"INSERT OR REPLACE INTO {STORAGE_TABLE_NAME}"
+                f" VALUES (?, ?, ?)",
+                [dataset_name, storage_type, json.dumps(storage_options)]
+            )
 
-        return result_raw[0] == 1
+    def get_storage_info(self, dataset_name: str) -> Dict[str, Any]:
+        """
+        Get how a dataset is stored.
 
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :return:
+            A dictionary with keys storage_type and storage_options.
+            Datasets without a storage entry are reported as stored in
+            duckdb, with no options.
+        :rtype: Dict[str, Any]
+        """
+        storage = self._get_catalog().storage.get(dataset_name)
+        if storage is None:
+            return {
+                "storage_type": DEFAULT_STORAGE_TYPE,
+                "storage_options": {}
+            }
+        return {
+            "storage_type": storage[0],
+            "storage_options": json.loads(storage[1])
+        }
 
-    def get_ds_metadata(self, dataset_name: str) -> Dict[str, Any]:
-        out_db_path = self._get_db_path(METADATA_DB_NAME)
-        connection = duckdb.connect(database=out_db_path)
+    def set_dataset_statistics(
+            self,
+            dataset_name: str,
+            statistics: Dict[str, Any]
+    ) -> None:
+        """
+        Store the statistics of a dataset, replacing any stored before.
 
-        if not duckdbutils.duckdb_check_table_exists(
-                connection, METADATA_TABLE_NAME
-        ):
-            raise ValueError(f"{METADATA_TABLE_NAME} table does not exist")
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :param statistics:
+            statistics in the format produced by
+            common.dataset_statistics.compute_statistics
+        :type statistics: Dict[str, Any]
+        """
+        with self._writing() as connection:
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {STATISTICS_TABLE_NAME} (
+                    dataset_name    VARCHAR PRIMARY KEY,
+                    statistics      VARCHAR
+                )
+            """)
+            connection.execute(
+                f"INSERT OR REPLACE INTO {STATISTICS_TABLE_NAME}"
+                f" VALUES (?, ?)",
+                [dataset_name, json.dumps(statistics)]
+            )
 
-        sql = f"""
-           SELECT
-                dataset_name,
-                description,
-                key_columns,
-                value_columns,
-                dataset_type
-           FROM {METADATA_TABLE_NAME}
-           WHERE dataset_name = ?
+    def get_dataset_statistics(
+            self,
+            dataset_name: str
+    ) -> Optional[Dict[str, Any]]:
         """
-        result_raw = connection.execute(sql, [dataset_name]).fetchone()
-
-        result = {
-            "dataset_name": result_raw[0],
-            "description": result_raw[1],
-            "key_columns": result_raw[2],
-            "value_columns": result_raw[3],
-            "dataset_type": result_raw[4]
-        }
+        Get the statistics stored for a dataset.
 
-        col_names: List[str] = result["value_columns"]["key"]
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :return:
+            the statistics, or None for datasets written before statistics
+            were collected
+        :rtype: Optional[Dict[str, Any]]
+        """
+        statistics = self._get_catalog().statistics.get(dataset_name)
+        if statistics is None:
+            return None
+        return json.loads(statistics)
 
-        for c_name in col_names:
-            non_al_num = self._get_non_alphanum_chars(c_name)
-            if len(non_al_num) > 0:
-                raise ValueError(
-                    f"column names must be alphanumeric."
-                    f" column name: [{c_name}] contained"
-                    f" non-alphanumeric character(s): [{non_al_num}]"
+    def bump_dataset_version(self, dataset_name: str) -> int:
+        """
+        Record that a dataset's contents have changed. Called by loaders
+        and output steps after every write to a dataset.
+
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :return: the dataset's new version
+        :rtype: int
+        """
+        with self._writing() as connection:
+            connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {VERSION_TABLE_NAME} (
+                    dataset_name    VARCHAR PRIMARY KEY,
+                    version         BIGINT
                 )
+            """)
+            row = connection.execute(
+                f"SELECT version FROM {VERSION_TABLE_NAME}"
+                f" WHERE dataset_name = ?",
+                [dataset_name]
+            ).fetchone()
+            version = 1 if row is None else row[0] + 1
+            connection.execute(
+                f"INSERT OR REPLACE INTO {VERSION_TABLE_NAME}"
+                f" VALUES (?, ?)",
+                [dataset_name, version]
+            )
+        return version
 
-        return result
+    def get_dataset_version(self, dataset_name: str) -> int:
+        """
+        Get the version of a dataset's contents. Datasets never written
+        since versions were introduced have version 0.
 
+        :param dataset_name: The name of the dataset
+        :type dataset_name: str
+        :return: the dataset's version
+        :rtype: int
+        """
+        return self._get_catalog().versions.get(dataset_name, 0)
+
+    def _get_catalog(self) -> _Catalog:
+        """
+        Get the contents of the metadata database, from memory if it has
+        not changed since last read by this process.
+        """
+        out_db_path = self._get_db_path(METADATA_DB_NAME)
+        key = os.path.abspath(out_db_path)
+        with _metadata_lock:
+            # taken before reading, so that a write made while reading
+            #  causes the next lookup to read again
+            signature = _file_signature(out_db_path)
+            catalog = _catalogs.get(key)
+            if catalog is None or catalog.signature != signature or \
+                    not catalog.trusted:
+                catalog = self._load_catalog(signature)
+                _catalogs[key] = catalog
+            return catalog
+
+    def _load_catalog(self, signature: Tuple) -> _Catalog:
+        # file modification times have a granularity of a few
+        #  milliseconds, so a file modified shortly before it was read
+        #  could be modified again without its signature changing. such
+        #  copies are reread until the file has been unmodified for a while.
+        newest = max([s[0] for s in signature if s is not None], default=0)
+        trusted = newest < time.time_ns() - CATALOG_TRUST_DELAY_NS
+        catalog = _Catalog(signature, trusted)
+        if not os.path.exists(self._get_db_path(METADATA_DB_NAME)):
+            return catalog
+
+        with self._reading() as connection:
+            if duckdbutils.duckdb_check_table_exists(
+                    connection, METADATA_TABLE_NAME):
+                catalog.has_metadata_table = True
+                rows = connection.execute(f"""
+                    SELECT
+                        dataset_name,
+                        description,
+                        key_columns,
+                        value_columns,
+                        dataset_type
+                    FROM {METADATA_TABLE_NAME}
+                """).fetchall()
+                for row in rows:
+                    catalog.entries[row[0]] = {
+                        "dataset_name": row[0],
+                        "description": row[1],
+                        "key_columns": row[2],
+                        "value_columns": row[3],
+                        "dataset_type": row[4]
+                    }
+            if duckdbutils.duckdb_check_table_exists(
+                    connection, STORAGE_TABLE_NAME):
+                rows = connection.execute(
+                    f"SELECT dataset_name, storage_type, storage_options"
+                    f" FROM {STORAGE_TABLE_NAME}").fetchall()
+                catalog.storage = dict((r[0], (r[1], r[2])) for r in rows)
+            if duckdbutils.duckdb_check_table_exists(
+                    connection, VERSION_TABLE_NAME):
+                rows = connection.execute(
+                    f"SELECT dataset_name, version"
+                    f" FROM {VERSION_TABLE_NAME}").fetchall()
+                catalog.versions = dict(rows)
+            if duckdbutils.duckdb_check_table_exists(
+                    connection, STATISTICS_TABLE_NAME):
+                rows = connection.execute(
+                    f"SELECT dataset_name, statistics"
+                    f" FROM {STATISTICS_TABLE_NAME}").fetchall()
+                catalog.statistics = dict(rows)
+        return catalog
+
+    @contextmanager
+    def _reading(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        out_db_path = self._get_db_path(METADATA_DB_NAME)
+        with _metadata_lock:
+            connection = file_lock.retry_with_backoff(
+                lambda: connection_manager.get_reader(out_db_path),
+                (duckdb.IOException,),
+                self.lock_timeout,
+                f"opening metadata database {out_db_path}"
+            )
+            try:
+                yield connection
+            finally:
+                connection.close()
+                # releases the file, so loaders in other processes can
+                #  write to it
+                connection_manager.close(out_db_path)
+
+    @contextmanager
+    def _writing(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        # not reentrant: writing again from within a write raises
+        #  ValueError, as the lock file is already held by this thread
+        out_db_path = self._get_db_path(METADATA_DB_NAME)
+        lock = file_lock.FileLock(
+            self._get_lock_path(), self.lock_timeout, self.stale_lock_after)
+        with _metadata_lock, lock:
+            # other processes may still be reading the file, which blocks
+            #  opening it for writing until they finish
+            connection = file_lock.retry_with_backoff(
+                lambda: connection_manager.get_writer(out_db_path),
+                (duckdb.IOException,),
+                self.lock_timeout,
+                f"opening metadata database {out_db_path} for writing"
+            )
+            try:
+                yield connection
+            finally:
+                connection.close()
+                connection_manager.close(out_db_path)
+                _catalogs.pop(os.path.abspath(out_db_path), None)
 
     def _get_non_alphanum_chars(self, s: str) -> str:
-        char_to_remove = ''.join(filter(lambda x: x.isalnum(), s))
+        char_to_remove = ''.join(
+            filter(lambda x: x.isalnum() or x == "_", s))
         table = str.maketrans("", "", char_to_remove)
         non_alpha = s.translate(table)
         return non_alpha
 
+    def _get_lock_path(self) -> str:
+        return os.path.join(self.database_dir, METADATA_LOCK_NAME)
+
     def _get_db_path(self, db_name: str) -> str:
         return os.path.join(self.database_dir, f"{db_name}.duckdb")
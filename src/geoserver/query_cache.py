@@ -0,0 +1,180 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Tuple
+
+import pyarrow
+import pyarrow.feather
+
+from common.const import LOGGING_FORMAT
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+@dataclass
+class _CacheEntry:
+    # version of the dataset the result was computed from
+    version: int
+    nbytes: int
+    # set for entries held in memory
+    table: Optional[pyarrow.Table] = None
+    # set for entries spilled to disk
+    path: Optional[str] = None
+
+
+class QueryResultCache:
+    """
+    Least recently used cache of query results, bounded by the size of
+    the results in bytes.
+
+    Each result is stored with the version of the dataset it was computed
+    from, and is discarded when read if the dataset's version has changed
+    since. Versions are kept in the metadata database and increased by
+    every loader and output step that writes to a dataset, so results are
+    never served from data that has since been rewritten, including by
+    other processes.
+
+    If spill_dir is set, results evicted from memory are written there as
+    arrow files, up to max_spill_bytes, and read back on a hit instead of
+    rerunning the query.
+    """
+
+    def __init__(
+            self,
+            max_bytes: int = DEFAULT_MAX_BYTES,
+            spill_dir: Optional[str] = None,
+            max_spill_bytes: Optional[int] = None
+    ):
+        """
+        :param max_bytes: maximum total size of results held in memory
+        :type max_bytes: int
+        :param spill_dir:
+            directory to write results evicted from memory to. Results are
+            not spilled if unset.
+        :type spill_dir: Optional[str]
+        :param max_spill_bytes:
+            maximum total size of spilled results. Defaults to 4 times
+            max_bytes.
+        :type max_spill_bytes: Optional[int]
+        """
+        if max_bytes < 0:
+            raise ValueError(f"max_bytes must not be negative, was"
+                             f" {max_bytes}")
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes \
+            if max_spill_bytes is not None else 4 * max_bytes
+        if spill_dir is not None and not os.path.exists(spill_dir):
+            os.makedirs(spill_dir)
+
+        self._lock = threading.RLock()
+        self._memory: OrderedDict[Tuple, _CacheEntry] = OrderedDict()
+        self._spilled: OrderedDict[Tuple, _CacheEntry] = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, version: int) -> Optional[pyarrow.Table]:
+        """
+        Get the cached result for a key, if there is one computed from the
+        given version of its dataset.
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                entry = self._spilled.get(key)
+            if entry is None or entry.version != version:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            if entry.table is not None:
+                self._memory.move_to_end(key)
+                return entry.table
+
+            table = pyarrow.feather.read_table(entry.path)
+            # read back into memory, as it is being used again
+            self._remove(key)
+            self._put_memory(key, _CacheEntry(version, entry.nbytes, table))
+            return table
+
+    def put(self, key: Tuple, version: int, table: pyarrow.Table) -> None:
+        """
+        Cache the result for a key, computed from the given version of its
+        dataset. Results larger than the cache are not cached.
+        """
+        nbytes = table.nbytes
+        with self._lock:
+            self._remove(key)
+            if nbytes > self.max_bytes:
+                logger.info(f"query result of {nbytes} bytes is larger than"
+                            f" the cache and will not be cached")
+                return
+            self._put_memory(key, _CacheEntry(version, nbytes, table))
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._memory.keys()) + \
+                    list(self._spilled.keys()):
+                self._remove(key)
+
+    def size_bytes(self) -> int:
+        """
+        Total size of the results held in memory.
+        """
+        return self._memory_bytes
+
+    def _put_memory(self, key: Tuple, entry: _CacheEntry) -> None:
+        self._memory[key] = entry
+        self._memory_bytes += entry.nbytes
+        while self._memory_bytes > self.max_bytes:
+            old_key, old_entry = self._memory.popitem(last=False)
+            self._memory_bytes -= old_entry.nbytes
+            self._spill(old_key, old_entry)
+
+    def _spill(self, key: Tuple, entry: _CacheEntry) -> None:
+        if self.spill_dir is None or entry.nbytes > self.max_spill_bytes:
+            return
+        path = os.path.join(self.spill_dir, _spill_file_name(key))
+        pyarrow.feather.write_feather(
+            entry.table, path, compression="uncompressed")
+        self._spilled[key] = _CacheEntry(entry.version, entry.nbytes,
+                                         path=path)
+        self._spilled_bytes += entry.nbytes
+        while self._spilled_bytes > self.max_spill_bytes:
+            old_key = next(iter(self._spilled))
+            self._remove(old_key)
+
+    def _remove(self, key: Tuple) -> None:
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= entry.nbytes
+        entry = self._spilled.pop(key, None)
+        if entry is not None:
+            self._spilled_bytes -= entry.nbytes
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _spill_file_name(key: Tuple[Any, ...]) -> str:
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest() + ".arrow"
@@ -0,0 +1,244 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import logging
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import h3
+
+from common.const import LOGGING_FORMAT
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 110
+
+# join the dataset against every cell covering the bounding box
+CELL_SET = "cells"
+# filter the dataset on latitude and longitude only
+RANGE = "range"
+# filter the partitions of a parquet dataset by the coarse cells covering
+#  the bounding box, then filter on latitude and longitude
+PARENT = "parent"
+# read every row, as the bounding box covers the whole dataset
+SCAN = "scan"
+STRATEGIES = [CELL_SET, RANGE, PARENT, SCAN]
+
+# most cells a cell set may hold before listing and joining them costs
+#  more than filtering on latitude and longitude
+DEFAULT_MAX_CELL_SET = 50000
+
+
+@dataclass
+class QueryPlan:
+    strategy: str
+    # why the strategy was chosen
+    reason: str
+    resolution: int
+    # cells covering the bounding box at the query resolution
+    estimated_cells: int
+    # rows in the bounding box, if the dataset's statistics are known
+    estimated_rows: Optional[int]
+    # resolution of the coarse cells filtered on by parent plans
+    parent_resolution: Optional[int] = None
+
+
+class QueryPlanner:
+    """
+    Chooses how a bounding box query reads a dataset, from the number of
+    cells covering the box and the statistics stored for the dataset.
+
+    Listing the cells covering a box and joining the dataset against them
+    costs time in proportion to the number of cells, which grows with the
+    area of the box and the resolution. For large boxes, filtering on
+    latitude and longitude gives the same rows for less, if the dataset's
+    rows are located at their cell's center, as cells are included when
+    their center is in the box. This is only known from the dataset's
+    statistics, so datasets without statistics, and point datasets, are
+    always joined against their cells.
+    """
+
+    def __init__(
+            self,
+            cells_at_resolution: List[int],
+            cells_km2_at_resolution: List[float],
+            max_cell_set: int = DEFAULT_MAX_CELL_SET
+    ):
+        """
+        :param cells_at_resolution: number of cells at each resolution
+        :type cells_at_resolution: List[int]
+        :param cells_km2_at_resolution:
+            average area of a cell at each resolution
+        :type cells_km2_at_resolution: List[float]
+        :param max_cell_set: most cells to join against
+        :type max_cell_set: int
+        """
+        self.cells_at_resolution = cells_at_resolution
+        self.cells_km2_at_resolution = cells_km2_at_resolution
+        self.max_cell_set = max_cell_set
+
+    def plan_bounding_box(
+            self,
+            ds_type: str,
+            resolution: int,
+            box: Tuple[float, float, float, float],
+            stats: Optional[Dict[str, Any]],
+            partition_resolution: Optional[int] = None
+    ) -> QueryPlan:
+        """
+        Plan a bounding box query.
+
+        :param ds_type: the dataset's type
+        :type ds_type: str
+        :param resolution: the resolution of the level being read
+        :type resolution: int
+        :param box: the (min_lat, max_lat, min_long, max_long) box
+        :type box: Tuple[float, float, float, float]
+        :param stats: the dataset's stored statistics, if any
+        :type stats: Optional[Dict[str, Any]]
+        :param partition_resolution:
+            for parquet datasets, the resolution of the cells the dataset
+            is partitioned by
+        :type partition_resolution: Optional[int]
+        :rtype: QueryPlan
+        """
+        cells = self.estimate_cells(resolution, box)
+        rows = self.estimate_rows(resolution, box, stats)
+
+        def plan(strategy: str, reason: str,
+                 parent_res: Optional[int] = None) -> QueryPlan:
+            return QueryPlan(strategy, reason, resolution, cells, rows,
+                             parent_res)
+
+        if ds_type == "point":
+            return plan(CELL_SET, "points are matched by their cell")
+        if stats is None or not stats.get("centroids"):
+            return plan(
+                CELL_SET,
+                "rows are not known to be located at their cell's center")
+        if self._covers_extent(resolution, box, stats):
+            return plan(SCAN, "bounding box covers the dataset's extent")
+        if cells <= self.max_cell_set:
+            return plan(
+                CELL_SET,
+                f"{cells} cells cover the bounding box, at most"
+                f" {self.max_cell_set} are joined")
+        if partition_resolution is not None and \
+                partition_resolution < resolution:
+            parents = self.estimate_cells(
+                partition_resolution,
+                self.widen(partition_resolution, box))
+            if parents <= self.max_cell_set:
+                return plan(
+                    PARENT,
+                    f"{cells} cells cover the bounding box, more than"
+                    f" {self.max_cell_set}, but only {parents} partitions"
+                    f" at resolution {partition_resolution}",
+                    partition_resolution)
+        return plan(
+            RANGE,
+            f"{cells} cells cover the bounding box, more than"
+            f" {self.max_cell_set}")
+
+    def estimate_cells(
+            self,
+            resolution: int,
+            box: Tuple[float, float, float, float]
+    ) -> int:
+        """
+        Estimate the number of cells at a resolution covering a box.
+        """
+        cells = math.ceil(
+            _box_area_km2(box) / self.cells_km2_at_resolution[resolution])
+        return min(cells, self.cells_at_resolution[resolution])
+
+    def estimate_rows(
+            self,
+            resolution: int,
+            box: Tuple[float, float, float, float],
+            stats: Optional[Dict[str, Any]]
+    ) -> Optional[int]:
+        """
+        Estimate the number of rows of a dataset in a box, assuming rows
+        are spread evenly over the dataset's extent.
+        """
+        if stats is None:
+            return None
+        rows = stats.get("resolutions", {}).get(
+            str(resolution), stats.get("row_count"))
+        extent = stats.get("extent")
+        if rows is None or extent is None:
+            return rows
+        min_lat, max_lat, min_long, max_long = box
+        overlap = (
+            max(min_lat, extent["min_lat"]),
+            min(max_lat, extent["max_lat"]),
+            max(min_long, extent["min_long"]),
+            min(max_long, extent["max_long"])
+        )
+        if overlap[0] > overlap[1] or overlap[2] > overlap[3]:
+            return 0
+        extent_area = _box_area_km2((
+            extent["min_lat"], extent["max_lat"],
+            extent["min_long"], extent["max_long"]))
+        if extent_area == 0:
+            return rows
+        return math.ceil(rows * _box_area_km2(overlap) / extent_area)
+
+    @staticmethod
+    def widen(
+            resolution: int,
+            box: Tuple[float, float, float, float]
+    ) -> Tuple[float, float, float, float]:
+        """
+        Widen a box by twice the edge length of cells at a resolution, so
+        it holds the center of every cell containing a point of the box.
+        """
+        min_lat, max_lat, min_long, max_long = box
+        margin_km = 2 * h3.edge_length(resolution, unit="km")
+        lat_margin = margin_km / KM_PER_DEGREE
+        min_lat = max(min_lat - lat_margin, -90.0)
+        max_lat = min(max_lat + lat_margin, 90.0)
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        long_margin = 360.0 if cos_lat <= 0.01 \
+            else margin_km / (KM_PER_DEGREE * cos_lat)
+        return (min_lat, max_lat,
+                max(min_long - long_margin, -180.0),
+                min(max_long + long_margin, 180.0))
+
+    def _covers_extent(
+            self,
+            resolution: int,
+            box: Tuple[float, float, float, float],
+            stats: Optional[Dict[str, Any]]
+    ) -> bool:
+        """
+        Whether every row of a dataset, at any of its levels, is in a box.
+        The extent is widened, as the centers of a level's cells may lie
+        outside the extent of the rows it was computed from.
+        """
+        if stats is None or stats.get("extent") is None:
+            return False
+        extent = stats["extent"]
+        min_lat, max_lat, min_long, max_long = box
+        e_min_lat, e_max_lat, e_min_long, e_max_long = self.widen(
+            resolution,
+            (extent["min_lat"], extent["max_lat"],
+             extent["min_long"], extent["max_long"]))
+        return min_lat <= e_min_lat and max_lat >= e_max_lat and \
+            min_long <= e_min_long and max_long >= e_max_long
+
+
+def _box_area_km2(box: Tuple[float, float, float, float]) -> float:
+    min_lat, max_lat, min_long, max_long = box
+    mid_lat = math.radians((min_lat + max_lat) / 2)
+    height = (max_lat - min_lat) * KM_PER_DEGREE
+    width = (max_long - min_long) * KM_PER_DEGREE * math.cos(mid_lat)
+    return max(height, 0.0) * max(width, 0.0)
@@ -0,0 +1,55 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+from dataclasses import dataclass
+from typing import Any, Hashable, List, Sequence, Tuple, Union
+
+
+@dataclass(frozen=True)
+class TimeRange:
+    """
+    An inclusive range of years, months or days, such as
+    TimeRange(2010, 2019) for a decade of years.
+    """
+    start: int
+    end: int
+
+    def __post_init__(self):
+        if self.start > self.end:
+            raise ValueError(
+                f"time range start {self.start} is after its end"
+                f" {self.end}")
+
+
+# a filter on a year, month or day key column: a single value, an
+#  inclusive range of values, or an explicit list of values
+TimeValue = Union[int, TimeRange, Sequence[int]]
+
+
+def get_filter(column: str, value: TimeValue) -> Tuple[str, List[Any]]:
+    """
+    Get the sql condition, with its parameters, selecting the rows whose
+    column matches a time value.
+    """
+    if isinstance(value, TimeRange):
+        return f"{column} BETWEEN ? AND ?", [value.start, value.end]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = sorted(value)
+        if len(values) == 0:
+            raise ValueError(f"no values were given to filter {column} by")
+        placeholders = ", ".join("?" for _ in values)
+        return f"{column} IN ({placeholders})", values
+    return f"{column} = ?", [value]
+
+
+def to_key(value: Any) -> Hashable:
+    """
+    Get a hashable form of a time value, for use in cache keys.
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return ("in",) + tuple(sorted(value))
+    return value
@@ -8,19 +8,28 @@
 import logging
 import os
 from abc import ABC, abstractmethod
-from typing import List, Optional, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import duckdb
-import h3
 import pandas
 from pandas import DataFrame
 
-from common import duckdbutils
-from loader import interpolator
+from common import connection_manager, dataset_statistics, duckdbutils, \
+    dataset_utilities, const
+from geoserver.metadata import MetadataDB
+from loader import interpolator, clustering
 
 LOADING_MODES = [
     "insert",
-    "create"
+    "create",
+    "merge"
+]
+
+# how time slices that already exist in a table are handled in insert mode
+OVERLAP_HANDLING_OPTIONS = [
+    "append",
+    "skip",
+    "error"
 ]
 
 # Set up logging
@@ -58,8 +67,22 @@ class AbstractLoaderConfig(ABC):
 
     mode: str
 
+    # in merge mode, whether to delete stored cells that are not present
+    #  in the reloaded data, within the time periods being reloaded
+    delete_missing: bool = False
+
+    # in insert mode, what to do with time slices of the input that are
+    #  already present in the dataset. "append" inserts every row,
+    #  "skip" loads only the new slices, "error" rejects the load.
+    overlap_handling: str = "append"
+
     max_parallelism: int = 4
 
+    # whether to compute statistics of the dataset after loading and
+    #  store them in the metadata database. Off by default, as it requires
+    #  a scan of the whole dataset after loading.
+    collect_statistics: bool = False
+
     def get_time_cols(self) -> List[str]:
         acc = [self.year_column, self.month_column, self.day_column]
         return list(filter(
@@ -78,6 +101,14 @@ class AbstractLoader(ABC):
     def get_config(self) -> AbstractLoaderConfig:
         pass
 
+    def get_raw_dataset_chunks(self) -> Iterator[DataFrame]:
+        """
+        Returns the raw dataset as a sequence of DataFrames. Loaders able
+        to stream their input can override this so that point datasets
+        are written without materializing the whole input.
+        """
+        yield self.get_raw_dataset()
+
     @abstractmethod
     def load(self) -> None:
         pass
@@ -129,74 +160,224 @@ class AbstractLoader(ABC):
                 f"loading mode {conf.mode} is not valid. valid modes are "
                 f"{LOADING_MODES}"
             )
+        if conf.overlap_handling not in OVERLAP_HANDLING_OPTIONS:
+            raise ValueError(
+                f"overlap_handling {conf.overlap_handling} is not valid."
+                f" valid options are {OVERLAP_HANDLING_OPTIONS}"
+            )
+        if conf.mode == "merge" and conf.dataset_type != "h3":
+            raise ValueError(
+                f"loading mode merge is only supported for h3 datasets."
+                f" dataset type was {conf.dataset_type}"
+            )
 
 
 
     def to_h3_dataset(self, mode: str):
         logger.info("loading dataset as h3 dataset")
+        meta = self.get_config()
+        # fail before interpolating if the dataset could not be registered
+        MetadataDB(meta.database_dir).check_writable()
 
         dataset = self.get_raw_dataset()
         # dataset assumed to have longitude, latitude columns
 
-        meta = self.get_config()
         intplr = interpolator.Interpolator(geo_out_db_dir=meta.database_dir)
 
-        for resolution in range(0, meta.max_resolution + 1):
-            table_name = meta.dataset_name + f"_{resolution}"
-            db_name = meta.dataset_name + ".duckdb"
-            db_path = os.path.join(meta.database_dir, db_name)
-            connection = duckdb.connect(database=db_path)
-            exists = duckdbutils.duckdb_check_table_exists(
-                connection, table_name)
+        if mode == "insert" and meta.overlap_handling == "error":
+            # checked for every resolution before anything is written, so
+            #  a rejected load leaves the dataset unchanged
+            self._check_no_time_slice_overlap(dataset)
 
-            sql = ""
-            if exists:
-                if mode == "create":
-                    raise ValueError(
-                        f"table {table_name} already exists."
-                        f"cannot insert into table in 'create' mode")
-                elif mode == "insert":
-                    if len(meta.get_time_cols()) == 0:
-                        # TODO: also check that if time cols are present,
-                        #  that the data does not overlap existing values
+        db_name = meta.dataset_name + ".duckdb"
+        db_path = os.path.join(meta.database_dir, db_name)
+        connection = connection_manager.get_writer(db_path)
+        try:
+            for resolution in range(0, meta.max_resolution + 1):
+                table_name = meta.dataset_name + f"_{resolution}"
+                exists = duckdbutils.duckdb_check_table_exists(
+                    connection, table_name)
+
+                sql = ""
+                this_res_ds = dataset
+                if exists:
+                    if mode == "create":
                         raise ValueError(
-                            "Cannot insert into a h3 dataset without specifying"
-                            " at least one time column."
-                        )
-                    sql = f"INSERT INTO {table_name} BY NAME" \
-                          f" SELECT * FROM interpolated"
-            else:
-                sql = f"CREATE TABLE {table_name}" \
-                      f" as select * from interpolated"
-
-            this_res_ds = pandas.DataFrame(dataset)  # copy to prevent changes
-            shapefile, region = self._get_shapefile_info()
-
-            logger.info(f"interpolating for resolution: {resolution}")
-            # IDE says this is unused, but it is referred to by name in the sql
-            #  variable, which is able to find it by name
-            interpolated = intplr.interpolate_df(
-                input_data=this_res_ds,
-                cols_to_interpolate=meta.data_columns,
-                time_cols=meta.get_time_cols(),
-                resolution=resolution,
-                num_neighbors=DEFAULT_NUM_NEIGHBORS,
-                power=DEFAULT_POWER,
-                shapefile=shapefile,
-                region=region,
-                max_parallelism=meta.max_parallelism
-            )
-            if interpolated.columns is None or len(interpolated.columns) == 0:
-                # handle case here where nothing returned due to shapefile reasons
-                #  can happen with small regions at very low resolutions
-                logger.warning("could not generate interpolation for"
-                               f"resolution {resolution}")
-            else:
-                connection.sql(
-                    sql
+                            f"table {table_name} already exists."
+                            f"cannot insert into table in 'create' mode")
+                    elif mode == "insert":
+                        if len(meta.get_time_cols()) == 0:
+                            raise ValueError(
+                                "Cannot insert into a h3 dataset without specifying"
+                                " at least one time column."
+                            )
+                        if meta.overlap_handling == "skip":
+                            this_res_ds = self._remove_existing_time_slices(
+                                connection, table_name, dataset)
+                        if len(this_res_ds) == 0:
+                            logger.info(f"all time slices already present in"
+                                        f" {table_name}. skipping resolution"
+                                        f" {resolution}")
+                            continue
+                        sql = f"INSERT INTO {table_name} BY NAME" \
+                              f" SELECT * FROM interpolated"
+                    elif mode == "merge":
+                        sql = None
+                else:
+                    sql = f"CREATE TABLE {table_name}" \
+                          f" as select * from interpolated"
+
+                # copy to prevent changes
+                this_res_ds = pandas.DataFrame(this_res_ds)
+                shapefile, region = self._get_shapefile_info()
+
+                logger.info(f"interpolating for resolution: {resolution}")
+                # IDE says this is unused, but it is referred to by name in the sql
+                #  variable, which is able to find it by name
+                interpolated = intplr.interpolate_df(
+                    input_data=this_res_ds,
+                    cols_to_interpolate=meta.data_columns,
+                    time_cols=meta.get_time_cols(),
+                    resolution=resolution,
+                    num_neighbors=DEFAULT_NUM_NEIGHBORS,
+                    power=DEFAULT_POWER,
+                    shapefile=shapefile,
+                    region=region,
+                    max_parallelism=meta.max_parallelism
                 )
+                if interpolated.columns is None or len(interpolated.columns) == 0:
+                    # handle case here where nothing returned due to shapefile reasons
+                    #  can happen with small regions at very low resolutions
+                    logger.warning("could not generate interpolation for"
+                                   f"resolution {resolution}")
+                    continue
+
+                interpolated = clustering.sort_for_storage(
+                    interpolated, meta.get_time_cols())
+                if sql is None:
+                    self._merge_h3_table(connection, table_name, interpolated)
+                else:
+                    connection.sql(
+                        sql
+                    )
+
+            statistics = None
+            if meta.collect_statistics:
+                statistics = self._compute_h3_statistics(connection)
+        finally:
+            connection.close()
+
+        meta_db = MetadataDB(meta.database_dir)
+        if statistics is not None:
+            meta_db.set_dataset_statistics(meta.dataset_name, statistics)
+        meta_db.bump_dataset_version(meta.dataset_name)
+
+    def _compute_h3_statistics(
+            self,
+            connection: duckdb.DuckDBPyConnection
+    ) -> Optional[Dict[str, Any]]:
+        # extent and value distributions are taken from the finest
+        #  resolution, which has the most detail
+        meta = self.get_config()
+        resolution_counts = {}
+        for resolution in range(0, meta.max_resolution + 1):
+            table_name = meta.dataset_name + f"_{resolution}"
+            if duckdbutils.duckdb_check_table_exists(connection, table_name):
+                resolution_counts[resolution] = \
+                    dataset_statistics.count_rows(connection, table_name)
+        if len(resolution_counts) == 0:
+            return None
+        finest = meta.dataset_name + f"_{max(resolution_counts)}"
+        return dataset_statistics.compute_statistics(
+            connection, finest, meta.get_time_cols(), resolution_counts)
+
+    def _get_existing_time_slices(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str
+    ) -> DataFrame:
+        time_cols = self.get_config().get_time_cols()
+        col_str = ", ".join(time_cols)
+        return connection.execute(
+            f"SELECT DISTINCT {col_str} FROM {table_name}"
+        ).df()
+
+    def _remove_existing_time_slices(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str,
+            dataset: DataFrame
+    ) -> DataFrame:
+        """
+        Remove rows of the input whose time slice (combination of time
+        column values) is already present in the table, so that only new
+        slices are interpolated.
+        """
+        time_cols = self.get_config().get_time_cols()
+        existing = self._get_existing_time_slices(connection, table_name)
+        if len(existing) == 0:
+            return dataset
+
+        slice_keys = pandas.MultiIndex.from_frame(dataset[time_cols])
+        existing_keys = pandas.MultiIndex.from_frame(existing[time_cols])
+        is_new = ~slice_keys.isin(existing_keys)
+
+        num_skipped = len(dataset) - int(is_new.sum())
+        if num_skipped > 0:
+            logger.info(f"skipping {num_skipped} input rows whose time slice"
+                        f" is already present in {table_name}")
+        return dataset[is_new]
+
+    def _check_no_time_slice_overlap(self, dataset: DataFrame):
+        meta = self.get_config()
+        time_cols = meta.get_time_cols()
+        if len(time_cols) == 0:
+            return
+
+        db_path = os.path.join(
+            meta.database_dir, meta.dataset_name + ".duckdb")
+        connection = connection_manager.get_writer(db_path)
+        try:
+            for resolution in range(0, meta.max_resolution + 1):
+                table_name = meta.dataset_name + f"_{resolution}"
+                if not duckdbutils.duckdb_check_table_exists(
+                        connection, table_name):
+                    continue
+                new_rows = self._remove_existing_time_slices(
+                    connection, table_name, dataset)
+                if len(new_rows) < len(dataset):
+                    overlap = dataset[time_cols].drop_duplicates() \
+                        .merge(self._get_existing_time_slices(
+                            connection, table_name), on=time_cols)
+                    raise ValueError(
+                        f"time slices {overlap.values.tolist()} for columns"
+                        f" {time_cols} are already present in table"
+                        f" {table_name}")
+        finally:
+            connection.close()
 
-
+    def _merge_h3_table(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str,
+            interpolated: DataFrame
+    ):
+        conf = self.get_config()
+        time_cols = conf.get_time_cols()
+        connection.execute(
+            "CREATE OR REPLACE TEMP TABLE merge_staging AS"
+            " SELECT * FROM interpolated"
+        )
+        counts = duckdbutils.merge_into_table(
+            connection,
+            table_name,
+            "merge_staging",
+            time_cols + [const.CELL_COL],
+            delete_missing=conf.delete_missing,
+            delete_scope_cols=time_cols
+        )
+        connection.execute("DROP TABLE merge_staging")
+        logger.info(f"merged into {table_name}: {counts}")
 
     def to_point_dataset(
             self,
@@ -204,41 +385,73 @@ class AbstractLoader(ABC):
     ):
         logger.info("loading dataset as point dataset")
         meta = self.get_config()
-        dataset = self.get_raw_dataset()
+        MetadataDB(meta.database_dir).check_writable()
         # dataset assumed to have latitude, longitude columns
 
         table_name = meta.dataset_name
 
         db_name = meta.dataset_name + ".duckdb"
         db_path = os.path.join(meta.database_dir, db_name)
-        connection = duckdb.connect(database=db_path)
-
-        exists = duckdbutils.duckdb_check_table_exists(
-            connection, table_name)
-        sql = ""
-        if exists:
-            if mode == "create":
+        connection = connection_manager.get_writer(db_path)
+        try:
+            exists = duckdbutils.duckdb_check_table_exists(
+                connection, table_name)
+            if exists and mode == "create":
                 raise ValueError(
                     f"table {table_name} already exists."
                     f"cannot insert into table in 'create' mode")
-            elif mode == "insert":
-                sql = f"INSERT INTO {table_name} BY NAME" \
-                      f" SELECT * FROM dataset"
-        else:
-            sql = f"CREATE TABLE {table_name}" \
-                  f" as select * from dataset"
 
-        for resolution in range(0, meta.max_resolution + 1):
-            logger.info(f"getting cells for res {resolution}")
-            cell_col = f"res{resolution}"
-
-            def to_cell(row):
-                lat = row['latitude']
-                long = row['longitude']
-                return h3.geo_to_h3(lat, long, resolution)
-
-            dataset[cell_col] = dataset.apply(to_cell, axis='columns')
-
-        connection.sql(
-            sql
-        )
+            # chunks are written in one transaction, so a chunk failing to
+            #  load leaves the table as it was before the load
+            connection.begin()
+            try:
+                num_chunks = 0
+                for dataset in self.get_raw_dataset_chunks():
+                    for resolution in range(0, meta.max_resolution + 1):
+                        logger.info(f"getting cells for res {resolution}")
+                        cell_col = f"res{resolution}"
+                        dataset[cell_col] = dataset_utilities.get_cells(
+                            dataset['latitude'],
+                            dataset['longitude'],
+                            resolution
+                        )
+                    dataset = clustering.sort_for_storage(
+                        dataset, meta.get_time_cols())
+
+                    if exists:
+                        sql = f"INSERT INTO {table_name} BY NAME" \
+                              f" SELECT * FROM dataset"
+                    else:
+                        sql = f"CREATE TABLE {table_name}" \
+                              f" as select * from dataset"
+                        exists = True
+
+                    connection.sql(
+                        sql
+                    )
+                    num_chunks += 1
+
+                if num_chunks > 1:
+                    # each chunk is only sorted within itself, so the
+                    #  table is rewritten to cluster it as a whole
+                    logger.info(f"reclustering {table_name} after loading"
+                                f" {num_chunks} chunks")
+                    clustering.recluster_table(
+                        connection, table_name, meta.get_time_cols(),
+                        transaction=False)
+            except Exception:
+                connection.rollback()
+                raise
+            connection.commit()
+
+            statistics = None
+            if meta.collect_statistics and exists:
+                statistics = dataset_statistics.compute_statistics(
+                    connection, table_name, meta.get_time_cols())
+        finally:
+            connection.close()
+
+        meta_db = MetadataDB(meta.database_dir)
+        if statistics is not None:
+            meta_db.set_dataset_statistics(meta.dataset_name, statistics)
+        meta_db.bump_dataset_version(meta.dataset_name)
@@ -0,0 +1,166 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import logging
+import os
+import re
+from typing import List
+
+import duckdb
+from pandas import DataFrame
+
+from common import connection_manager, dataset_utilities
+from common.const import CELL_COL, LATITUDE_COL, LONGITUDE_COL, \
+    LOGGING_FORMAT
+from geoserver.metadata import MetadataDB
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# Rows are stored ordered by key columns (ex. year, month, day), then by
+#  location. Each duckdb row group then covers a small range of times and
+#  a compact region, so its min/max statistics let queries on a time or
+#  bounding box skip most row groups.
+
+
+def sort_for_storage(df: DataFrame, key_cols: List[str]) -> DataFrame:
+    """
+    Sort a DataFrame into the order it should be stored in: by the key
+    columns, then by h3 cell, or by the Hilbert key of latitude/longitude
+    if there is no cell column.
+    """
+    sort_cols = [c for c in key_cols if c in df.columns]
+    if CELL_COL in df.columns:
+        return df.sort_values(sort_cols + [CELL_COL], ignore_index=True)
+    if LATITUDE_COL not in df.columns or LONGITUDE_COL not in df.columns:
+        return df.sort_values(sort_cols, ignore_index=True) \
+            if len(sort_cols) > 0 else df
+
+    hilbert = dataset_utilities.get_hilbert_keys(
+        df[LATITUDE_COL], df[LONGITUDE_COL])
+    order = DataFrame(
+        dict([(c, df[c].values) for c in sort_cols] +
+             [("__hilbert", hilbert)])
+    ).sort_values(sort_cols + ["__hilbert"], kind="stable").index
+    return df.iloc[order].reset_index(drop=True)
+
+
+def recluster_dataset(database_dir: str, dataset_name: str) -> List[str]:
+    """
+    Rewrite every table of a stored dataset in clustered order. Used for
+    datasets written before writers clustered their output, or after
+    many inserts have each been clustered separately. Table definitions,
+    constraints and indexes are preserved.
+
+    :return: the names of the tables that were reclustered
+    :rtype: List[str]
+    """
+    meta_db = MetadataDB(database_dir)
+    if not meta_db.ds_meta_exists(dataset_name):
+        raise ValueError(f"dataset {dataset_name} not registered"
+                         f" in metadata.")
+    meta = meta_db.get_ds_metadata(dataset_name)
+    key_cols = [
+        c for c in meta["key_columns"]["key"]
+        if not dataset_utilities.is_cell_col(c)
+        and c not in [LATITUDE_COL, LONGITUDE_COL]
+    ]
+
+    db_path = os.path.join(database_dir, dataset_name + ".duckdb")
+    if not os.path.exists(db_path):
+        raise ValueError(f"database {db_path} for dataset {dataset_name}"
+                         f" does not exist")
+    connection = connection_manager.get_writer(db_path)
+    try:
+        tables = [
+            r[0] for r in connection.execute(
+                "SELECT table_name FROM duckdb_tables()").fetchall()
+            if r[0] == dataset_name or
+            re.fullmatch(f"{re.escape(dataset_name)}_[0-9]+", r[0])
+        ]
+        for table_name in tables:
+            logger.info(f"reclustering table {table_name}")
+            recluster_table(connection, table_name, key_cols)
+    finally:
+        connection.close()
+    return tables
+
+
+def recluster_table(
+        connection: duckdb.DuckDBPyConnection,
+        table_name: str,
+        key_cols: List[str],
+        transaction: bool = True
+) -> None:
+    """
+    Rewrite a table in clustered order, within a single transaction. The
+    table is recreated from its original definition, so constraints are
+    kept, and its indexes are rebuilt afterwards.
+
+    :param transaction:
+        whether to run the rewrite in its own transaction. False if the
+        caller has already begun a transaction the rewrite is part of.
+    :type transaction: bool
+    """
+    table_sql = connection.execute(
+        "SELECT sql FROM duckdb_tables() WHERE table_name = ?",
+        [table_name]
+    ).fetchone()[0]
+    index_sqls = [
+        r[0] for r in connection.execute(
+            "SELECT sql FROM duckdb_indexes() WHERE table_name = ?",
+            [table_name]
+        ).fetchall()
+    ]
+    columns = [
+        r[0] for r in
+        connection.execute(f"DESCRIBE {table_name}").fetchall()
+    ]
+    order_cols = [f't."{c}"' for c in key_cols if c in columns]
+
+    tmp_table = f"{table_name}__recluster"
+    if transaction:
+        connection.begin()
+    try:
+        if CELL_COL in columns:
+            connection.execute(
+                f"CREATE TABLE {tmp_table} AS SELECT t.* FROM {table_name} t"
+                f" ORDER BY {', '.join(order_cols + [f't.{CELL_COL}'])}"
+            )
+        else:
+            points = connection.execute(
+                f"SELECT rowid AS row_id, {LATITUDE_COL}, {LONGITUDE_COL}"
+                f" FROM {table_name}"
+            ).df()
+            hilbert_keys = DataFrame({
+                "row_id": points["row_id"],
+                "hilbert": dataset_utilities.get_hilbert_keys(
+                    points[LATITUDE_COL], points[LONGITUDE_COL])
+            })
+            connection.register("hilbert_keys", hilbert_keys)
+            connection.execute(
+                f"CREATE TABLE {tmp_table} AS SELECT t.* FROM {table_name} t"
+                f" JOIN hilbert_keys h ON t.rowid = h.row_id"
+                f" ORDER BY {', '.join(order_cols + ['h.hilbert'])}"
+            )
+            connection.unregister("hilbert_keys")
+
+        connection.execute(f"DROP TABLE {table_name}")
+        connection.execute(table_sql)
+        connection.execute(
+            f"INSERT INTO {table_name} SELECT * FROM {tmp_table}")
+        connection.execute(f"DROP TABLE {tmp_table}")
+        for index_sql in index_sqls:
+            connection.execute(index_sql)
+    except Exception:
+        if transaction:
+            connection.rollback()
+        raise
+    if transaction:
+        connection.commit()
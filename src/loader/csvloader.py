@@ -5,20 +5,21 @@
 # https://opensource.org/licenses/MIT.
 #
 # Created: 2024-03-08 by davis.broda@brodagroupsoftware.com
-import csv
+import logging
 import os.path
 from dataclasses import dataclass
-from typing import List, Dict
+from typing import Dict, Iterator, Optional
 
 from pandas import DataFrame
 
+from common import csvutils
+from common.csvutils import SUPPORTED_DATA_TYPES
 from loader.abstract_loader import AbstractLoaderConfig, AbstractLoader
 
-SUPPORTED_DATA_TYPES = [
-    "float",
-    "str",
-    "int"
-]
+# Set up logging
+LOGGING_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -33,7 +34,9 @@ class CSVLoaderConfig(AbstractLoaderConfig):
 
     columns: Dict[str, str]  # list of column names in order, mapped to type
 
-    pass
+    # when set, point datasets are streamed into the database in chunks of
+    #  roughly this many rows instead of being loaded into memory at once
+    chunk_size: Optional[int] = None
 
 
 class CSVLoader(AbstractLoader):
@@ -60,39 +63,21 @@ class CSVLoader(AbstractLoader):
 
     def load(self) -> None:
         conf = self.get_config()
-        out: List[Dict] = []
-        with open(conf.file_path) as csvfile:
-            reader = csv.reader(csvfile)
-            is_first = True
-            for row in reader:
-                if conf.has_header_row and is_first:
-                    # skip header row
-                    is_first = False
-                    continue
-                else:
-                    is_first = False
-
-                if len(row) != len(conf.columns):
-                    raise ValueError(
-                        f"configuration expects {len(conf.columns)} columns,"
-                        f" but row had {len(row)} columns."
-                    )
-                zipped = zip(conf.columns.keys(), list(row))
-
-                row_as_dict = {}
-                for name, s in zipped:
-                    row_as_dict[name] = self._cast_str_to_type(
-                        s,
-                        conf.columns[name]
-                    )
-
-                out.append(row_as_dict)
-
-        # IDE says that type is wrong. It is not.
-        # noinspection PyTypeChecker
-        dataset = DataFrame.from_dict(out)
-
-        self.dataset = dataset
+
+        if conf.chunk_size is not None and conf.dataset_type == "point":
+            logger.info(f"streaming {conf.file_path} in chunks of"
+                        f" {conf.chunk_size} rows")
+            self.dataset = None
+        else:
+            if conf.chunk_size is not None:
+                logger.info("chunk_size is ignored for h3 datasets, as"
+                            " interpolation requires the full dataset")
+            self.dataset = csvutils.read_typed_csv(
+                conf.file_path,
+                conf.columns,
+                conf.has_header_row,
+                conf.max_parallelism
+            )
 
         if conf.dataset_type == "h3":
             super().to_h3_dataset(conf.mode)
@@ -110,13 +95,11 @@ class CSVLoader(AbstractLoader):
                 f"file {conf.file_path} is a directory, not a file"
             )
 
-        for name, col_type in conf.columns.items():
-            if col_type not in SUPPORTED_DATA_TYPES:
-                raise ValueError(
-                    f"column type {col_type} for column {name}"
-                    f" is not a supported type. supported types are"
-                    f" {SUPPORTED_DATA_TYPES}"
-                )
+        csvutils.validate_column_types(conf.columns)
+
+        if conf.chunk_size is not None and conf.chunk_size < 1:
+            raise ValueError(
+                f"chunk_size must be at least 1, was {conf.chunk_size}")
 
         for column_name in conf.data_columns:
             if column_name not in conf.columns.keys():
@@ -134,23 +117,15 @@ class CSVLoader(AbstractLoader):
                 " attempting to use the dataset.")
         return self.dataset
 
-    def _cast_str_to_type(
-            self,
-            s: str,
-            type_str: str
-    ):
-        if type_str not in SUPPORTED_DATA_TYPES:
-            raise ValueError(
-                f"cannot cast str to {type_str} as type is unsupported."
-                f" supported types are {SUPPORTED_DATA_TYPES}"
+    def get_raw_dataset_chunks(self) -> Iterator[DataFrame]:
+        conf = self.get_config()
+        if self.dataset is None and conf.chunk_size is not None:
+            yield from csvutils.read_typed_csv_chunks(
+                conf.file_path,
+                conf.columns,
+                conf.has_header_row,
+                conf.chunk_size,
+                conf.max_parallelism
             )
-        if type_str == "str":
-            return s
-        elif type_str == "int":
-            return int(s)
-        elif type_str == "float":
-            return float(s)
         else:
-            raise ValueError(
-                f"conversion of supported type {type_str} not yet implemented"
-            )
+            yield self.get_raw_dataset()
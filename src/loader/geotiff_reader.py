@@ -6,14 +6,17 @@
 #
 # Created: 2024-07-17 by 15205060+DavisBroda@users.noreply.github.com
 import logging
+import math
 import os
 from dataclasses import dataclass
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Any, Tuple
 
 import geopandas
 import numpy
 import pandas
 import rasterio
+import rasterio.warp
+import rasterio.windows
 import xarray
 from geopandas import GeoDataFrame
 from pandas import DataFrame
@@ -135,3 +138,230 @@ class GeotiffReader(ReadingStep):
             (geo['longitude'] < self.conf.max_long)
             ]
         return out
+
+
+@dataclass
+class MultiGeotiffReaderConf:
+    def __init__(self, **entries):
+        self.__dict__.update(entries)
+
+    # list of rasters to read. Each entry contains a 'file_path' and a
+    #  'data_field', and optionally a 1-based 'band' (default 1). The same
+    #  file may be listed multiple times with different bands.
+    rasters: List[Dict[str, Any]]
+
+    min_lat: float = -90
+    max_lat: float = 90
+    min_long: float = -180
+    max_long: float = 180
+
+    # number of raster rows read per window
+    window_rows: int = 1024
+
+
+class MultiGeotiffReader(ReadingStep):
+    """
+    Reads several rasters (or several bands of a raster) that share the
+    same grid in a single windowed pass, producing one value column per
+    raster. Pixels are kept if at least one raster has data at that
+    location; rasters without data at a kept pixel have a NaN value.
+    """
+
+    def __init__(self, conf_dict: Dict[str, Any]):
+        self.conf = MultiGeotiffReaderConf(**conf_dict)
+        self.validate_conf(self.conf)
+
+    def validate_conf(self, conf: MultiGeotiffReaderConf):
+        if conf.rasters is None or len(conf.rasters) == 0:
+            raise ValueError(
+                "rasters was not provided. rasters is a mandatory"
+                " parameter for MultiGeotiffReader")
+
+        fields = set()
+        for raster in conf.rasters:
+            for param in ("file_path", "data_field"):
+                if param not in raster:
+                    raise ValueError(
+                        f"raster entry {raster} is missing mandatory"
+                        f" parameter '{param}'")
+            if not os.path.exists(raster["file_path"]):
+                raise ValueError(
+                    f"file {raster['file_path']} specified in"
+                    f" MultiGeotiffReader conf does not exist"
+                )
+            if raster["data_field"] in fields:
+                raise ValueError(
+                    f"data_field {raster['data_field']} is used by more than"
+                    f" one raster in MultiGeotiffReader conf")
+            fields.add(raster["data_field"])
+
+        if conf.window_rows < 1:
+            raise ValueError(
+                f"window_rows must be at least 1, was {conf.window_rows}")
+
+    def read(self) -> DataFrame:
+        paths = list(dict.fromkeys(r["file_path"] for r in self.conf.rasters))
+        datasets = {}
+        try:
+            for path in paths:
+                logger.info(f"opening geotiff file {path}")
+                datasets[path] = rasterio.open(path)
+            self._validate_shared_grid(datasets)
+            out = self._read_windows(datasets)
+        finally:
+            for dataset in datasets.values():
+                dataset.close()
+        return out
+
+    def get_data_cols(self) -> List[str]:
+        return [r["data_field"] for r in self.conf.rasters]
+
+    def get_key_cols(self) -> List[str]:
+        return []
+
+    def _validate_shared_grid(
+            self,
+            datasets: Dict[str, rasterio.DatasetReader]
+    ) -> None:
+        first_path, first = next(iter(datasets.items()))
+        for path, dataset in datasets.items():
+            if dataset.width != first.width or \
+                    dataset.height != first.height or \
+                    dataset.transform != first.transform or \
+                    dataset.crs != first.crs:
+                raise ValueError(
+                    f"geotiff {path} does not share the same grid as"
+                    f" {first_path}. All rasters read by MultiGeotiffReader"
+                    f" must have the same dimensions, transform and crs.")
+
+        for raster in self.conf.rasters:
+            band = raster.get("band", 1)
+            count = datasets[raster["file_path"]].count
+            if band < 1 or band > count:
+                raise ValueError(
+                    f"band {band} requested for {raster['file_path']}, but"
+                    f" file only has {count} band(s)")
+
+    def _get_window(
+            self,
+            dataset: rasterio.DatasetReader
+    ) -> rasterio.windows.Window:
+        full = rasterio.windows.Window(0, 0, dataset.width, dataset.height)
+        try:
+            bounds = rasterio.warp.transform_bounds(
+                "EPSG:4326", dataset.crs,
+                self.conf.min_long, self.conf.min_lat,
+                self.conf.max_long, self.conf.max_lat
+            )
+        except Exception as e:
+            logger.info(f"could not project bounding box into raster crs,"
+                        f" reading full raster: {e}")
+            return full
+
+        if not all(numpy.isfinite(bounds)):
+            return full
+
+        window = rasterio.windows.from_bounds(*bounds, dataset.transform)
+        col_start = max(0, math.floor(window.col_off))
+        row_start = max(0, math.floor(window.row_off))
+        col_stop = min(dataset.width,
+                       math.ceil(window.col_off + window.width))
+        row_stop = min(dataset.height,
+                       math.ceil(window.row_off + window.height))
+        if col_stop <= col_start or row_stop <= row_start:
+            # bounding box does not overlap the raster
+            return rasterio.windows.Window(0, 0, 0, 0)
+        return rasterio.windows.Window(
+            col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+    def _read_windows(
+            self,
+            datasets: Dict[str, rasterio.DatasetReader]
+    ) -> DataFrame:
+        first = next(iter(datasets.values()))
+        window = self._get_window(first)
+        logger.info(f"reading {len(self.conf.rasters)} rasters over"
+                    f" window {window}")
+
+        parts = []
+        row_stop = window.row_off + window.height
+        for row_start in range(window.row_off, row_stop,
+                               self.conf.window_rows):
+            sub_window = rasterio.windows.Window(
+                window.col_off,
+                row_start,
+                window.width,
+                min(self.conf.window_rows, row_stop - row_start)
+            )
+            part = self._read_single_window(datasets, sub_window)
+            if len(part) > 0:
+                parts.append(part)
+
+        if len(parts) == 0:
+            columns = self.get_data_cols() + \
+                [const.LONGITUDE_COL, const.LATITUDE_COL]
+            return pandas.DataFrame(columns=columns)
+        return pandas.concat(parts, ignore_index=True)
+
+    def _read_single_window(
+            self,
+            datasets: Dict[str, rasterio.DatasetReader],
+            window: rasterio.windows.Window
+    ) -> DataFrame:
+        values: Dict[str, numpy.ndarray] = {}
+        any_valid = None
+        for raster in self.conf.rasters:
+            dataset = datasets[raster["file_path"]]
+            band = raster.get("band", 1)
+            data, valid = self._read_band(dataset, band, window)
+            values[raster["data_field"]] = numpy.where(valid, data, numpy.nan)
+            any_valid = valid if any_valid is None else any_valid | valid
+
+        y_indices, x_indices = numpy.where(any_valid)
+        if len(y_indices) == 0:
+            return pandas.DataFrame()
+
+        trans = next(iter(datasets.values())).transform
+        crs = next(iter(datasets.values())).crs
+        x, y = trans * (x_indices + window.col_off, y_indices + window.row_off)
+        longs, lats = self._to_epsg_4326(crs, x, y)
+
+        out = pandas.DataFrame(
+            {f: v[y_indices, x_indices] for f, v in values.items()}
+        )
+        out[const.LONGITUDE_COL] = longs
+        out[const.LATITUDE_COL] = lats
+
+        return out[
+            (out[const.LATITUDE_COL] > self.conf.min_lat) &
+            (out[const.LATITUDE_COL] < self.conf.max_lat) &
+            (out[const.LONGITUDE_COL] > self.conf.min_long) &
+            (out[const.LONGITUDE_COL] < self.conf.max_long)
+            ]
+
+    def _read_band(
+            self,
+            dataset: rasterio.DatasetReader,
+            band: int,
+            window: rasterio.windows.Window
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        data = dataset.read(band, window=window).astype(numpy.float64)
+        no_data_val = dataset.nodatavals[band - 1]
+        if no_data_val is None:
+            valid = numpy.ones(data.shape, dtype=bool)
+        elif numpy.isnan(no_data_val):
+            valid = ~numpy.isnan(data)
+        else:
+            valid = data != no_data_val
+        return data, valid
+
+    def _to_epsg_4326(
+            self,
+            crs: Any,
+            x: numpy.ndarray,
+            y: numpy.ndarray
+    ) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        if crs is None or crs == "EPSG:4326":
+            return numpy.asarray(x), numpy.asarray(y)
+        longs, lats = rasterio.warp.transform(crs, "EPSG:4326", x, y)
+        return numpy.asarray(longs), numpy.asarray(lats)
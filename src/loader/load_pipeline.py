@@ -6,16 +6,25 @@
 #
 # Created: 2024-07-01 by 15205060+DavisBroda@users.noreply.github.com
 import importlib
+import logging
 from dataclasses import dataclass
 from typing import List, Dict, Any, Optional
 
+import pandas
 import yaml
+from pandas import DataFrame
 
 from loader.aggregation_step import AggregationStep, CellAggregationStep
 from loader.output_step import OutputStep
 from loader.postprocessing_step import PostprocessingStep
 from loader.preprocessing_step import PreprocessingStep
 from loader.reading_step import ReadingStep
+from common.const import LOGGING_FORMAT
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
 
 CLASS_NAME_PARAM = "class_name"
 
@@ -48,11 +57,33 @@ class LoadingPipeline:
                 f" {len(self.aggregation_steps)} aggregation steps.")
 
     def run(self):
+        # fail before any work is done if the output cannot be written,
+        #  such as when another load holds the metadata database
+        self.outputStep.check_writable()
+
         data_cols = self.reading_step.get_data_cols()
         key_cols = self.reading_step.get_key_cols()
-        df = self.reading_step.read()
-        for pre_step in self.preprocess_steps:
-            df = pre_step.run(df)
+        batches = self.reading_step.read_batches()
+
+        if len(self.aggregation_steps) == 0 and self._is_row_wise():
+            # every step works row by row, so batches can be streamed
+            #  through to the output
+            self.outputStep.write_batches(
+                self._postprocess(self._preprocess(batch))
+                for batch in batches
+            )
+            return
+
+        batch_list = list(batches)
+        if len(batch_list) == 0:
+            logger.warning("no rows were read. nothing to process")
+            self.outputStep.write_batches([])
+            return
+        df = self._preprocess(pandas.concat(batch_list, ignore_index=True))
+
+        if len(self.aggregation_steps) == 0:
+            self.outputStep.write(self._postprocess(df))
+            return
 
         cell_agg = CellAggregationStep(
             self.aggregation_steps,
@@ -63,11 +94,24 @@ class LoadingPipeline:
 
         df = cell_agg.run(df)
 
-        for post_step in self.postprocess_steps:
-            df = post_step.run(df)
+        df = self._postprocess(df)
 
         self.outputStep.write(df)
 
+    def _is_row_wise(self) -> bool:
+        steps = list(self.preprocess_steps) + list(self.postprocess_steps)
+        return all(step.row_wise for step in steps)
+
+    def _preprocess(self, df: DataFrame) -> DataFrame:
+        for pre_step in self.preprocess_steps:
+            df = pre_step.run(df)
+        return df
+
+    def _postprocess(self, df: DataFrame) -> DataFrame:
+        for post_step in self.postprocess_steps:
+            df = post_step.run(df)
+        return df
+
 
 @dataclass
 class LoadingPipelineConf:
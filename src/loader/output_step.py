@@ -5,27 +5,36 @@
 # https://opensource.org/licenses/MIT.
 #
 # Created: 2024-07-01 by 15205060+DavisBroda@users.noreply.github.com
+import json
 import logging
 import os
+import uuid
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict, Optional, List
+from typing import Any, Dict, Optional, List, Iterable
 
 import duckdb
+import h3
 import pandas
+import pyarrow
+import pyarrow.dataset
+import shapely
 from pandas import DataFrame
 import pandas.io.sql
 
-from common import duckdbutils, const
+from common import connection_manager, dataset_statistics, duckdbutils, \
+    const, dataset_utilities
 
 from common.const import LOGGING_FORMAT
 from geoserver.metadata import MetadataDB
+from loader import pyramid, clustering
 
 # Set up logging
 
 logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
 logger = logging.getLogger(__name__)
 
+GEOMETRY_COL = "geometry"
 
 
 class OutputStep(ABC):
@@ -38,6 +47,23 @@ class OutputStep(ABC):
     def write(self, in_df: DataFrame) -> None:
         pass
 
+    def write_batches(self, batches: Iterable[DataFrame]) -> None:
+        """
+        Write a dataset that arrives as a sequence of DataFrames. By default
+        the batches are combined and written at once; output steps that
+        are able to write incrementally should override this.
+        """
+        batch_list = list(batches)
+        if len(batch_list) > 0:
+            self.write(pandas.concat(batch_list, ignore_index=True))
+
+    def check_writable(self) -> None:
+        """
+        Check that the output can be written, before the pipeline reads
+        or processes any data. Raises ValueError if it cannot.
+        """
+        pass
+
     @abstractmethod
     def _create_metadata(self, df: DataFrame) -> None:
         pass
@@ -51,27 +77,65 @@ class LocalDuckdbOutputStepConf:
     # parameters used to create the data storage db
     database_dir: str
     dataset_name: str
+    # "create" a new dataset, "insert" rows into an existing one, or
+    #  "merge" rows into an existing one. Merging compares incoming rows
+    #  with stored rows on the key columns and cell, and only writes rows
+    #  that are new or changed.
     mode: str = "create"
     key_columns: List[str] = ()
 
+    # in merge mode, whether to delete stored rows that are not present
+    #  in the incoming data
+    delete_missing: bool = False
+
+    # how rows are written. "indexed" declares the key columns as a
+    #  primary key when creating the table, so uniqueness is enforced on
+    #  every insert. "bulk" creates the table without constraints, loads
+    #  all batches inside one transaction, and checks uniqueness once at
+    #  the end. Much faster for large outputs.
+    ingestion_mode: str = "indexed"
+
+    # in bulk mode, whether to build a unique index on the key columns
+    #  once loading is complete
+    create_index: bool = True
+
+    # h3_index datasets only. If set, rollup tables are built after every
+    #  write for each resolution from one coarser than the data down to
+    #  this resolution, so that coarse queries do not need to read every
+    #  fine cell.
+    pyramid_min_resolution: Optional[int] = None
+
+    # whether to compute statistics of the dataset after every write
+    #  and store them in the metadata database. Off by default, as it
+    #  requires a scan of the whole dataset after each write.
+    collect_statistics: bool = False
+
     # Metadata parameters
     description: str = ""
     dataset_type: str = "h3_index"
 
 
-
 class LocalDuckdbOutputStep(OutputStep):
 
     SUPPORTED_DS_TYPES = ["h3_index", "point"]
 
     ALLOWED_MODES = [
         "create",
-        "insert"
+        "insert",
+        "merge"
+    ]
+
+    INGESTION_MODES = [
+        "indexed",
+        "bulk"
     ]
 
     def __init__(self, conf_dict: Dict[str, str]):
         self.conf = LocalDuckdbOutputStepConf(**conf_dict)
         self._vaidate_conf(self.conf)
+        # row counts from the last merge, keyed by inserted, updated,
+        #  deleted and unchanged
+        self.change_counts: Optional[Dict[str, int]] = None
 
     def _vaidate_conf(self, conf: LocalDuckdbOutputStepConf):
         if conf.database_dir is None:
@@ -87,65 +151,322 @@ class LocalDuckdbOutputStep(OutputStep):
             raise ValueError(
                 f"mode {conf.mode} is not allowed in "
             )
+        if conf.ingestion_mode not in self.INGESTION_MODES:
+            raise ValueError(
+                f"ingestion_mode {conf.ingestion_mode} is not supported."
+                f" supported modes are: {self.INGESTION_MODES}"
+            )
         if conf.dataset_type not in self.SUPPORTED_DS_TYPES:
             raise ValueError(
                 f"dataset_type {conf.dataset_type} is not a supported type."
                 f" supported types are: {self.SUPPORTED_DS_TYPES}"
             )
+        if conf.pyramid_min_resolution is not None:
+            if conf.dataset_type != "h3_index":
+                raise ValueError(
+                    "pyramid_min_resolution is only supported for"
+                    " h3_index datasets")
+            if not 0 <= conf.pyramid_min_resolution <= 15:
+                raise ValueError(
+                    f"pyramid_min_resolution must be between 0 and 15,"
+                    f" was {conf.pyramid_min_resolution}")
+
+    def check_writable(self) -> None:
+        MetadataDB(self.conf.database_dir).check_writable()
 
     def write(self, in_df: DataFrame) -> None:
+        self.write_batches([in_df])
+
+    def write_batches(self, batches: Iterable[DataFrame]) -> None:
         logger.info("running LocalDuckDbOutputStep")
         table_name = self.conf.dataset_name
         db_name = self.conf.dataset_name + ".duckdb"
         db_path = os.path.join(self.conf.database_dir, db_name)
-        connection = duckdb.connect(database=db_path)
+        connection = connection_manager.get_writer(db_path)
 
-        exists = duckdbutils.duckdb_check_table_exists(
-            connection, table_name)
-
-        sql = ""
-        if exists:
-            if self.conf.mode == "create":
+        try:
+            exists = duckdbutils.duckdb_check_table_exists(
+                connection, table_name)
+            if exists and self.conf.mode == "create":
                 raise ValueError(
                     f"table {table_name} already exists."
                     f"cannot insert into table in 'create' mode")
-            elif self.conf.mode == "insert":
-                sql = f"INSERT INTO {table_name} BY NAME" \
-                      f" SELECT * FROM in_df"
-        else:
-            keys = list(self.conf.key_columns)
-            if const.CELL_COL in in_df.columns:
-                keys.append(const.CELL_COL)
 
-            sql = pandas.io.sql.get_schema(in_df, table_name, keys=keys)
-            logger.info(f"creating table {table_name}"
-                        f" in local database at {db_path}")
-            connection.sql(
-                sql
-            )
+            if exists and self.conf.mode == "merge":
+                first_df = self._write_merge(
+                    connection, batches, table_name, db_path)
+            elif self.conf.ingestion_mode == "bulk":
+                first_df = self._write_bulk(
+                    connection, batches, table_name, db_path, exists)
+            else:
+                first_df = self._write_indexed(
+                    connection, batches, table_name, db_path, exists)
+
+            pyramid_levels = None
+            min_res = self._get_pyramid_min_resolution()
+            if first_df is not None and min_res is not None:
+                pyramid_levels = pyramid.build_pyramid(
+                    connection,
+                    table_name,
+                    list(self.conf.key_columns),
+                    min_res
+                )
+
+            statistics = None
+            if first_df is not None and self.conf.collect_statistics:
+                statistics = self._compute_statistics(
+                    connection, table_name, pyramid_levels)
+        finally:
+            connection.close()
+
+        if first_df is not None:
+            self._create_metadata(first_df)
+            if pyramid_levels is not None:
+                self._register_pyramid(first_df, pyramid_levels)
+            if statistics is not None:
+                MetadataDB(self.conf.database_dir).set_dataset_statistics(
+                    table_name, statistics)
+            MetadataDB(self.conf.database_dir).bump_dataset_version(
+                table_name)
+
+    def _compute_statistics(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str,
+            pyramid_levels: Optional[List[int]]
+    ) -> Dict[str, Any]:
+        resolution_counts = {}
+        base_res = dataset_statistics.get_cell_resolution(
+            connection, table_name)
+        if base_res is not None:
+            resolution_counts[base_res] = \
+                dataset_statistics.count_rows(connection, table_name)
+            for level in pyramid_levels or []:
+                resolution_counts[level] = dataset_statistics.count_rows(
+                    connection,
+                    dataset_utilities.get_pyramid_table_name(
+                        table_name, level)
+                )
+        return dataset_statistics.compute_statistics(
+            connection,
+            table_name,
+            list(self.conf.key_columns),
+            resolution_counts
+        )
+
+    def _get_pyramid_min_resolution(self) -> Optional[int]:
+        if self.conf.pyramid_min_resolution is not None:
+            return self.conf.pyramid_min_resolution
+        if self.conf.mode == "create":
+            return None
+        # levels built by an earlier write are rebuilt so they stay
+        #  consistent with the base table
+        options = MetadataDB(self.conf.database_dir).get_storage_info(
+            self.conf.dataset_name)["storage_options"]
+        levels = options.get("pyramid_resolutions")
+        if levels is None or len(levels) == 0:
+            return None
+        return min(levels)
+
+    def _register_pyramid(self, df: DataFrame, levels: List[int]) -> None:
+        base_res = None
+        if len(df) > 0:
+            base_res = h3.h3_get_resolution(df[const.CELL_COL].iloc[0])
+        MetadataDB(self.conf.database_dir).set_storage_info(
+            self.conf.dataset_name,
+            "duckdb",
+            {
+                "base_resolution": base_res,
+                "pyramid_resolutions": levels,
+                "pyramid_statistics": pyramid.PYRAMID_STATISTICS
+            }
+        )
+
+    def _write_indexed(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            batches: Iterable[DataFrame],
+            table_name: str,
+            db_path: str,
+            exists: bool
+    ) -> Optional[DataFrame]:
+        first_df = None
+        for in_df in batches:
+            in_df = clustering.sort_for_storage(
+                in_df, list(self.conf.key_columns))
+            if not exists:
+                keys = self._get_key_cols(in_df)
+                sql = pandas.io.sql.get_schema(in_df, table_name, keys=keys)
+                logger.info(f"creating table {table_name}"
+                            f" in local database at {db_path}")
+                connection.sql(
+                    sql
+                )
+                exists = True
+
             sql = f"INSERT INTO {table_name} BY NAME" \
                   f" SELECT * FROM in_df"
 
-        logger.info(f"writing to local database at {db_path}")
-        connection.sql(
-            sql
+            logger.info(f"writing {len(in_df)} rows to local database"
+                        f" at {db_path}")
+            connection.sql(
+                sql
+            )
+            if first_df is None:
+                first_df = in_df
+        return first_df
+
+    def _write_merge(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            batches: Iterable[DataFrame],
+            table_name: str,
+            db_path: str
+    ) -> Optional[DataFrame]:
+        staging_table = f"{table_name}_staging"
+        first_df = None
+        for in_df in batches:
+            if first_df is None:
+                first_df = in_df
+                connection.execute(
+                    f"CREATE OR REPLACE TEMP TABLE {staging_table} AS"
+                    f" SELECT * FROM in_df LIMIT 0"
+                )
+            connection.execute(
+                f"INSERT INTO {staging_table} BY NAME SELECT * FROM in_df")
+
+        if first_df is None:
+            return None
+
+        keys = self._get_key_cols(first_df)
+        logger.info(f"merging rows into {table_name} on keys {keys}"
+                    f" in local database at {db_path}")
+        self.change_counts = duckdbutils.merge_into_table(
+            connection,
+            table_name,
+            staging_table,
+            keys,
+            delete_missing=self.conf.delete_missing
+        )
+        logger.info(f"merged into {table_name}: {self.change_counts}")
+        connection.execute(f"DROP TABLE {staging_table}")
+        return first_df
+
+    def _write_bulk(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            batches: Iterable[DataFrame],
+            table_name: str,
+            db_path: str,
+            exists: bool
+    ) -> Optional[DataFrame]:
+        index_name = f"{table_name}_key_idx"
+        first_df = None
+        keys = []
+
+        index_sql = None
+        if exists:
+            # the index is rebuilt once all rows have been loaded rather
+            #  than maintained on every insert. duckdb keeps enforcing an
+            #  index dropped within the same transaction, so it is dropped
+            #  before loading starts.
+            row = connection.execute(
+                "SELECT sql FROM duckdb_indexes() WHERE index_name = ?",
+                [index_name]
+            ).fetchone()
+            if row is not None:
+                index_sql = row[0]
+                connection.execute(f"DROP INDEX {index_name}")
+
+        connection.begin()
+        try:
+            for in_df in batches:
+                in_df = clustering.sort_for_storage(
+                    in_df, list(self.conf.key_columns))
+                if first_df is None:
+                    first_df = in_df
+                    keys = self._get_key_cols(in_df)
+                if not exists:
+                    sql = pandas.io.sql.get_schema(in_df, table_name)
+                    logger.info(f"creating table {table_name} without"
+                                f" constraints in local database at"
+                                f" {db_path}")
+                    connection.execute(sql)
+                    exists = True
+
+                in_arrow = pyarrow.Table.from_pandas(
+                    in_df, preserve_index=False)
+                logger.info(f"bulk loading {len(in_df)} rows to local"
+                            f" database at {db_path}")
+                connection.execute(
+                    f"INSERT INTO {table_name} BY NAME"
+                    f" SELECT * FROM in_arrow"
+                )
+
+            if first_df is not None and len(keys) > 0:
+                self._check_unique(connection, table_name, keys)
+                if self.conf.create_index:
+                    self._create_index(
+                        connection, table_name, index_name, keys)
+        except Exception:
+            connection.rollback()
+            if index_sql is not None:
+                connection.execute(index_sql)
+            raise
+        connection.commit()
+        return first_df
+
+    def _create_index(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str,
+            index_name: str,
+            keys: List[str]
+    ) -> None:
+        logger.info(f"creating index {index_name}")
+        key_str = ", ".join(f"\"{k}\"" for k in keys)
+        connection.execute(
+            f"CREATE UNIQUE INDEX {index_name} ON {table_name} ({key_str})"
         )
 
-        self._create_metadata(in_df)
+    def _check_unique(
+            self,
+            connection: duckdb.DuckDBPyConnection,
+            table_name: str,
+            keys: List[str]
+    ) -> None:
+        key_str = ", ".join(f"\"{k}\"" for k in keys)
+        duplicate = connection.execute(
+            f"SELECT {key_str}, count(*) FROM {table_name}"
+            f" GROUP BY {key_str} HAVING count(*) > 1 LIMIT 1"
+        ).fetchone()
+        if duplicate is not None:
+            raise ValueError(
+                f"duplicate key {dict(zip(keys, duplicate))} found in"
+                f" {duplicate[-1]} rows of table {table_name}. No rows"
+                f" were written.")
 
+    def _get_key_cols(self, df: DataFrame) -> List[str]:
+        keys = list(self.conf.key_columns)
+        if const.CELL_COL in df.columns:
+            keys.append(const.CELL_COL)
+        return keys
 
     def _create_metadata(self, df: DataFrame) -> None:
         meta_db = MetadataDB(self.conf.database_dir)
 
         ds_name = self.conf.dataset_name
+        if self.conf.mode in ["insert", "merge"] and \
+                meta_db.ds_meta_exists(ds_name):
+            logger.info(f"metadata entry for dataset {ds_name} already"
+                        f" exists. Not recreating it.")
+            return
         description = self.conf.description
 
         table_name = self.conf.dataset_name
         schema_str = pandas.io.sql.get_schema(df, table_name,)
-        all_cols = self._get_cols_from_schema_str(schema_str)
-        k_col_names = list(self.conf.key_columns)
-        if const.CELL_COL in df.columns:
-            k_col_names.append(const.CELL_COL)
+        all_cols = _get_cols_from_schema_str(schema_str)
+        k_col_names = self._get_key_cols(df)
 
         key_cols = dict(
             [(k, v) for k,v in all_cols.items() if k in k_col_names]
@@ -163,16 +484,289 @@ class LocalDuckdbOutputStep(OutputStep):
             self.conf.dataset_type
         )
 
-    def _get_cols_from_schema_str(self, schema_str: str) -> Dict[str,str]:
-        all_str_rows = schema_str.split("\n")
-        all_str_rows.pop(0)  # contains create table <name>
-        all_str_rows.pop()  # last row contains closing )
 
-        out = {}
-        for row in all_str_rows:
-            splits = row.strip().split(' ')
-            name = splits[0].replace("\"", "").strip()
-            d_type = splits[1].replace(",", "").strip()
-            out[name] = d_type
+@dataclass
+class LocalParquetOutputStepConf:
+    def __init__(self, **entries):
+        self.__dict__.update(entries)
+
+    # the dataset is written to the <database_dir>/<dataset_name> directory
+    database_dir: str
+    dataset_name: str
+    mode: str = "create"
+    key_columns: List[str] = ()
+
+    # files are partitioned by the parent h3 cell at this resolution, so
+    #  that queries over a region only need to read a few files. Set to
+    #  None to disable h3 partitioning.
+    partition_resolution: Optional[int] = 2
+
+    # any key columns (such as year or month) to also partition by
+    partition_columns: List[str] = ()
+
+    # maximum number of rows in each parquet row group. Row groups are the
+    #  unit that readers can skip based on column statistics.
+    max_rows_per_group: int = 122880
+
+    # whether to add a WKB point geometry column and GeoParquet metadata,
+    #  so the files can be read by GIS tools
+    include_geometry: bool = False
+
+    # whether to compute statistics of the dataset after every write
+    #  and store them in the metadata database. Off by default, as it
+    #  requires a scan of the whole dataset after each write.
+    collect_statistics: bool = False
+
+    # Metadata parameters
+    description: str = ""
+    dataset_type: str = "h3_index"
+
+
+class LocalParquetOutputStep(OutputStep):
+    """
+    Writes a dataset as a directory of hive partitioned parquet files,
+    rather than a single duckdb database. Partitions are by coarse h3
+    parent cell and optionally by time key, and rows are sorted by cell
+    within each file. Files are never rewritten, so the dataset can be
+    read while more data is being inserted. Key uniqueness is not
+    enforced.
+    """
+
+    SUPPORTED_DS_TYPES = ["h3_index", "point"]
+
+    ALLOWED_MODES = [
+        "create",
+        "insert"
+    ]
+
+    def __init__(self, conf_dict: Dict[str, str]):
+        self.conf = LocalParquetOutputStepConf(**conf_dict)
+        self._validate_conf(self.conf)
+
+    def _validate_conf(self, conf: LocalParquetOutputStepConf):
+        for param in ["database_dir", "dataset_name"]:
+            if getattr(conf, param, None) is None:
+                raise ValueError(
+                    f"{param} was not provided. {param} is a mandatory"
+                    f" parameter for LocalParquetOutputStep")
+
+        if conf.mode not in self.ALLOWED_MODES:
+            raise ValueError(
+                f"mode {conf.mode} is not allowed. allowed modes are:"
+                f" {self.ALLOWED_MODES}"
+            )
+        if conf.dataset_type not in self.SUPPORTED_DS_TYPES:
+            raise ValueError(
+                f"dataset_type {conf.dataset_type} is not a supported type."
+                f" supported types are: {self.SUPPORTED_DS_TYPES}"
+            )
+        if conf.partition_resolution is not None and \
+                not 0 <= conf.partition_resolution <= 15:
+            raise ValueError(
+                f"partition_resolution must be between 0 and 15, was"
+                f" {conf.partition_resolution}")
+        for col in conf.partition_columns:
+            if col not in conf.key_columns:
+                raise ValueError(
+                    f"partition column {col} must be one of the key"
+                    f" columns: {conf.key_columns}")
+        if conf.max_rows_per_group < 1:
+            raise ValueError(
+                f"max_rows_per_group must be at least 1, was"
+                f" {conf.max_rows_per_group}")
+
+    def check_writable(self) -> None:
+        MetadataDB(self.conf.database_dir).check_writable()
+
+    def write(self, in_df: DataFrame) -> None:
+        self.write_batches([in_df])
+
+    def write_batches(self, batches: Iterable[DataFrame]) -> None:
+        logger.info("running LocalParquetOutputStep")
+        out_dir = self._get_out_dir()
+        if os.path.exists(out_dir) and len(os.listdir(out_dir)) > 0 \
+                and self.conf.mode == "create":
+            raise ValueError(
+                f"dataset directory {out_dir} already exists."
+                f" cannot insert into dataset in 'create' mode")
+        if self.conf.mode == "create" and MetadataDB(
+                self.conf.database_dir).ds_meta_exists(
+                self.conf.dataset_name):
+            # checked before writing, so no files are left behind when
+            #  registering the dataset would fail
+            raise ValueError(
+                f"metadata entry for dataset {self.conf.dataset_name}"
+                f" already exists. cannot create dataset in 'create' mode")
+
+        partitioning = None
+        partition_cols = self._get_partition_cols()
+        # every write gets unique file names, so inserts never overwrite
+        #  files written earlier
+        write_id = uuid.uuid4().hex
+
+        first_df = None
+        for batch_num, in_df in enumerate(batches):
+            if first_df is None:
+                first_df = in_df
+            table = self._to_arrow(in_df)
+            if len(partition_cols) > 0 and partitioning is None:
+                partitioning = pyarrow.dataset.partitioning(
+                    pyarrow.schema(
+                        [table.schema.field(c) for c in partition_cols]),
+                    flavor="hive"
+                )
+
+            logger.info(f"writing {len(in_df)} rows to parquet dataset"
+                        f" at {out_dir}")
+            pyarrow.dataset.write_dataset(
+                table,
+                out_dir,
+                format="parquet",
+                partitioning=partitioning,
+                basename_template=f"part-{write_id}-{batch_num}-{{i}}.parquet",
+                existing_data_behavior="overwrite_or_ignore",
+                max_rows_per_group=self.conf.max_rows_per_group,
+                max_rows_per_file=0,
+            )
+
+        if first_df is not None:
+            self._create_metadata(first_df)
+            if self.conf.collect_statistics:
+                MetadataDB(self.conf.database_dir).set_dataset_statistics(
+                    self.conf.dataset_name, self._compute_statistics())
+            MetadataDB(self.conf.database_dir).bump_dataset_version(
+                self.conf.dataset_name)
+
+    def _create_metadata(self, df: DataFrame) -> None:
+        meta_db = MetadataDB(self.conf.database_dir)
+        ds_name = self.conf.dataset_name
+
+        if not (self.conf.mode == "insert" and
+                meta_db.ds_meta_exists(ds_name)):
+            schema_str = pandas.io.sql.get_schema(df, ds_name)
+            all_cols = _get_cols_from_schema_str(schema_str)
+            k_col_names = list(self.conf.key_columns)
+            if const.CELL_COL in df.columns:
+                k_col_names.append(const.CELL_COL)
+
+            key_cols = dict(
+                [(k, v) for k, v in all_cols.items() if k in k_col_names]
+            )
+            value_cols = dict(
+                [(k, v) for k, v in all_cols.items()
+                 if k not in k_col_names]
+            )
+            meta_db.add_metadata_entry(
+                ds_name,
+                self.conf.description,
+                key_cols,
+                value_cols,
+                self.conf.dataset_type
+            )
+
+        meta_db.set_storage_info(
+            ds_name,
+            "parquet",
+            {
+                "path": ds_name,
+                "partition_resolution": self.conf.partition_resolution,
+                "partition_columns": list(self.conf.partition_columns),
+                "geometry_column":
+                    GEOMETRY_COL if self.conf.include_geometry else None
+            }
+        )
+
+    def _compute_statistics(self) -> Dict[str, Any]:
+        glob = os.path.join(self._get_out_dir(), "**", "*.parquet") \
+            .replace("'", "''")
+        source = f"read_parquet('{glob}', hive_partitioning=1)"
+        connection = duckdb.connect()
+        try:
+            resolution_counts = {}
+            base_res = dataset_statistics.get_cell_resolution(
+                connection, source)
+            if base_res is not None:
+                resolution_counts[base_res] = \
+                    dataset_statistics.count_rows(connection, source)
+            return dataset_statistics.compute_statistics(
+                connection,
+                source,
+                list(self.conf.key_columns),
+                resolution_counts
+            )
+        finally:
+            connection.close()
+
+    def _get_out_dir(self) -> str:
+        return os.path.join(self.conf.database_dir, self.conf.dataset_name)
+
+    def _get_partition_cols(self) -> List[str]:
+        cols = []
+        if self.conf.partition_resolution is not None:
+            cols.append(const.PARTITION_COL)
+        cols.extend(self.conf.partition_columns)
+        return cols
+
+    def _to_arrow(self, df: DataFrame) -> pyarrow.Table:
+        df = df.copy()
+        res = self.conf.partition_resolution
+        if res is not None:
+            df[const.PARTITION_COL] = self._get_partition_cells(df, res)
+
+        sort_cols = list(self._get_partition_cols())
+        if const.CELL_COL in df.columns:
+            sort_cols.append(const.CELL_COL)
+        else:
+            sort_cols.extend([const.LATITUDE_COL, const.LONGITUDE_COL])
+        df = df.sort_values(sort_cols, ignore_index=True)
+
+        if self.conf.include_geometry:
+            points = shapely.points(
+                df[const.LONGITUDE_COL], df[const.LATITUDE_COL])
+            df[GEOMETRY_COL] = shapely.to_wkb(points)
+
+        table = pyarrow.Table.from_pandas(df, preserve_index=False)
+        if self.conf.include_geometry:
+            geo_meta = {
+                "version": "1.0.0",
+                "primary_column": GEOMETRY_COL,
+                "columns": {
+                    GEOMETRY_COL: {
+                        "encoding": "WKB",
+                        "geometry_types": ["Point"]
+                    }
+                }
+            }
+            metadata = dict(table.schema.metadata or {})
+            metadata[b"geo"] = json.dumps(geo_meta).encode("utf-8")
+            table = table.replace_schema_metadata(metadata)
+        return table
+
+    def _get_partition_cells(self, df: DataFrame, res: int) -> List[str]:
+        if const.CELL_COL in df.columns:
+            cells = df[const.CELL_COL].unique()
+            if len(cells) > 0 and h3.h3_get_resolution(cells[0]) < res:
+                raise ValueError(
+                    f"partition_resolution {res} is finer than the"
+                    f" resolution of the cells in column {const.CELL_COL}")
+            parents = dict(
+                (cell, h3.h3_to_parent(cell, res)) for cell in cells)
+            return df[const.CELL_COL].map(parents)
+
+        return dataset_utilities.get_cells(
+            df[const.LATITUDE_COL], df[const.LONGITUDE_COL], res)
+
+
+def _get_cols_from_schema_str(schema_str: str) -> Dict[str, str]:
+    all_str_rows = schema_str.split("\n")
+    all_str_rows.pop(0)  # contains create table <name>
+    all_str_rows.pop()  # last row contains closing )
+
+    out = {}
+    for row in all_str_rows:
+        splits = row.strip().split(' ')
+        name = splits[0].replace("\"", "").strip()
+        d_type = splits[1].replace(",", "").strip()
+        out[name] = d_type
 
-        return out
+    return out
@@ -22,6 +22,12 @@ logger = logging.getLogger(__name__)
 
 
 class PostprocessingStep(ABC):
+    # whether the step transforms each row independently of the others,
+    #  so that running it on each batch of a dataset gives the same result
+    #  as running it on the whole dataset. Pipelines stream batches
+    #  through their steps only when every step is row wise.
+    row_wise: bool = False
+
     @abstractmethod
     def __init__(self, conf_dict: Dict[str, Any]):
         pass
@@ -44,6 +50,8 @@ class MultiplyValueConf:
 
 
 class MultiplyValue(PostprocessingStep):
+    row_wise = True
+
     def __init__(self, conf_dict: Dict[str, Any]):
         logger.debug(f"creating ShapefileFilter with conf {conf_dict}")
         self.conf = MultiplyValueConf(**conf_dict)
@@ -78,6 +86,8 @@ class AddConstantColumnConf:
 
 
 class AddConstantColumn(PostprocessingStep):
+    row_wise = True
+
     def __init__(self, conf_dict: Dict[str, Any]):
         logger.debug(f"creating AddConstantColumnConf with conf {conf_dict}")
         self.conf = AddConstantColumnConf(**conf_dict)
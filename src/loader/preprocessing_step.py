@@ -24,6 +24,12 @@ logger = logging.getLogger(__name__)
 
 
 class PreprocessingStep(ABC):
+    # whether the step transforms each row independently of the others,
+    #  so that running it on each batch of a dataset gives the same result
+    #  as running it on the whole dataset. Pipelines stream batches
+    #  through their steps only when every step is row wise.
+    row_wise: bool = False
+
     @abstractmethod
     def __init__(self, conf_dict: Dict[str, str]):
         pass
@@ -43,6 +49,8 @@ class ShapefileFilterConf:
 
 
 class ShapefileFilter(PreprocessingStep):
+    row_wise = True
+
 
     def __init__(self, conf_dict: Dict[str, str]):
         logger.debug(f"creating ShapefileFilter with conf {conf_dict}")
@@ -0,0 +1,196 @@
+# Copyright 2024 Broda Group Software Inc.
+#
+# Use of this source code is governed by an MIT-style
+# license that can be found in the LICENSE file or at
+# https://opensource.org/licenses/MIT.
+#
+# Created: 2026-10-19 by davis.broda@brodagroupsoftware.com
+import logging
+from typing import List
+
+import duckdb
+import h3
+import numpy
+import pyarrow
+
+from common import dataset_utilities, duckdbutils
+from common.const import CELL_COL, LATITUDE_COL, LONGITUDE_COL, \
+    LOGGING_FORMAT
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
+
+# statistics stored for each value column in a pyramid level, as
+#  <column>_<statistic>. The mean is stored under the column's own name,
+#  so pyramid levels can be queried the same way as the base table.
+PYRAMID_STATISTICS = ["count", "min", "max", "sum"]
+
+
+def build_pyramid(
+        connection: duckdb.DuckDBPyConnection,
+        dataset_name: str,
+        key_cols: List[str],
+        min_resolution: int
+) -> List[int]:
+    """
+    Build rollup tables for an h3_index dataset at every resolution from
+    one coarser than the dataset's own resolution down to min_resolution.
+    Each level is aggregated from the level above it, grouped by parent
+    cell and key columns, so the cost of each level depends on the size
+    of the previous level rather than the base table. Existing levels
+    are replaced.
+
+    :param connection: connection to the dataset's database
+    :type connection: duckdb.DuckDBPyConnection
+    :param dataset_name:
+        the name of the dataset. The base table has the same name, and
+        levels are written to <dataset_name>_<resolution>
+    :type dataset_name: str
+    :param key_cols:
+        key columns other than the cell column, such as time columns.
+        Rows are aggregated separately for each combination of key values.
+    :type key_cols: List[str]
+    :param min_resolution: the coarsest resolution to build
+    :type min_resolution: int
+    :return: the resolutions that were built, finest first
+    :rtype: List[int]
+    """
+    value_cols = _get_value_cols(connection, dataset_name, key_cols)
+    _check_name_collisions(connection, dataset_name, value_cols)
+
+    first_cell = connection.execute(
+        f"SELECT {CELL_COL} FROM {dataset_name} LIMIT 1").fetchone()
+    if first_cell is None:
+        return []
+    base_res = h3.h3_get_resolution(first_cell[0])
+
+    built = []
+    src_table = dataset_name
+    for res in range(base_res - 1, min_resolution - 1, -1):
+        table_name = dataset_utilities.get_pyramid_table_name(
+            dataset_name, res)
+        logger.info(f"building pyramid level {table_name}")
+        _build_level(
+            connection,
+            src_table,
+            table_name,
+            res,
+            key_cols,
+            value_cols,
+            src_table == dataset_name
+        )
+        built.append(res)
+        src_table = table_name
+    return built
+
+
+def _build_level(
+        connection: duckdb.DuckDBPyConnection,
+        src_table: str,
+        table_name: str,
+        resolution: int,
+        key_cols: List[str],
+        value_cols: List[str],
+        from_base: bool
+):
+    # parents only need computing once per distinct cell, not per row,
+    #  and centers once per distinct parent
+    cells = connection.execute(f"""
+        SELECT DISTINCT {CELL_COL} AS cell,
+            ('0x' || {CELL_COL})::UBIGINT AS id
+        FROM {src_table}
+        WHERE {CELL_COL} IS NOT NULL
+    """).fetch_arrow_table()
+    parent_ids = dataset_utilities.get_parent_cell_ids(
+        cells["id"].to_numpy(), resolution)
+    unique_ids, inverse = numpy.unique(parent_ids, return_inverse=True)
+    unique_parents = [h3.h3_to_string(int(p)) for p in unique_ids]
+    centers = numpy.array(
+        [h3.h3_to_geo(p) for p in unique_parents], dtype=numpy.float64
+    ).reshape(-1, 2)
+    parent_map = pyarrow.table({
+        "cell": cells["cell"],
+        "parent": pyarrow.array(unique_parents, pyarrow.string()).take(
+            pyarrow.array(inverse)),
+        "lat": centers[inverse, 0],
+        "long": centers[inverse, 1],
+    })
+    connection.register("parent_map", parent_map)
+
+    aggs = []
+    for v in value_cols:
+        if from_base:
+            aggs.extend([
+                f'count(s."{v}") AS "{v}_count"',
+                f'min(s."{v}") AS "{v}_min"',
+                f'max(s."{v}") AS "{v}_max"',
+                f'sum(s."{v}") AS "{v}_sum"',
+                f'avg(s."{v}") AS "{v}"',
+            ])
+        else:
+            aggs.extend([
+                f'sum(s."{v}_count") AS "{v}_count"',
+                f'min(s."{v}_min") AS "{v}_min"',
+                f'max(s."{v}_max") AS "{v}_max"',
+                f'sum(s."{v}_sum") AS "{v}_sum"',
+                f'sum(s."{v}_sum") / sum(s."{v}_count") AS "{v}"',
+            ])
+
+    group_cols = ["m.parent", "m.lat", "m.long"] + \
+        [f's."{k}"' for k in key_cols]
+    select_cols = [
+        f"m.parent AS {CELL_COL}",
+        f"m.lat AS {LATITUDE_COL}",
+        f"m.long AS {LONGITUDE_COL}",
+    ] + [f's."{k}"' for k in key_cols] + aggs
+
+    connection.execute(f"""
+        CREATE OR REPLACE TABLE {table_name} AS
+        SELECT {", ".join(select_cols)}
+        FROM {src_table} s
+        JOIN parent_map m ON s.{CELL_COL} = m.cell
+        GROUP BY {", ".join(group_cols)}
+        ORDER BY {", ".join([f's."{k}"' for k in key_cols] + ["m.parent"])}
+    """)
+    connection.unregister("parent_map")
+
+
+def _get_value_cols(
+        connection: duckdb.DuckDBPyConnection,
+        table_name: str,
+        key_cols: List[str]
+) -> List[str]:
+    described = connection.execute(f"DESCRIBE {table_name}").fetchall()
+    value_cols = []
+    for row in described:
+        name, col_type = row[0], row[1]
+        if name in key_cols or \
+                name in [CELL_COL, LATITUDE_COL, LONGITUDE_COL]:
+            continue
+        if duckdbutils.is_numeric_type(col_type):
+            value_cols.append(name)
+        else:
+            logger.info(f"column {name} of type {col_type} is not numeric"
+                        f" and will not be included in pyramid levels")
+    return value_cols
+
+
+def _check_name_collisions(
+        connection: duckdb.DuckDBPyConnection,
+        table_name: str,
+        value_cols: List[str]
+):
+    all_cols = [
+        r[0] for r in
+        connection.execute(f"DESCRIBE {table_name}").fetchall()
+    ]
+    for v in value_cols:
+        for stat in PYRAMID_STATISTICS:
+            stat_col = f"{v}_{stat}"
+            if stat_col in all_cols:
+                raise ValueError(
+                    f"cannot build pyramid for {table_name}: statistic"
+                    f" column {stat_col} for column {v} would collide with"
+                    f" an existing column of the same name")
@@ -5,16 +5,25 @@
 # https://opensource.org/licenses/MIT.
 #
 # Created: 2024-07-01 by 15205060+DavisBroda@users.noreply.github.com
+import logging
 import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Iterator, Any, Tuple
 
+import duckdb
 import pandas
 from pandas import DataFrame
 
+from common import connection_manager, csvutils, dataset_utilities
 from common.const import LATITUDE_COL, LONGITUDE_COL, YEAR_COL, MONTH_COL, \
-    DAY_COL
+    DAY_COL, LOGGING_FORMAT
+from geoserver.metadata import MetadataDB
+
+# Set up logging
+
+logging.basicConfig(level=logging.INFO, format=LOGGING_FORMAT)
+logger = logging.getLogger(__name__)
 
 latitude_col = "latitude"
 
@@ -29,6 +38,14 @@ class ReadingStep(ABC):
     def read(self) -> DataFrame:
         pass
 
+    def read_batches(self) -> Iterator[DataFrame]:
+        """
+        Read the source data as a sequence of DataFrames. By default the
+        entire dataset is returned as a single batch; steps that are able
+        to stream their input should override this.
+        """
+        yield self.read()
+
     @abstractmethod
     def get_data_cols(self) -> List[str]:
         pass
@@ -102,3 +119,324 @@ class ParquetFileReader(ReadingStep):
 
     def get_key_cols(self) -> List[str]:
         return list(self.conf.key_columns)
+
+
+@dataclass
+class CSVFileReaderConf:
+    def __init__(self, **entries):
+        self.__dict__.update(entries)
+
+    file_path: str
+
+    # every column in the file, in order, mapped to its type.
+    #  Supported types: [str, float, int]
+    columns: Dict[str, str]
+
+    data_columns: List[str]
+
+    key_columns: List[str] = ()
+
+    has_header_row: bool = False
+
+    # approximate number of rows in each batch produced by read_batches
+    batch_size: int = 1000000
+
+    # maximum number of threads used to parse the file. Uses all available
+    #  cores if not set.
+    max_parallelism: Optional[int] = None
+
+
+class CSVFileReader(ReadingStep):
+    """
+    Reads a csv file with typed columns. Parsing is done by duckdb, which
+    splits large files at line boundaries and parses the pieces in
+    parallel. read_batches streams the file in batches of roughly
+    batch_size rows, so memory use does not depend on the file size.
+    """
+
+    def __init__(self, conf_dict: Dict[str, str]):
+        self.conf = CSVFileReaderConf(**conf_dict)
+        self.validate_conf(self.conf)
+
+    def validate_conf(self, conf: CSVFileReaderConf):
+        if not os.path.exists(conf.file_path):
+            raise ValueError(
+                f"file {conf.file_path} specified in CSVFileReader conf"
+                f" does not exist"
+            )
+        if os.path.isdir(conf.file_path):
+            raise ValueError(
+                f"file {conf.file_path} specified in CSVFileReader conf"
+                f" is a directory, not a file"
+            )
+
+        csvutils.validate_column_types(conf.columns)
+
+        for col in [LATITUDE_COL, LONGITUDE_COL]:
+            if col not in conf.columns:
+                raise ValueError(
+                    f"columns element of CSVFileReaderConf did not include"
+                    f" mandatory column {col}")
+
+        for col in list(conf.data_columns) + list(conf.key_columns):
+            if col not in conf.columns:
+                raise ValueError(
+                    f"column {col} specified in 'data_columns' or"
+                    f" 'key_columns' element of CSVFileReaderConf is not"
+                    f" present in the 'columns' element")
+
+        if conf.batch_size < 1:
+            raise ValueError(
+                f"batch_size must be at least 1, was {conf.batch_size}")
+
+    def read(self) -> DataFrame:
+        df = csvutils.read_typed_csv(
+            self.conf.file_path,
+            self.conf.columns,
+            self.conf.has_header_row,
+            self.conf.max_parallelism
+        )
+        return self._prepare(df)
+
+    def read_batches(self) -> Iterator[DataFrame]:
+        logger.info(f"reading {self.conf.file_path} in batches of"
+                    f" {self.conf.batch_size} rows")
+        batches = csvutils.read_typed_csv_chunks(
+            self.conf.file_path,
+            self.conf.columns,
+            self.conf.has_header_row,
+            self.conf.batch_size,
+            self.conf.max_parallelism
+        )
+        for batch in batches:
+            yield self._prepare(batch)
+
+    def get_data_cols(self) -> List[str]:
+        return self.conf.data_columns
+
+    def get_key_cols(self) -> List[str]:
+        return list(self.conf.key_columns)
+
+    def _prepare(self, df: DataFrame) -> DataFrame:
+        lat = df[LATITUDE_COL]
+        long = df[LONGITUDE_COL]
+        invalid = lat.isna() | long.isna() | \
+            (lat < -90) | (lat > 90) | (long < -180) | (long > 180)
+        num_invalid = int(invalid.sum())
+        if num_invalid > 0:
+            first = df[invalid].iloc[0]
+            raise ValueError(
+                f"{num_invalid} row(s) in {self.conf.file_path} had a"
+                f" missing or out of range latitude/longitude. First"
+                f" invalid row had latitude: {first[LATITUDE_COL]},"
+                f" longitude: {first[LONGITUDE_COL]}")
+
+        keep_cols = list(self.conf.data_columns)
+        keep_cols.append(LATITUDE_COL)
+        keep_cols.append(LONGITUDE_COL)
+        keep_cols.extend(self.conf.key_columns)
+
+        drop_cols = df.columns.difference(keep_cols)
+        if len(drop_cols) > 0:
+            df = df.drop(columns=drop_cols)
+
+        return df
+
+
+@dataclass
+class DuckdbDatasetReaderConf:
+    def __init__(self, **entries):
+        self.__dict__.update(entries)
+
+    # the database directory and name of a dataset written by
+    #  LocalDuckdbOutputStep or one of the loaders
+    database_dir: str
+    dataset_name: str
+
+    # resolution of the table to read. Mandatory for h3 datasets, which
+    #  store one table per resolution, and ignored otherwise.
+    resolution: Optional[int] = None
+
+    # columns to read. If not set, all value/key columns registered in the
+    #  metadata for the dataset are read, apart from latitude, longitude
+    #  and h3 cell columns.
+    data_columns: Optional[List[str]] = None
+    key_columns: Optional[List[str]] = None
+
+    # key column name -> a value, or list of values, that rows must match
+    filters: Dict[str, Any] = None
+
+    # Bounding box to read rows from. Any unspecified edge is unbounded.
+    min_lat: Optional[float] = None
+    max_lat: Optional[float] = None
+    min_long: Optional[float] = None
+    max_long: Optional[float] = None
+
+    # maximum number of rows in each batch produced by read_batches
+    batch_size: int = 1000000
+
+
+class DuckdbDatasetReader(ReadingStep):
+    """
+    Reads a dataset stored in a local duckdb database, so that derived
+    datasets (such as coarser rollups) can be built from it. The database
+    is opened read-only, and filters, the bounding box and the column
+    projection are all applied by duckdb, so only the requested rows and
+    columns are ever materialized. read_batches streams the result as
+    arrow record batches.
+    """
+
+    def __init__(self, conf_dict: Dict[str, str]):
+        self.conf = DuckdbDatasetReaderConf(**conf_dict)
+        self.validate_conf(self.conf)
+
+    def validate_conf(self, conf: DuckdbDatasetReaderConf):
+        for param in ["database_dir", "dataset_name"]:
+            if getattr(conf, param, None) is None:
+                raise ValueError(
+                    f"{param} was not provided. {param} is a mandatory"
+                    f" parameter for DuckdbDatasetReader")
+
+        db_path = self._get_db_path()
+        if not os.path.exists(db_path):
+            raise ValueError(
+                f"database {db_path} for dataset {conf.dataset_name}"
+                f" does not exist")
+
+        if conf.batch_size < 1:
+            raise ValueError(
+                f"batch_size must be at least 1, was {conf.batch_size}")
+
+        for col, value in (conf.filters or {}).items():
+            if isinstance(value, (list, tuple)) and len(value) == 0:
+                raise ValueError(
+                    f"filter for column {col} is an empty list. at least"
+                    f" one value must be provided")
+
+        if conf.resolution is None and \
+                self._get_metadata()["dataset_type"] == "h3":
+            raise ValueError(
+                f"resolution was not provided. resolution is a mandatory"
+                f" parameter for h3 dataset {conf.dataset_name}")
+
+    def read(self) -> DataFrame:
+        sql, params = self._get_sql()
+        connection = self._connect()
+        try:
+            return connection.execute(sql, params).df()
+        finally:
+            connection.close()
+
+    def read_batches(self) -> Iterator[DataFrame]:
+        sql, params = self._get_sql()
+        logger.info(f"reading dataset {self.conf.dataset_name} in batches"
+                    f" of {self.conf.batch_size} rows")
+        connection = self._connect()
+        try:
+            reader = connection.execute(sql, params) \
+                .fetch_record_batch(self.conf.batch_size)
+            for batch in reader:
+                yield batch.to_pandas()
+        finally:
+            connection.close()
+
+    def get_data_cols(self) -> List[str]:
+        return self._resolve_columns()[0]
+
+    def get_key_cols(self) -> List[str]:
+        return self._resolve_columns()[1]
+
+    def _get_db_path(self) -> str:
+        return os.path.join(
+            self.conf.database_dir, self.conf.dataset_name + ".duckdb")
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        return connection_manager.get_reader(self._get_db_path())
+
+    def _get_metadata(self) -> Dict[str, Any]:
+        if not hasattr(self, "_metadata"):
+            meta_db = MetadataDB(self.conf.database_dir)
+            if not meta_db.ds_meta_exists(self.conf.dataset_name):
+                raise ValueError(
+                    f"no metadata entry exists for dataset"
+                    f" {self.conf.dataset_name}")
+            self._metadata = meta_db.get_ds_metadata(self.conf.dataset_name)
+        return self._metadata
+
+    def _resolve_columns(self) -> Tuple[List[str], List[str]]:
+        meta = self._get_metadata()
+        meta_key_cols = list(meta["key_columns"]["key"])
+        meta_value_cols = list(meta["value_columns"]["key"])
+        all_cols = meta_key_cols + meta_value_cols
+
+        def default_cols(cols: List[str]) -> List[str]:
+            return [
+                c for c in cols
+                if c not in [LATITUDE_COL, LONGITUDE_COL]
+                and not dataset_utilities.is_cell_col(c)
+            ]
+
+        data_cols = self.conf.data_columns
+        if data_cols is None:
+            data_cols = default_cols(meta_value_cols)
+        key_cols = self.conf.key_columns
+        if key_cols is None:
+            key_cols = default_cols(meta_key_cols)
+
+        for col in list(data_cols) + list(key_cols) + \
+                list((self.conf.filters or {}).keys()):
+            if col not in all_cols:
+                raise ValueError(
+                    f"column {col} specified in DuckdbDatasetReader conf"
+                    f" does not exist in dataset {self.conf.dataset_name}."
+                    f" available columns: {all_cols}")
+        for col in [LATITUDE_COL, LONGITUDE_COL]:
+            if col not in all_cols:
+                raise ValueError(
+                    f"dataset {self.conf.dataset_name} does not contain"
+                    f" mandatory column {col}")
+
+        return list(data_cols), list(key_cols)
+
+    def _get_sql(self) -> Tuple[str, List[Any]]:
+        data_cols, key_cols = self._resolve_columns()
+        table_name = dataset_utilities.get_table_name(
+            self.conf.dataset_name,
+            self._get_metadata()["dataset_type"],
+            self.conf.resolution
+        )
+
+        select_cols = [LATITUDE_COL, LONGITUDE_COL]
+        for col in data_cols + key_cols:
+            if col not in select_cols:
+                select_cols.append(col)
+
+        clauses = []
+        params = []
+        for col, value in (self.conf.filters or {}).items():
+            if isinstance(value, (list, tuple)):
+                placeholders = ", ".join("?" for _ in value)
+                clauses.append(f"\"{col}\" IN ({placeholders})")
+                params.extend(value)
+            else:
+                clauses.append(f"\"{col}\" = ?")
+                params.append(value)
+
+        bounds = [
+            (LATITUDE_COL, ">=", self.conf.min_lat),
+            (LATITUDE_COL, "<=", self.conf.max_lat),
+            (LONGITUDE_COL, ">=", self.conf.min_long),
+            (LONGITUDE_COL, "<=", self.conf.max_long),
+        ]
+        for col, op, value in bounds:
+            if value is not None:
+                clauses.append(f"{col} {op} ?")
+                params.append(value)
+
+        where = ""
+        if len(clauses) > 0:
+            where = "WHERE " + " AND ".join(clauses)
+
+        col_str = ", ".join(f"\"{c}\"" for c in select_cols)
+        sql = f"SELECT {col_str} FROM \"{table_name}\" {where}"
+        return sql, params
@@ -11,6 +11,7 @@ from typing import Optional, Set, Tuple, List
 import geopandas
 import h3
 import numpy as np
+import shapely
 from geopandas import GeoDataFrame
 from pandas import Series
 from shapely import Polygon, MultiPolygon, Point
@@ -352,6 +353,31 @@ class Shape:
                 max_lat = this_max_lat
         return min_long, min_lat, max_long, max_lat
 
+    def get_region_geometry(
+            self,
+            region: Optional[str] = None
+    ) -> BaseGeometry:
+        """
+        Get the geometry of a region in the shapefile, in the shapefile's
+        coordinate order.
+
+        :param region:
+            The region in the shapefile to get. If absent, the union of
+            every region in the shapefile is returned.
+        :type region: Optional[str]
+        :return: the region's geometry
+        :rtype: BaseGeometry
+        """
+        if region is not None:
+            gdf = self.gdf[self.gdf.name == region]
+            if len(gdf) == 0:
+                raise ValueError(
+                    f"region {region} not found in shapefile"
+                    f" {self.shapefile}")
+        else:
+            gdf = self.gdf
+        return shapely.union_all(gdf.geometry.values)
+
     def point_within_shape(
             self,
             latitude: float,
@@ -0,0 +1,111 @@
+import gc
+import os
+import shutil
+import time
+
+import duckdb
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.metadata import MetadataDB
+from loader import clustering
+
+tmp_folder = "./test/test_data/clustering_tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+class TestClustering:
+
+    def test_sort_by_keys_then_cell(self):
+        df = DataFrame({
+            "h3_cell": ["b", "a", "c", "a"],
+            "year": [2021, 2021, 2020, 2020],
+            "value1": [1, 2, 3, 4],
+        })
+
+        out = clustering.sort_for_storage(df, ["year"])
+
+        assert out.values.tolist() == [
+            ["a", 2020, 4], ["c", 2020, 3], ["a", 2021, 2], ["b", 2021, 1]
+        ]
+
+    def test_points_sorted_by_location(self):
+        df = DataFrame({
+            "latitude": [50.0, -30.0, 50.001, -30.001],
+            "longitude": [10.0, 140.0, 10.001, 140.001],
+            "value1": [1, 2, 3, 4],
+        })
+
+        out = clustering.sort_for_storage(df, [])
+
+        # nearby points end up next to each other
+        assert set(out["value1"][:2]) in [{1, 3}, {2, 4}]
+        assert set(out["value1"][2:]) in [{1, 3}, {2, 4}]
+
+    def test_recluster_keeps_constraints(self, database_dir):
+        connection = duckdb.connect(f"{database_dir}/ds.duckdb")
+        connection.execute(
+            "CREATE TABLE ds (h3_cell VARCHAR, year INTEGER,"
+            " value1 DOUBLE, PRIMARY KEY (year, h3_cell))")
+        connection.execute(
+            "CREATE INDEX ds_value_idx ON ds (value1)")
+        connection.execute(
+            "INSERT INTO ds VALUES ('b', 2021, 1), ('a', 2021, 2),"
+            " ('c', 2020, 3), ('a', 2020, 4)")
+        connection.close()
+        MetadataDB(database_dir).add_metadata_entry(
+            "ds", "", {"year": "INTEGER", "h3_cell": "VARCHAR"},
+            {"value1": "DOUBLE"}, "h3_index")
+
+        tables = clustering.recluster_dataset(database_dir, "ds")
+
+        assert tables == ["ds"]
+        connection = duckdb.connect(f"{database_dir}/ds.duckdb")
+        rows = connection.execute(
+            "SELECT h3_cell, year FROM ds ORDER BY rowid").fetchall()
+        assert rows == [("a", 2020), ("c", 2020), ("a", 2021), ("b", 2021)]
+        assert connection.execute(
+            "SELECT index_name FROM duckdb_indexes()"
+        ).fetchall() == [("ds_value_idx",)]
+        with pytest.raises(duckdb.ConstraintException):
+            connection.execute("INSERT INTO ds VALUES ('a', 2020, 5)")
+        connection.close()
+
+    def test_recluster_point_dataset(self, database_dir):
+        connection = duckdb.connect(f"{database_dir}/pts.duckdb")
+        connection.execute(
+            "CREATE TABLE pts (latitude DOUBLE, longitude DOUBLE,"
+            " value1 DOUBLE)")
+        connection.execute(
+            "INSERT INTO pts VALUES (50, 10, 1), (-30, 140, 2),"
+            " (50.001, 10.001, 3), (-30.001, 140.001, 4)")
+        connection.close()
+        MetadataDB(database_dir).add_metadata_entry(
+            "pts", "", {},
+            {"latitude": "DOUBLE", "longitude": "DOUBLE",
+             "value1": "DOUBLE"},
+            "point")
+
+        clustering.recluster_dataset(database_dir, "pts")
+
+        connection = duckdb.connect(f"{database_dir}/pts.duckdb")
+        values = [r[0] for r in connection.execute(
+            "SELECT value1 FROM pts ORDER BY rowid").fetchall()]
+        connection.close()
+        assert set(values[:2]) in [{1, 3}, {2, 4}]
+        assert sorted(values) == [1, 2, 3, 4]
@@ -0,0 +1,178 @@
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import h3
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.geomesh import Geomesh
+from loader.output_step import LocalDuckdbOutputStep
+
+tmp_folder = "./test/test_data/connection_manager_tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+def create_db(db_path: str, values: int = 3):
+    with connection_manager.writing(db_path) as connection:
+        connection.execute("CREATE TABLE t AS SELECT range AS v"
+                           f" FROM range({values})")
+    connection_manager.close(db_path)
+
+
+class TestConnectionManager:
+
+    def test_reader_error_if_not_exists(self, database_dir):
+        with pytest.raises(ValueError):
+            connection_manager.get_reader(
+                os.path.join(database_dir, "missing.duckdb"))
+        assert not os.path.exists(
+            os.path.join(database_dir, "missing.duckdb"))
+
+    def test_readers_share_connection(self, database_dir):
+        db_path = os.path.join(database_dir, "db.duckdb")
+        create_db(db_path)
+
+        with connection_manager.reading(db_path) as first:
+            with connection_manager.reading(db_path) as second:
+                assert first.execute("SELECT count(*) FROM t") \
+                           .fetchone()[0] == 3
+                assert second.execute("SELECT count(*) FROM t") \
+                           .fetchone()[0] == 3
+                # same cached connection regardless of how the path is
+                #  written
+                with connection_manager.reading(
+                        os.path.abspath(db_path)) as third:
+                    third.execute("SELECT count(*) FROM t").fetchone()
+                    assert len(connection_manager._connections) == 1
+        # released once the last reader is closed
+        assert len(connection_manager._connections) == 0
+
+    def test_writer_error_while_reading(self, database_dir):
+        db_path = os.path.join(database_dir, "db.duckdb")
+        create_db(db_path)
+
+        reader = connection_manager.get_reader(db_path)
+        with pytest.raises(ValueError):
+            connection_manager.get_writer(db_path)
+        assert reader.execute("SELECT count(*) FROM t").fetchone()[0] == 3
+        reader.close()
+        with connection_manager.writing(db_path) as connection:
+            connection.execute("INSERT INTO t VALUES (10)")
+
+    def test_other_process_writes_while_geomesh_alive(self, database_dir):
+        cells = list(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 4), 1))
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "ds",
+        }).write(DataFrame({
+            "h3_cell": cells,
+            "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": [1.0] * len(cells),
+        }))
+        connection_manager.close_all()
+        geomesh = Geomesh(database_dir)
+        out = geomesh.bounding_box_get(
+            "ds", 4, 40.0, 50.0, -80.0, -70.0, None, None, None)
+        assert len(out) == len(cells)
+
+        db_path = os.path.join(database_dir, "ds.duckdb")
+        write = (
+            "import duckdb\n"
+            f"connection = duckdb.connect({db_path!r})\n"
+            "connection.execute('UPDATE ds SET value1 = 2.0')\n"
+            "connection.close()\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", write], capture_output=True, text=True)
+
+        assert result.returncode == 0, result.stderr
+        with connection_manager.reading(db_path) as connection:
+            assert connection.execute(
+                "SELECT DISTINCT value1 FROM ds").fetchall() == [(2.0,)]
+
+    def test_writer_replaces_read_only_connection(self, database_dir):
+        db_path = os.path.join(database_dir, "db.duckdb")
+        create_db(db_path)
+
+        with connection_manager.reading(db_path) as connection:
+            connection.execute("SELECT * FROM t").fetchall()
+        with connection_manager.writing(db_path) as connection:
+            connection.execute("INSERT INTO t VALUES (10)")
+        # readers now use the read-write connection, and see the write
+        with connection_manager.reading(db_path) as connection:
+            assert connection.execute("SELECT count(*) FROM t") \
+                       .fetchone()[0] == 4
+
+    def test_reopen_after_file_replaced(self, database_dir):
+        db_path = os.path.join(database_dir, "db.duckdb")
+        create_db(db_path, 3)
+        with connection_manager.reading(db_path) as connection:
+            connection.execute("SELECT * FROM t").fetchall()
+
+        # replace the file without going through the manager
+        replacement = os.path.join(database_dir, "other.duckdb")
+        create_db(replacement, 5)
+        os.replace(replacement, db_path)
+
+        with connection_manager.reading(db_path) as connection:
+            assert connection.execute("SELECT count(*) FROM t") \
+                       .fetchone()[0] == 5
+
+    def test_concurrent_reads_and_writes(self, database_dir):
+        db_path = os.path.join(database_dir, "db.duckdb")
+        create_db(db_path, 0)
+        # a process that writes holds a read-write connection, which
+        #  readers share
+        connection_manager.get_writer(db_path).close()
+        errors = []
+
+        def write(start: int):
+            try:
+                for i in range(start, start + 20):
+                    with connection_manager.writing(db_path) as connection:
+                        connection.execute("INSERT INTO t VALUES (?)", [i])
+            except Exception as e:
+                errors.append(e)
+
+        def read():
+            try:
+                for _ in range(20):
+                    with connection_manager.reading(db_path) as connection:
+                        connection.execute("SELECT count(*) FROM t") \
+                            .fetchone()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(i * 100,))
+                   for i in range(2)] + \
+                  [threading.Thread(target=read) for _ in range(2)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert errors == []
+        with connection_manager.reading(db_path) as connection:
+            assert connection.execute("SELECT count(*) FROM t") \
+                       .fetchone()[0] == 40
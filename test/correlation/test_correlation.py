@@ -0,0 +1,144 @@
+import gc
+import os
+import shutil
+import time
+
+import h3
+import pyarrow.parquet
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.correlation import DatasetCorrelator
+from loader.output_step import LocalDuckdbOutputStep, \
+    LocalParquetOutputStep
+
+tmp_folder = "./test/test_data/correlation/tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.fixture()
+def cells():
+    return sorted(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 6), 1))
+
+
+@pytest.fixture()
+def datasets(database_dir, cells):
+    # hazard covers every cell for two years, readings covers two cells
+    #  for one year, with two readings in the first cell
+    LocalDuckdbOutputStep({
+        "database_dir": database_dir,
+        "dataset_name": "hazard",
+        "key_columns": ["year"],
+        "pyramid_min_resolution": 5,
+    }).write(DataFrame({
+        "h3_cell": cells * 2,
+        "year": [2020] * len(cells) + [2021] * len(cells),
+        "latitude": [h3.h3_to_geo(c)[0] for c in cells] * 2,
+        "longitude": [h3.h3_to_geo(c)[1] for c in cells] * 2,
+        "value1": [float(i) for i in range(2 * len(cells))],
+    }))
+    point_locs = [h3.h3_to_geo(cells[0]), h3.h3_to_geo(cells[0]),
+                  h3.h3_to_geo(cells[1])]
+    LocalParquetOutputStep({
+        "database_dir": database_dir,
+        "dataset_name": "readings",
+        "dataset_type": "point",
+        "key_columns": ["year"],
+        "partition_resolution": 4,
+    }).write(DataFrame({
+        "latitude": [p[0] for p in point_locs],
+        "longitude": [p[1] for p in point_locs],
+        "year": [2020] * 3,
+        "res6": [h3.geo_to_h3(p[0], p[1], 6) for p in point_locs],
+        "reading": [1.0, 3.0, 5.0],
+    }))
+
+
+class TestCorrelation:
+
+    def test_correlate_same_resolution(self, database_dir, cells, datasets):
+        correlator = DatasetCorrelator(database_dir)
+
+        out = correlator.correlate_table(["hazard", "readings"], 6)
+        assert out.column_names == \
+            ["h3_cell", "year", "hazard_value1", "readings_reading"]
+        assert sorted(out.to_pylist(), key=lambda r: r["h3_cell"]) == [
+            {"h3_cell": cells[0], "year": 2020,
+             "hazard_value1": 0.0, "readings_reading": 2.0},
+            {"h3_cell": cells[1], "year": 2020,
+             "hazard_value1": 1.0, "readings_reading": 5.0},
+        ]
+
+        left = correlator.correlate_table(
+            ["hazard", "readings"], 6, how="left", year=2021)
+        assert left.num_rows == len(cells)
+        assert left["readings_reading"].null_count == len(cells)
+
+    def test_correlate_rolls_up_and_down(self, database_dir, cells, datasets):
+        correlator = DatasetCorrelator(database_dir)
+
+        up = correlator.correlate_table(["readings", "hazard"], 5, year=2020)
+        parent = h3.h3_to_parent(cells[0], 5)
+        up_rows = dict((r["h3_cell"], r) for r in up.to_pylist())
+        assert h3.h3_to_parent(cells[1], 5) in up_rows
+        assert up_rows[parent]["readings_reading"] == pytest.approx(
+            3.0 if h3.h3_to_parent(cells[1], 5) == parent else 2.0)
+
+        down = correlator.correlate_table(
+            ["hazard", "readings"], 7, value_columns={"hazard": ["value1"]})
+        children = h3.h3_to_children(cells[0], 7)
+        down_rows = [r for r in down.to_pylist() if r["h3_cell"] in children]
+        assert len(down_rows) == len(children)
+        assert all(r["hazard_value1"] == 0.0 and r["readings_reading"] == 2.0
+                   for r in down_rows)
+
+    def test_correlate_to_parquet(self, database_dir, datasets):
+        correlator = DatasetCorrelator(database_dir)
+        out_file = os.path.join(database_dir, "out.parquet")
+
+        written = correlator.correlate_to_parquet(
+            ["hazard", "readings"], 6, out_file, how="full")
+
+        table = pyarrow.parquet.read_table(out_file)
+        expected = correlator.correlate_table(
+            ["hazard", "readings"], 6, how="full")
+        sort_keys = [("h3_cell", "ascending"), ("year", "ascending")]
+        assert written == table.num_rows == 14
+        assert table.sort_by(sort_keys).to_pylist() == \
+            expected.sort_by(sort_keys).to_pylist()
+        with pytest.raises(ValueError):
+            correlator.correlate_to_parquet(
+                ["hazard", "readings"], 6, out_file)
+        with pytest.raises(ValueError):
+            correlator.correlate_table(["hazard", "readings"], 6, how="cross")
+
+    def test_correlate_leaves_writers_open(self, database_dir, datasets):
+        writer = connection_manager.get_writer(
+            os.path.join(database_dir, "hazard.duckdb"))
+        try:
+            writer.execute("UPDATE hazard SET value1 = value1 + 100")
+            out = DatasetCorrelator(database_dir).correlate_table(
+                ["hazard"], 6, year=2020)
+
+            # the connection shared with the writer is not closed, and the
+            #  written rows are correlated
+            assert writer.execute(
+                "SELECT min(value1) FROM hazard").fetchone()[0] == 100.0
+            assert min(out["hazard_value1"].to_pylist()) == 100.0
+        finally:
+            writer.close()
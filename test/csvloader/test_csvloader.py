@@ -14,6 +14,9 @@ import unittest
 import duckdb
 import h3
 
+from common import connection_manager, csvutils
+from geoserver.metadata import MetadataDB
+from loader import clustering
 from loader.loader_factory import LoaderFactory
 
 
@@ -29,6 +32,7 @@ class TestCSVLoader(unittest.TestCase):
     def tearDown(self) -> None:
         # needed as databases only release lock on files when garbage collected
         #  without this, the delete operation will fail due to file locks
+        connection_manager.close_all()
         gc.collect()
         time.sleep(0.1)
         if os.path.exists(self.tmp_folder):
@@ -235,3 +239,275 @@ class TestCSVLoader(unittest.TestCase):
             ValueError,
             trycreate
         )
+
+    def test_header_row_skipped(self):
+        config_path = "./test/test_data/csvloader/point_with_header_conf.yml"
+        loader = LoaderFactory.create_loader(config_path)
+
+        loader.load()
+
+        ds_name = loader.get_config().dataset_name
+        database_path = os.path.join(self.database_dir, f"{ds_name}.duckdb")
+        connection = duckdb.connect(database_path)
+
+        results = connection.execute(
+            f"select longitude, latitude, mydata from {ds_name}"
+        ).fetchall()
+
+        self.assertEqual(
+            {(50.0, 50.0, 1.0), (51.0, 51.0, 1000.0), (49.5, 49.5, 0.5)},
+            set(results)
+        )
+
+    def test_chunked_point_dataset_matches_unchunked(self):
+        loader = LoaderFactory.create_loader(
+            "./test/test_data/csvloader/point_no_header_conf.yml")
+        loader.load()
+        chunked_loader = LoaderFactory.create_loader(
+            "./test/test_data/csvloader/point_no_header_chunked_conf.yml")
+        chunked_loader.load()
+
+        def read_all(ds_name: str):
+            database_path = os.path.join(
+                self.database_dir, f"{ds_name}.duckdb")
+            connection = duckdb.connect(database_path)
+            return set(connection.execute(
+                f"select latitude, longitude, mydata, res0, res1, res2"
+                f" from {ds_name}"
+            ).fetchall())
+
+        expected = read_all(loader.get_config().dataset_name)
+        actual = read_all(chunked_loader.get_config().dataset_name)
+
+        self.assertEqual(5, len(actual))
+        self.assertEqual(expected, actual)
+
+    def test_chunked_point_dataset_failing_chunk(self):
+        csv_path = os.path.join(self.tmp_folder, "bad_last_chunk.csv")
+        with open(csv_path, "w") as f:
+            for i in range(10000):
+                f.write(f"{i % 90},{i % 90},{i * 0.5}\n")
+            # a missing value, only read in the last chunk
+            f.write("10.0,10.0,\n")
+        config_path = os.path.join(self.tmp_folder, "bad_last_chunk.yml")
+        with open(config_path, "w") as f:
+            f.write(
+                "loader_type: CSVLoader\n"
+                "dataset_name: bad_last_chunk\n"
+                "dataset_type: point\n"
+                f"database_dir: {self.database_dir}\n"
+                "interval: one_time\n"
+                "max_resolution: 1\n"
+                "data_columns: [mydata]\n"
+                f"file_path: {csv_path}\n"
+                "has_header_row: false\n"
+                "columns:\n"
+                "  longitude: float\n"
+                "  latitude: float\n"
+                "  mydata: float\n"
+                "mode: create\n"
+                "chunk_size: 2048\n"
+                "max_parallelism: 1\n"
+            )
+        loader = LoaderFactory.create_loader(config_path)
+
+        self.assertRaises(ValueError, loader.load)
+
+        # chunks read before the failing one are not left in the table
+        connection_manager.close_all()
+        connection = duckdb.connect(
+            os.path.join(self.database_dir, "bad_last_chunk.duckdb"))
+        tables = connection.execute(
+            "select table_name from duckdb_tables()").fetchall()
+        connection.close()
+        self.assertEqual([], tables)
+        self.assertFalse(MetadataDB(self.database_dir).ds_meta_exists(
+            "bad_last_chunk"))
+
+    def test_chunked_point_dataset_clustered(self):
+        csv_path = os.path.join(self.tmp_folder, "many_points.csv")
+        with open(csv_path, "w") as f:
+            for i in range(5000):
+                f.write(f"{(i * 7) % 360 - 180},{(i * 13) % 180 - 90},{i}\n")
+        config_path = os.path.join(self.tmp_folder, "many_points.yml")
+        with open(config_path, "w") as f:
+            f.write(
+                "loader_type: CSVLoader\n"
+                "dataset_name: many_points\n"
+                "dataset_type: point\n"
+                f"database_dir: {self.database_dir}\n"
+                "interval: one_time\n"
+                "max_resolution: 0\n"
+                "data_columns: [mydata]\n"
+                f"file_path: {csv_path}\n"
+                "has_header_row: false\n"
+                "columns:\n"
+                "  longitude: float\n"
+                "  latitude: float\n"
+                "  mydata: float\n"
+                "mode: create\n"
+                "chunk_size: 2048\n"
+            )
+        LoaderFactory.create_loader(config_path).load()
+
+        connection_manager.close_all()
+        connection = duckdb.connect(
+            os.path.join(self.database_dir, "many_points.duckdb"))
+        stored = connection.execute(
+            "select latitude, longitude from many_points order by rowid"
+        ).df()
+        everything = connection.execute(
+            "select latitude, longitude, mydata from many_points").df()
+        connection.close()
+
+        # rows are clustered across the whole table, not only within
+        #  each chunk
+        expected = clustering.sort_for_storage(everything, [])
+        self.assertEqual(
+            expected[["latitude", "longitude"]].values.tolist(),
+            stored.values.tolist())
+
+    def test_read_chunks_streams_whole_file(self):
+        csv_path = os.path.join(self.tmp_folder, "many_rows.csv")
+        with open(csv_path, "w") as f:
+            for i in range(5000):
+                f.write(f"{i},{i % 90},{i * 0.5}\n")
+
+        columns = {"id": "int", "latitude": "float", "mydata": "float"}
+        chunks = list(csvutils.read_typed_csv_chunks(
+            csv_path, columns, False, 2048))
+
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(5000, sum(len(c) for c in chunks))
+        self.assertEqual(list(range(5000)),
+                         [i for c in chunks for i in c["id"].tolist()])
+        self.assertEqual(["id", "latitude", "mydata"],
+                         list(chunks[0].columns))
+
+    def test_empty_fields(self):
+        csv_path = os.path.join(self.tmp_folder, "empty_fields.csv")
+        with open(csv_path, "w") as f:
+            f.write('a,1,1.5\n,2,2.5\n"",3,3.5\n')
+        columns = {"name": "str", "id": "int", "mydata": "float"}
+
+        df = csvutils.read_typed_csv(csv_path, columns, False)
+
+        # empty strings are kept rather than read as missing values
+        self.assertEqual(["a", "", ""], df["name"].tolist())
+        self.assertEqual([1, 2, 3], df["id"].tolist())
+
+        with open(csv_path, "w") as f:
+            f.write("a,1,1.5\nb,,2.5\n")
+        self.assertRaises(
+            ValueError,
+            csvutils.read_typed_csv, csv_path, columns, False
+        )
+        with open(csv_path, "w") as f:
+            f.write("a,1,\n")
+        self.assertRaises(
+            ValueError,
+            lambda: list(csvutils.read_typed_csv_chunks(
+                csv_path, columns, False, 2048))
+        )
+
+    def test_fails_on_wrong_column_count(self):
+        config_path = \
+            "./test/test_data/csvloader/invalid/wrong_column_count_conf.yml"
+        loader = LoaderFactory.create_loader(config_path)
+
+        self.assertRaises(
+            ValueError,
+            loader.load
+        )
+
+    def test_h3_merge_updates_changed_cells(self):
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/h3_no_header_conf.yml").load()
+
+        database_path = os.path.join(
+            self.database_dir, "h3_no_header.duckdb")
+        connection = duckdb.connect(database_path)
+        before = dict(connection.execute(
+            "select h3_cell, mydata from h3_no_header_2").fetchall())
+
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/h3_no_header_merge_conf.yml").load()
+
+        after = dict(connection.execute(
+            "select h3_cell, mydata from h3_no_header_2").fetchall())
+
+        self.assertEqual(before.keys(), after.keys())
+        changed = h3.geo_to_h3(51.0, 51.0, 2)
+        self.assertGreater(after[changed], before[changed])
+        unchanged = h3.geo_to_h3(50.0, 50.0, 2)
+        self.assertEqual(before[unchanged], after[unchanged])
+
+    def test_merge_not_allowed_for_point_dataset(self):
+        config_path = "./test/test_data/csvloader/invalid/" \
+                      "point_merge_conf.yml"
+
+        def trycreate():
+            LoaderFactory.create_loader(config_path)
+
+        self.assertRaises(
+            ValueError,
+            trycreate
+        )
+
+    def test_insert_only_loads_new_time_slices(self):
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/yearly_create_conf.yml").load()
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/yearly_insert_conf.yml").load()
+
+        database_path = os.path.join(self.database_dir, "yearly.duckdb")
+        connection = duckdb.connect(database_path)
+
+        for res, num_cells in [(0, 122), (1, 842)]:
+            counts = connection.execute(
+                f"select year, count(*) from yearly_{res}"
+                f" group by year order by year"
+            ).fetchall()
+            self.assertEqual([(2020, num_cells), (2021, num_cells)], counts)
+
+        # 2020 values come from the first load, not the second file
+        cell = h3.geo_to_h3(50.0, 50.0, 1)
+        val_2020 = connection.execute(
+            f"select mydata from yearly_1"
+            f" where h3_cell = '{cell}' and year = 2020"
+        ).fetchone()[0]
+        self.assertTrue(val_2020 < 1000)
+
+    def test_insert_appends_by_default(self):
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/yearly_create_conf.yml").load()
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/yearly_insert_append_conf.yml"
+        ).load()
+
+        database_path = os.path.join(self.database_dir, "yearly.duckdb")
+        connection = duckdb.connect(database_path)
+
+        # slices already present are inserted again, as before
+        #  overlap_handling was added
+        counts = connection.execute(
+            "select year, count(*) from yearly_0 group by year order by year"
+        ).fetchall()
+        self.assertEqual([(2020, 2 * 122), (2021, 122)], counts)
+
+    def test_insert_overlap_error(self):
+        LoaderFactory.create_loader(
+            "./test/test_data/csvloader/yearly_create_conf.yml").load()
+
+        def tryinsert():
+            LoaderFactory.create_loader(
+                "./test/test_data/csvloader/yearly_insert_error_conf.yml"
+            ).load()
+
+        self.assertRaises(ValueError, tryinsert)
+
+        database_path = os.path.join(self.database_dir, "yearly.duckdb")
+        connection = duckdb.connect(database_path)
+        years = connection.execute(
+            "select distinct year from yearly_0").fetchall()
+        self.assertEqual([(2020,)], years)
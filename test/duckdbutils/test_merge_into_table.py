@@ -0,0 +1,55 @@
+import duckdb
+
+from common import duckdbutils
+
+
+def create_tables(
+        connection: duckdb.DuckDBPyConnection,
+        target_rows: str,
+        source_rows: str
+) -> None:
+    for table, rows in [("target", target_rows), ("source", source_rows)]:
+        connection.execute(
+            f"CREATE TABLE {table} (cell VARCHAR, year INTEGER, v DOUBLE)")
+        connection.execute(f"INSERT INTO {table} VALUES {rows}")
+
+
+class TestMergeIntoTable:
+
+    def test_merge(self):
+        connection = duckdb.connect()
+        create_tables(
+            connection,
+            "('a', 2020, 1.0), ('b', 2020, 2.0), ('c', 2020, 3.0)",
+            "('a', 2020, 1.0), ('b', 2020, 5.0), ('d', 2020, 4.0)"
+        )
+
+        counts = duckdbutils.merge_into_table(
+            connection, "target", "source", ["cell", "year"],
+            delete_missing=True)
+
+        assert counts == \
+               {"inserted": 1, "updated": 1, "deleted": 1, "unchanged": 1}
+        assert connection.execute(
+            "SELECT * FROM target ORDER BY cell").fetchall() == \
+               [("a", 2020, 1.0), ("b", 2020, 5.0), ("d", 2020, 4.0)]
+
+    def test_null_keys_match(self):
+        connection = duckdb.connect()
+        create_tables(
+            connection,
+            "('a', NULL, 1.0), ('b', NULL, 2.0), ('c', 2020, 3.0)",
+            "('a', NULL, 1.0), ('b', NULL, 5.0)"
+        )
+
+        counts = duckdbutils.merge_into_table(
+            connection, "target", "source", ["cell", "year"],
+            delete_missing=True, delete_scope_cols=["year"])
+
+        # rows with NULL keys are updated or left alone rather than
+        #  inserted again, and only rows in the NULL year are deleted
+        assert counts == \
+               {"inserted": 0, "updated": 1, "deleted": 0, "unchanged": 1}
+        assert connection.execute(
+            "SELECT * FROM target ORDER BY cell").fetchall() == \
+               [("a", None, 1.0), ("b", None, 5.0), ("c", 2020, 3.0)]
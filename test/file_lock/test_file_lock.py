@@ -0,0 +1,154 @@
+import gc
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import threading
+import time
+
+import duckdb
+import pytest
+
+from common import connection_manager
+from common.file_lock import FileLock
+from geoserver.metadata import MetadataDB, METADATA_LOCK_NAME
+
+tmp_folder = "./test/test_data/file_lock_tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+def add_entry(database_dir: str, dataset_name: str):
+    MetadataDB(database_dir).add_metadata_entry(
+        dataset_name, "", {}, {"value1": "DOUBLE"}, "point")
+
+
+def hold_metadata_db(database_dir: str, seconds: float):
+    # keeps the metadata database open for writing without the lock file,
+    #  as an older loader would
+    connection = duckdb.connect(
+        os.path.join(database_dir, "dataset_metadata.duckdb"))
+    time.sleep(seconds)
+    connection.close()
+
+
+class TestFileLock:
+
+    def test_acquire_release(self, database_dir):
+        lock_path = os.path.join(database_dir, "test.lock")
+        with FileLock(lock_path):
+            assert os.path.exists(lock_path)
+            with pytest.raises(ValueError):
+                FileLock(lock_path, timeout=0.2).acquire()
+        assert not os.path.exists(lock_path)
+
+    def test_reacquire_in_same_thread_fails_fast(self, database_dir):
+        lock_path = os.path.join(database_dir, "test.lock")
+        with FileLock(lock_path):
+            start = time.monotonic()
+            with pytest.raises(ValueError):
+                FileLock(lock_path, timeout=10).acquire()
+            assert time.monotonic() - start < 5
+
+            # other threads wait for the lock as usual
+            errors = []
+
+            def acquire():
+                try:
+                    FileLock(lock_path, timeout=0.2).acquire()
+                except ValueError as e:
+                    errors.append(e)
+
+            thread = threading.Thread(target=acquire)
+            thread.start()
+            thread.join()
+            assert len(errors) == 1
+        with FileLock(lock_path, timeout=1):
+            pass
+
+    def test_breaks_lock_of_dead_process(self, database_dir):
+        lock_path = os.path.join(database_dir, "test.lock")
+        process = multiprocessing.Process(target=time.sleep, args=(0,))
+        process.start()
+        process.join()
+        with open(lock_path, "w") as f:
+            json.dump({"host": socket.gethostname(), "pid": process.pid,
+                       "time": time.time()}, f)
+
+        with FileLock(lock_path, timeout=1):
+            pass
+
+    def test_breaks_lock_older_than_stale_after(self, database_dir):
+        lock_path = os.path.join(database_dir, "test.lock")
+        with open(lock_path, "w") as f:
+            json.dump({"host": "other-host", "pid": 1,
+                       "time": time.time() - 100}, f)
+
+        with pytest.raises(ValueError):
+            FileLock(lock_path, timeout=0.2).acquire()
+        with FileLock(lock_path, timeout=1, stale_after=50):
+            pass
+
+
+class TestConcurrentMetadataWrites:
+
+    def test_parallel_processes_all_register(self, database_dir):
+        processes = [
+            multiprocessing.Process(
+                target=add_entry, args=(database_dir, f"ds{i}"))
+            for i in range(6)
+        ]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+        assert [p.exitcode for p in processes] == [0] * 6
+        names = set(m["dataset_name"]
+                    for m in MetadataDB(database_dir).show_meta())
+        assert names == set(f"ds{i}" for i in range(6))
+        assert not os.path.exists(
+            os.path.join(database_dir, METADATA_LOCK_NAME))
+
+    def test_waits_for_database_held_by_other_process(self, database_dir):
+        add_entry(database_dir, "first")
+        holder = multiprocessing.Process(
+            target=hold_metadata_db, args=(database_dir, 1))
+        holder.start()
+        time.sleep(0.5)
+
+        add_entry(database_dir, "second")
+        holder.join()
+
+        assert MetadataDB(database_dir).ds_meta_exists("second")
+
+    def test_check_writable_fails_fast_when_locked(self, database_dir):
+        with FileLock(os.path.join(database_dir, METADATA_LOCK_NAME)):
+            start = time.monotonic()
+            with pytest.raises(ValueError):
+                MetadataDB(database_dir, lock_timeout=0.5).check_writable()
+            assert time.monotonic() - start < 5
+        MetadataDB(database_dir).check_writable()
+
+    def test_nested_write_fails_fast(self, database_dir):
+        meta_db = MetadataDB(database_dir, lock_timeout=10)
+        with meta_db._writing():
+            start = time.monotonic()
+            with pytest.raises(ValueError):
+                meta_db.check_writable()
+            assert time.monotonic() - start < 5
+        meta_db.check_writable()
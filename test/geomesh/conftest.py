@@ -0,0 +1,64 @@
+import gc
+import os
+import shutil
+import time
+from typing import Callable, List, Optional
+
+import h3
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from loader.output_step import LocalDuckdbOutputStep
+
+tmp_folder = "./test/test_data/geomesh/tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.makedirs(tmp_folder)
+
+    yield tmp_folder
+
+    # gc + delay is necessary as without manual call tests may complete
+    #  before db instances are cleaned up. This causes a file lock to persist
+    #  that prevents cleanup of the temp directory.
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.fixture()
+def write_cells(database_dir) -> Callable[..., DataFrame]:
+    """
+    Write a dataset with a row per cell, located at the cell's center, and
+    a value1 column numbering the cells unless values are given. Extra
+    keyword arguments are added to the output step's configuration.
+    """
+
+    def write(
+            dataset_name: str,
+            cells: List[str],
+            values: Optional[List[float]] = None,
+            output_step=LocalDuckdbOutputStep,
+            **conf
+    ) -> DataFrame:
+        df = DataFrame({
+            "h3_cell": cells,
+            "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": values if values is not None
+            else [float(i) for i in range(len(cells))],
+        })
+        output_step({
+            "database_dir": database_dir,
+            "dataset_name": dataset_name,
+            **conf
+        }).write(df)
+        return df
+
+    return write
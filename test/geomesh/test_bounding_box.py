@@ -0,0 +1,214 @@
+import os
+
+import h3
+import pyarrow
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.geomesh import Geomesh
+from geoserver.metadata import MetadataDB
+from loader.output_step import LocalDuckdbOutputStep, \
+    LocalParquetOutputStep
+
+
+class TestBoundingBox:
+
+    def test_bounding_box_includes_whole_cells(self, database_dir):
+        # points are matched by the cells covering the bounding box, so a
+        #  point in a covering cell is returned even if just outside the box
+        cell = h3.geo_to_h3(45.0, -75.0, 3)
+        center_lat, center_long = h3.h3_to_geo(cell)
+        vertex_lat, vertex_long = h3.h3_to_geo_boundary(cell)[0]
+        edge_point = (center_lat + 0.9 * (vertex_lat - center_lat),
+                      center_long + 0.9 * (vertex_long - center_long))
+        far_point = (center_lat + 10, center_long)
+        points = [(center_lat, center_long), edge_point, far_point]
+
+        connection = connection_manager.get_writer(
+            os.path.join(database_dir, "pts.duckdb"))
+        connection.register("points", DataFrame({
+            "latitude": [p[0] for p in points],
+            "longitude": [p[1] for p in points],
+            "res3": [h3.geo_to_h3(p[0], p[1], 3) for p in points],
+            "value1": [1.0, 2.0, 3.0],
+        }))
+        connection.execute("CREATE TABLE pts AS SELECT * FROM points")
+        connection.close()
+        MetadataDB(database_dir).add_metadata_entry(
+            "pts", "", {}, {"value1": "DOUBLE"}, "point")
+
+        geomesh = Geomesh(database_dir)
+        out = geomesh.bounding_box_get(
+            "pts", 3, center_lat - 0.01, center_lat + 0.01,
+            center_long - 0.01, center_long + 0.01, None, None, None)
+        empty = geomesh.bounding_box_get(
+            "pts", 3, -10.0, -9.99, 10.0, 10.01, None, None, None)
+
+        assert sorted(r["value1"] for r in out) == [1.0, 2.0]
+        assert empty == []
+
+    def test_bounding_box_columnar_results(self, database_dir, write_cells):
+        cells = list(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 4), 2))
+        write_cells("cols", cells)
+        geomesh = Geomesh(database_dir)
+        args = ["cols", 4, 40.0, 50.0, -80.0, -70.0, None, None, None]
+
+        rows = geomesh.bounding_box_get(*args)
+        table = geomesh.bounding_box_get_table(*args)
+        df = geomesh.bounding_box_get_df(*args)
+        batches = list(geomesh.bounding_box_get_batches(*args, batch_size=5))
+
+        assert len(rows) == len(cells)
+        assert table.column_names == \
+               ["h3_cell", "latitude", "longitude", "value1"]
+        assert table.to_pylist() == rows
+        assert df.to_dict("records") == rows
+        assert all(b.num_rows <= 5 for b in batches)
+        assert sum(b.num_rows for b in batches) == len(cells)
+
+    def test_bounding_box_cursor(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 6), 1))[:3]
+        # 5, 3 and 4 points in each cell
+        point_cells = [cells[0]] * 5 + [cells[1]] * 3 + [cells[2]] * 4
+        LocalParquetOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "cursor_points",
+            "dataset_type": "point",
+            "partition_resolution": 4,
+        }).write(DataFrame({
+            "latitude": [h3.h3_to_geo(c)[0] for c in point_cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in point_cells],
+            "res6": point_cells,
+            "reading": [float(i) for i in range(len(point_cells))],
+        }))
+        geomesh = Geomesh(database_dir)
+        query = ("cursor_points", 6, 49.0, 51.0, 9.0, 11.0, None, None, None)
+
+        pages = []
+        token = None
+        while True:
+            page, token = geomesh.bounding_box_get_page(
+                *query, page_size=2, token=token)
+            pages.append(page)
+            if token is None:
+                break
+        paged = pyarrow.concat_tables(pages)
+
+        cursor = geomesh.bounding_box_get_cursor(
+            *query, batch_size=3, cells_per_query=1)
+        first = [next(iter(cursor)), next(iter(cursor))]
+        token = cursor.token
+        cursor.close()
+        resumed = geomesh.bounding_box_get_cursor(
+            *query, batch_size=3, token=token)
+        streamed = pyarrow.Table.from_batches(first + list(resumed))
+
+        assert [p.num_rows for p in pages] == [2, 2, 2, 2, 2, 2]
+        assert paged["h3_cell"].to_pylist() == sorted(point_cells)
+        assert sorted(paged["reading"].to_pylist()) == \
+               [float(i) for i in range(len(point_cells))]
+        assert streamed.to_pylist() == paged.to_pylist()
+        assert resumed.token is None
+        with pytest.raises(ValueError):
+            geomesh.bounding_box_get_page(
+                "cursor_points", 6, 49.0, 50.5, 9.0, 11.0, None, None, None,
+                page_size=2, token=token)
+        with pytest.raises(ValueError):
+            geomesh.bounding_box_get_cursor(*query, token="not a token")
+
+    def test_statistics_prune_bounding_box(self, database_dir, write_cells):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))
+        write_cells("pq_stats", cells, [1.0] * len(cells),
+                    output_step=LocalParquetOutputStep,
+                    collect_statistics=True)
+        assert MetadataDB(database_dir).get_dataset_statistics(
+            "pq_stats")["row_count"] == len(cells)
+        geomesh = Geomesh(database_dir)
+
+        calls = []
+        get_cells = geomesh._get_h3_in_boundary
+        geomesh._get_h3_in_boundary = \
+            lambda *args: calls.append(args) or get_cells(*args)
+        far = geomesh.bounding_box_get_table(
+            "pq_stats", 5, -10.0, -9.0, 10.0, 11.0, None, None, None)
+        near = geomesh.bounding_box_get_table(
+            "pq_stats", 5, 49.0, 51.0, 9.0, 11.0, None, None, None)
+
+        assert far.num_rows == 0
+        assert far.column_names == near.column_names
+        assert near.num_rows == len(cells)
+        # the far box is outside the dataset's extent, and the near box
+        #  covers all of it, so neither needs its cells listed
+        assert len(calls) == 0
+
+    def test_bounding_box_plans(self, database_dir, write_cells):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 7), 6))
+        write_cells("planned", cells, collect_statistics=True)
+        write_cells("planned_pq", cells, output_step=LocalParquetOutputStep,
+                    collect_statistics=True, partition_resolution=5)
+        geomesh = Geomesh(database_dir)
+        box = (49.95, 50.05, 9.95, 10.05)
+
+        def query(dataset_name):
+            return geomesh.bounding_box_get_table(
+                dataset_name, 7, *box, None, None, None
+            ).sort_by("h3_cell")
+
+        by_cells = query("planned")
+        cells_plan = geomesh.explain("planned", 7, *box)
+        geomesh.planner.max_cell_set = 10
+        by_range = query("planned")
+        range_plan = geomesh.explain("planned", 7, *box)
+        by_parent = query("planned_pq")
+        parent_plan = geomesh.explain("planned_pq", 7, *box)
+        scan_plan = geomesh.explain("planned", 7, 49.0, 51.0, 9.0, 11.0)
+
+        assert cells_plan["strategy"] == "cells"
+        assert range_plan["strategy"] == "range"
+        assert parent_plan["strategy"] == "parent"
+        assert parent_plan["parent_resolution"] == 5
+        assert scan_plan["strategy"] == "scan"
+        assert range_plan["estimated_cells"] > 10
+        assert 0 < range_plan["estimated_rows"] < len(cells)
+        assert 0 < by_cells.num_rows < len(cells)
+        assert by_range["h3_cell"].to_pylist() == \
+               by_cells["h3_cell"].to_pylist()
+        assert by_parent["h3_cell"].to_pylist() == \
+               by_cells["h3_cell"].to_pylist()
+        assert geomesh.bounding_box_get_table(
+            "planned", 7, 49.0, 51.0, 9.0, 11.0, None, None, None
+        ).num_rows == len(cells)
+
+    def test_bounding_box_plans_need_centroids(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 7), 6))
+        # rows are located away from their cell's center, still inside
+        #  the cell
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "shifted",
+            "collect_statistics": True,
+        }).write(DataFrame({
+            "h3_cell": cells,
+            "latitude": [h3.h3_to_geo(c)[0] + 0.003 for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": [float(i) for i in range(len(cells))],
+        }))
+        geomesh = Geomesh(database_dir)
+        geomesh.planner.max_cell_set = 10
+        box = (49.95, 50.05, 9.95, 10.05)
+
+        plan = geomesh.explain("shifted", 7, *box)
+        out = geomesh.bounding_box_get_table(
+            "shifted", 7, *box, None, None, None)
+        scan_plan = geomesh.explain("shifted", 7, 49.0, 51.0, 9.0, 11.0)
+
+        assert MetadataDB(database_dir).get_dataset_statistics(
+            "shifted")["centroids"] is False
+        assert plan["strategy"] == "cells"
+        assert scan_plan["strategy"] == "cells"
+        expected = set(
+            c for c in cells
+            if box[0] <= h3.h3_to_geo(c)[0] <= box[1]
+            and box[2] <= h3.h3_to_geo(c)[1] <= box[3])
+        assert set(out["h3_cell"].to_pylist()) == expected
@@ -0,0 +1,50 @@
+import h3
+import pytest
+from pandas import DataFrame
+
+from geoserver.geomesh import Geomesh
+from loader.output_step import LocalParquetOutputStep
+
+
+class TestPointLookup:
+
+    def test_point_lookup(self, database_dir, write_cells):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 6), 1))
+        write_cells("hazard", cells)
+        # two points in the first cell, one in the second
+        point_locs = [h3.h3_to_geo(cells[0]), h3.h3_to_geo(cells[0]),
+                      h3.h3_to_geo(cells[1])]
+        LocalParquetOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "readings",
+            "dataset_type": "point",
+            "partition_resolution": 4,
+        }).write(DataFrame({
+            "latitude": [p[0] for p in point_locs],
+            "longitude": [p[1] for p in point_locs],
+            "res6": [h3.geo_to_h3(p[0], p[1], 6) for p in point_locs],
+            "reading": [1.0, 3.0, 5.0],
+        }))
+
+        assets = DataFrame({
+            "id": ["c", "a", "b", "far"],
+            "latitude": [h3.h3_to_geo(cells[1])[0],
+                         h3.h3_to_geo(cells[0])[0],
+                         h3.h3_to_geo(cells[2])[0], -45.0],
+            "longitude": [h3.h3_to_geo(cells[1])[1],
+                          h3.h3_to_geo(cells[0])[1],
+                          h3.h3_to_geo(cells[2])[1], 75.0],
+        })
+        out = Geomesh(database_dir).point_lookup_table(
+            assets, [("hazard", 6), ("readings", 6)])
+
+        assert out.column_names == ["id", "hazard_value1", "readings_reading"]
+        assert out.to_pylist() == [
+            {"id": "c", "hazard_value1": 1.0, "readings_reading": 5.0},
+            {"id": "a", "hazard_value1": 0.0, "readings_reading": 2.0},
+            {"id": "b", "hazard_value1": 2.0, "readings_reading": None},
+            {"id": "far", "hazard_value1": None, "readings_reading": None},
+        ]
+        with pytest.raises(ValueError):
+            Geomesh(database_dir).point_lookup_table(
+                assets, [("hazard", 6), ("hazard", 5)])
@@ -0,0 +1,72 @@
+import h3
+
+from geoserver.geomesh import Geomesh
+
+
+class TestRadius:
+
+    def test_radius_get(self, database_dir, write_cells):
+        center = h3.geo_to_h3(45.0, -75.0, 6)
+        cells = list(h3.k_ring(center, 6))
+        write_cells("rad", cells, [1.0] * len(cells))
+        geomesh = Geomesh(database_dir)
+        lat, long = h3.h3_to_geo(center)
+        radius_km = 15.0
+
+        exact = geomesh.radius_get(
+            "rad", 6, lat, long, radius_km, None, None, None)
+        ring = geomesh.radius_get_table(
+            "rad", 6, lat, long, radius_km, None, None, None, exact=False)
+
+        expected = set(
+            c for c in cells
+            if h3.point_dist((lat, long), h3.h3_to_geo(c), unit="km")
+            <= radius_km)
+        assert set(r["h3_cell"] for r in exact) == expected
+        assert expected < set(ring["h3_cell"].to_pylist()) <= set(cells)
+        tiny = geomesh.radius_get(
+            "rad", 6, lat, long, 0.0, None, None, None)
+        assert [r["h3_cell"] for r in tiny] == [center]
+
+    def test_radius_get_many(self, database_dir, write_cells):
+        center = h3.geo_to_h3(45.0, -75.0, 6)
+        cells = list(h3.k_ring(center, 6))
+        write_cells("rad", cells, [1.0] * len(cells))
+        geomesh = Geomesh(database_dir)
+        neighbour = sorted(h3.k_ring(center, 1) - {center})[0]
+        centers = [h3.h3_to_geo(center), h3.h3_to_geo(neighbour),
+                   (-45.0, 75.0)]
+
+        queried = []
+        execute = geomesh._execute_cells_query
+        geomesh._execute_cells_query = \
+            lambda *args, **kwargs: queried.append(args[5]) or \
+            execute(*args, **kwargs)
+        table = geomesh.radius_get_many_table(
+            "rad", 6, centers, 10.0, None, None, None)
+
+        by_center = [
+            set(geomesh.radius_get_df(
+                "rad", 6, c[0], c[1], 10.0, None, None, None)["h3_cell"])
+            for c in centers
+        ]
+        rows = table.select(["center_index", "h3_cell"]).to_pylist()
+        for i, cell_set in enumerate(by_center):
+            assert set(r["h3_cell"] for r in rows
+                       if r["center_index"] == i) == cell_set
+        assert by_center[2] == set()
+        # cells shared by the first two centers are queried once
+        center_cells = geomesh._get_cells_in_radius(6, centers, 10.0, True)
+        assert sorted(queried[0]) == sorted(set(c for _, c in center_cells))
+        assert len(queried[0]) < len(center_cells)
+
+    def test_ring_size_covers_radius(self):
+        for res in [3, 6, 9]:
+            for radius_km in [0.0, 1.0, 25.0, 100.0]:
+                k = Geomesh.get_ring_size(res, radius_km)
+                center = h3.geo_to_h3(45.0, -75.0, res)
+                outer = h3.hex_ring(center, k + 1)
+                nearest = min(
+                    h3.point_dist(h3.h3_to_geo(center), h3.h3_to_geo(c),
+                                  unit="km") for c in outer)
+                assert nearest > radius_km
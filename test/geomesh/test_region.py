@@ -0,0 +1,60 @@
+import h3
+import pytest
+import shapely
+from pandas import DataFrame
+
+from geoserver.geomesh import Geomesh
+from loader.output_step import LocalDuckdbOutputStep
+
+data_dir = "./test/test_data/loading_pipeline/"
+
+
+class TestRegion:
+
+    def test_region_get(self, database_dir):
+        # a triangle, so many cells cross its boundary
+        region = shapely.Polygon([(10.0, 50.0), (11.0, 50.0), (10.0, 51.0)])
+        # offset so no point is on the boundary, where float precision
+        #  would decide whether it is inside
+        lats = [49.913 + 0.05 * i for i in range(25)]
+        longs = [9.913 + 0.05 * i for i in range(25)]
+        points = [(lat, long) for lat in lats for long in longs]
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "region_pts",
+            "dataset_type": "point",
+        }).write(DataFrame({
+            "latitude": [p[0] for p in points],
+            "longitude": [p[1] for p in points],
+            "res5": [h3.geo_to_h3(p[0], p[1], 5) for p in points],
+            "value1": [float(i) for i in range(len(points))],
+        }))
+        geomesh = Geomesh(database_dir)
+
+        out = geomesh.region_get_table(
+            "region_pts", 5, region, None, None, None)
+
+        expected = set(
+            float(i) for i, (lat, long) in enumerate(points)
+            if region.contains(shapely.Point(long, lat)))
+        assert set(out["value1"].to_pylist()) == expected
+        interior, boundary = geomesh._get_cells_in_region(5, region)
+        assert len(interior) > 0 and len(boundary) > 0
+
+    def test_shapefile_get(self, database_dir, write_cells):
+        shapefile = f"{data_dir}/Germany_Cuba_Box/Germany_Cuba_Box.shp"
+        cells = [h3.geo_to_h3(50.0, 10.0, 4), h3.geo_to_h3(21.0, -80.0, 4),
+                 h3.geo_to_h3(0.0, 0.0, 4)]
+        write_cells("shp", cells, [1.0, 2.0, 3.0])
+        geomesh = Geomesh(database_dir)
+
+        germany = geomesh.shapefile_get_df(
+            "shp", 4, shapefile, "Germany", None, None, None)
+        both = geomesh.shapefile_get_table(
+            "shp", 4, shapefile, None, None, None, None)
+
+        assert germany["value1"].tolist() == [1.0]
+        assert sorted(both["value1"].to_pylist()) == [1.0, 2.0]
+        with pytest.raises(ValueError):
+            geomesh.shapefile_get_table(
+                "shp", 4, shapefile, "Atlantis", None, None, None)
@@ -0,0 +1,85 @@
+import h3
+import pytest
+from pandas import DataFrame
+
+from geoserver.geomesh import Geomesh
+from geoserver.query_cache import QueryResultCache
+from geoserver.time_filter import TimeRange
+from loader.output_step import LocalDuckdbOutputStep
+
+
+class TestTimeFilters:
+
+    def test_time_range_filters(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))
+        rows = [
+            (c, year, month) for c in cells
+            for year in range(2000, 2004) for month in range(1, 13)
+        ]
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "monthly",
+            "key_columns": ["year", "month"],
+        }).write(DataFrame({
+            "h3_cell": [r[0] for r in rows],
+            "year": [r[1] for r in rows],
+            "month": [r[2] for r in rows],
+            "latitude": [h3.h3_to_geo(r[0])[0] for r in rows],
+            "longitude": [h3.h3_to_geo(r[0])[1] for r in rows],
+            "value1": [float(r[1] * 100 + r[2]) for r in rows],
+        }))
+        geomesh = Geomesh(database_dir, QueryResultCache())
+
+        ranged = geomesh.bounding_box_get_table(
+            "monthly", 5, 49.0, 51.0, 9.0, 11.0,
+            TimeRange(2001, 2002), [3, 1], None)
+        listed = geomesh.bounding_box_get_table(
+            "monthly", 5, 49.0, 51.0, 9.0, 11.0,
+            TimeRange(2001, 2002), [1, 3], None)
+
+        assert sorted(set(ranged["value1"].to_pylist())) == \
+               [200101.0, 200103.0, 200201.0, 200203.0]
+        assert ranged.num_rows == 4 * len(cells)
+        assert listed is ranged
+        with pytest.raises(ValueError):
+            TimeRange(2002, 2001)
+        with pytest.raises(ValueError):
+            geomesh.bounding_box_get_table(
+                "monthly", 5, 49.0, 51.0, 9.0, 11.0, 2001, [], None)
+
+    def test_time_series(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))
+        rows = [
+            (c, year, month) for c in cells
+            for year in [2000, 2001] for month in [1, 2]
+        ]
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "series",
+            "key_columns": ["year", "month"],
+        }).write(DataFrame({
+            "h3_cell": [r[0] for r in rows],
+            "year": [r[1] for r in rows],
+            "month": [r[2] for r in rows],
+            "value1": [float(r[1] * 100 + r[2]) for r in rows],
+        }))
+        geomesh = Geomesh(database_dir)
+
+        long = geomesh.time_series_get_table(
+            "series", 5, cells[:2], year=TimeRange(2000, 2001), month=[2])
+        wide = geomesh.time_series_get_table(
+            "series", 5, cells[:2], layout="wide")
+
+        assert long.column_names == ["h3_cell", "year", "month", "value1"]
+        assert long.to_pylist() == [
+            {"h3_cell": c, "year": y, "month": 2, "value1": y * 100.0 + 2}
+            for c in cells[:2] for y in [2000, 2001]
+        ]
+        assert wide.column_names == [
+            "h3_cell", "value1_2000_01", "value1_2000_02", "value1_2001_01",
+            "value1_2001_02"]
+        assert wide["h3_cell"].to_pylist() == cells[:2]
+        assert wide["value1_2001_02"].to_pylist() == [200102.0, 200102.0]
+        with pytest.raises(ValueError):
+            geomesh.time_series_get_table(
+                "series", 5, cells[:2], layout="tall")
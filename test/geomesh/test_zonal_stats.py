@@ -0,0 +1,93 @@
+import h3
+import pytest
+import shapely
+from pandas import DataFrame
+
+from geoserver.geomesh import Geomesh
+from loader.output_step import LocalDuckdbOutputStep
+
+
+class TestZonalStats:
+
+    def test_zonal_stats(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 2))
+        rows = [
+            (c, year, month, float(i * month + year - 2000))
+            for i, c in enumerate(cells)
+            for year in [2000, 2001] for month in [1, 2, 3]
+        ]
+        df = DataFrame({
+            "h3_cell": [r[0] for r in rows],
+            "year": [r[1] for r in rows],
+            "month": [r[2] for r in rows],
+            "value1": [r[3] for r in rows],
+        })
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "zonal",
+            "key_columns": ["year", "month"],
+            "pyramid_min_resolution": 4,
+        }).write(df)
+        geomesh = Geomesh(database_dir)
+        zone = cells[:5]
+
+        series = geomesh.zonal_stats(
+            "zonal", 5, zone, ["count", "mean", "max", "std"],
+            group_by=["year", "month"])
+        by_cells = geomesh.zonal_stats(
+            "zonal", 5, [h3.h3_to_parent(zone[0], 4)], year=2001)
+
+        expected = df[df["h3_cell"].isin(zone)] \
+            .groupby(["year", "month"])["value1"]
+        assert series.column_names == [
+            "year", "month", "value1_count", "value1_mean", "value1_max",
+            "value1_std"]
+        assert series["value1_count"].to_pylist() == \
+               expected.count().tolist()
+        assert series["value1_mean"].to_pylist() == \
+               pytest.approx(expected.mean().tolist())
+        assert series["value1_max"].to_pylist() == expected.max().tolist()
+        assert series["value1_std"].to_pylist() == \
+               pytest.approx(expected.std().tolist())
+        children = h3.h3_to_children(h3.h3_to_parent(zone[0], 4), 5)
+        in_parent = df[df["h3_cell"].isin(children) & (df["year"] == 2001)]
+        assert by_cells.to_pylist() == [{
+            "value1_count": len(in_parent),
+            "value1_mean": pytest.approx(in_parent["value1"].mean()),
+            "value1_min": in_parent["value1"].min(),
+            "value1_max": in_parent["value1"].max(),
+        }]
+
+    def test_zonal_stats_pyramid(self, database_dir, write_cells):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 6), 4))
+        df = write_cells("zonal_pyr", cells, pyramid_min_resolution=4)
+        geomesh = Geomesh(database_dir)
+        region = shapely.box(9.9, 49.95, 10.1, 50.05)
+
+        from_pyramid = geomesh.zonal_stats(
+            "zonal_pyr", 5, region, ["count", "sum", "mean"])
+        from_base = geomesh.zonal_stats(
+            "zonal_pyr", 5, region, ["count", "sum", "mean", "median"])
+
+        # pyramid cells are matched by their centers, at resolution 5
+        level_rows = geomesh.region_get_table(
+            "zonal_pyr", 5, region, None, None, None)
+        assert from_pyramid["value1_mean"].to_pylist() == \
+               pytest.approx([
+                   from_pyramid["value1_sum"][0].as_py() /
+                   from_pyramid["value1_count"][0].as_py()])
+        assert from_pyramid["value1_count"][0].as_py() == sum(
+            len(set(h3.h3_to_children(c, 6)) & set(cells))
+            for c in level_rows["h3_cell"].to_pylist())
+        # the base table is matched point by point
+        inside = [
+            c for c in cells
+            if region.contains(shapely.Point(h3.h3_to_geo(c)[::-1]))]
+        assert from_base["value1_count"][0].as_py() == len(inside)
+        assert from_base["value1_median"][0].as_py() == \
+               pytest.approx(df[df["h3_cell"].isin(inside)]["value1"]
+                             .median())
+        with pytest.raises(ValueError):
+            geomesh.zonal_stats("zonal_pyr", 5, region, ["mode"])
+        with pytest.raises(ValueError):
+            geomesh.zonal_stats("zonal_pyr", 5, region, group_by=["year"])
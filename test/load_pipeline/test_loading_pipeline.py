@@ -1,4 +1,5 @@
 import gc
+import json
 import os
 import shutil
 import time
@@ -6,16 +7,22 @@ from typing import List, Tuple, Dict, Set
 
 import duckdb
 import h3
+import pyarrow.dataset
 import pytest
+import shapely
 from pandas import DataFrame
 
-from common import const
+from common import connection_manager, const
+from geoserver.geomesh import Geomesh
+from geoserver.metadata import MetadataDB
 from loader.aggregation_step import MinAggregation, MaxAggregation
 from loader.load_pipeline import LoadingPipeline
-from loader.output_step import LocalDuckdbOutputStep
+from loader.output_step import LocalDuckdbOutputStep, \
+    LocalParquetOutputStep
 from loader.postprocessing_step import MultiplyValue
 from loader.preprocessing_step import PreprocessingStep
-from loader.reading_step import ParquetFileReader
+from loader.reading_step import ParquetFileReader, CSVFileReader, \
+    ReadingStep
 
 data_dir = "./test/test_data/loading_pipeline/"
 
@@ -33,6 +40,7 @@ def database_dir():
     # gc + delay is necessary as without manual call tests may complete
     #  before db instances are cleaned up. This causes a file lock to persist
     #  that prevents cleanup of the temp directory.
+    connection_manager.close_all()
     gc.collect()
     time.sleep(0.1)
     if os.path.exists(tmp_folder):
@@ -75,6 +83,35 @@ class AddOnePre(PreprocessingStep):
             input_df[col] = input_df[col] + 1
         return input_df
 
+class RowCountPre(PreprocessingStep):
+    # not row wise, so it must be given the whole dataset at once
+
+    def __init__(self, conf_dict: Dict[str, str]):
+        self.row_counts = []
+
+    def run(self, input_df: DataFrame) -> DataFrame:
+        self.row_counts.append(len(input_df))
+        return input_df
+
+
+class EmptyReader(ReadingStep):
+
+    def __init__(self, conf_dict: Dict[str, str]):
+        pass
+
+    def read(self) -> DataFrame:
+        return DataFrame({"latitude": [], "longitude": [], "value1": []})
+
+    def read_batches(self):
+        return iter([])
+
+    def get_data_cols(self) -> List[str]:
+        return ["value1"]
+
+    def get_key_cols(self) -> List[str]:
+        return []
+
+
 def round_floats(input: Set[Tuple]) -> Set[Tuple]:
     # database seems to result in floating point errors in some tests
     # ex. 50.1 -> 50.999956 or something
@@ -416,3 +453,429 @@ class TestLoadingPipeline:
         )]
 
         assert out == expected
+
+    def test_batches_streamed_to_output(self, database_dir):
+        csv_path = os.path.join(database_dir, "many_rows.csv")
+        with open(csv_path, "w") as f:
+            for i in range(5000):
+                f.write(f"{i % 90},{i % 180},{i}\n")
+        dataset = "streamed"
+
+        read_step = CSVFileReader({
+            "file_path": csv_path,
+            "columns": {
+                "latitude": "float",
+                "longitude": "float",
+                "value1": "int",
+            },
+            "data_columns": ["value1"],
+            "batch_size": 2048
+        })
+
+        output_step = LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": dataset,
+            "mode": "create",
+            "dataset_type": "point"
+        })
+
+        post_step = MultiplyValue({"multiply_by": 2})
+
+        pipeline = LoadingPipeline(
+            read_step, [], [], [post_step], output_step, None
+        )
+
+        pipeline.run()
+
+        out = read_temp_db(dataset)
+
+        assert len(out) == 5000
+        assert sorted(row[2] for row in out) == \
+               [i * 2 for i in range(5000)]
+        assert len(read_metadata_db(dataset)) == 1
+
+    def test_batches_not_streamed_through_whole_dataset_steps(
+            self, database_dir):
+        csv_path = os.path.join(database_dir, "many_rows.csv")
+        with open(csv_path, "w") as f:
+            for i in range(5000):
+                f.write(f"{i % 90},{i % 180},{i}\n")
+
+        read_step = CSVFileReader({
+            "file_path": csv_path,
+            "columns": {
+                "latitude": "float",
+                "longitude": "float",
+                "value1": "int",
+            },
+            "data_columns": ["value1"],
+            "batch_size": 2048
+        })
+        pre_step = RowCountPre({})
+
+        pipeline = LoadingPipeline(
+            read_step, [pre_step], [], [], LocalDuckdbOutputStep({
+                "database_dir": database_dir,
+                "dataset_name": "whole",
+                "mode": "create",
+                "dataset_type": "point"
+            }), None
+        )
+        pipeline.run()
+
+        assert pre_step.row_counts == [5000]
+        assert len(read_temp_db("whole")) == 5000
+
+    def test_aggregate_no_rows_read(self, database_dir):
+        output_step = LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "empty",
+            "mode": "create"
+        })
+
+        pipeline = LoadingPipeline(
+            EmptyReader({}), [], [MinAggregation({})], [], output_step, 1
+        )
+        pipeline.run()
+
+        assert not MetadataDB(database_dir).ds_meta_exists("empty")
+
+    def test_bulk_ingestion_matches_indexed(self, database_dir):
+        df = DataFrame({
+            "h3_cell": ["a", "b", "c"],
+            "company": ["x", "x", "y"],
+            "value1": [1.0, 2.0, 3.0],
+        })
+        for mode in ["indexed", "bulk"]:
+            LocalDuckdbOutputStep({
+                "database_dir": database_dir,
+                "dataset_name": mode,
+                "key_columns": ["company"],
+                "ingestion_mode": mode,
+            }).write_batches([df.iloc[:2], df.iloc[2:]])
+
+        assert sorted(read_temp_db("bulk")) == \
+               sorted(read_temp_db("indexed"))
+        assert read_metadata_db("bulk")[0][1:] == \
+               read_metadata_db("indexed")[0][1:]
+
+        connection = duckdb.connect(f"{tmp_folder}/bulk.duckdb")
+        indexes = connection.execute(
+            "SELECT index_name, is_unique FROM duckdb_indexes()"
+        ).fetchall()
+        connection.close()
+        assert indexes == [("bulk_key_idx", True)]
+
+    def test_bulk_ingestion_insert(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "bulk",
+            "ingestion_mode": "bulk",
+        }
+        LocalDuckdbOutputStep(conf).write(
+            DataFrame({"h3_cell": ["a"], "value1": [1.0]}))
+
+        conf["mode"] = "insert"
+        LocalDuckdbOutputStep(conf).write(
+            DataFrame({"h3_cell": ["b"], "value1": [2.0]}))
+
+        assert sorted(read_temp_db("bulk")) == [("a", 1.0), ("b", 2.0)]
+
+        with pytest.raises(ValueError):
+            LocalDuckdbOutputStep(conf).write(
+                DataFrame({"h3_cell": ["b"], "value1": [3.0]}))
+        assert sorted(read_temp_db("bulk")) == [("a", 1.0), ("b", 2.0)]
+
+        connection = duckdb.connect(f"{tmp_folder}/bulk.duckdb")
+        assert connection.execute(
+            "SELECT index_name FROM duckdb_indexes()"
+        ).fetchall() == [("bulk_key_idx",)]
+        connection.close()
+
+    def test_bulk_ingestion_duplicate_keys(self, database_dir):
+        output_step = LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "bulk_duplicate",
+            "ingestion_mode": "bulk",
+        })
+
+        with pytest.raises(ValueError):
+            output_step.write_batches([
+                DataFrame({"h3_cell": ["a", "b"], "value1": [1.0, 2.0]}),
+                DataFrame({"h3_cell": ["b"], "value1": [3.0]}),
+            ])
+
+        connection = duckdb.connect(f"{tmp_folder}/bulk_duplicate.duckdb")
+        assert connection.execute(
+            "SELECT count(*) FROM information_schema.tables"
+        ).fetchone()[0] == 0
+        connection.close()
+
+    def test_parquet_output_partitioned(self, database_dir):
+        cells = [h3.geo_to_h3(lat, 10.0, 5) for lat in [10.0, 30.0, 50.0]]
+        df = DataFrame({
+            "h3_cell": cells * 2,
+            "year": [2020] * 3 + [2021] * 3,
+            "value1": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+        })
+        LocalParquetOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "pq",
+            "key_columns": ["year"],
+            "partition_resolution": 1,
+            "partition_columns": ["year"],
+            "max_rows_per_group": 1,
+        }).write(df)
+
+        files = [
+            os.path.relpath(os.path.join(root, f), f"{tmp_folder}/pq")
+            for root, _, fs in os.walk(f"{tmp_folder}/pq") for f in fs
+        ]
+        assert len(files) == 6
+        assert all(f.startswith("h3_partition=") for f in files)
+
+        connection = duckdb.connect()
+        out = connection.execute(
+            f"SELECT h3_cell, year, value1 FROM read_parquet("
+            f"'{tmp_folder}/pq/**/*.parquet', hive_partitioning=1)"
+        ).fetchall()
+        connection.close()
+        assert sorted(out) == sorted(
+            zip(df["h3_cell"], df["year"], df["value1"]))
+
+        storage = MetadataDB(database_dir).get_storage_info("pq")
+        assert storage["storage_type"] == "parquet"
+        assert storage["storage_options"]["partition_columns"] == ["year"]
+        meta = MetadataDB(database_dir).get_ds_metadata("pq")
+        assert set(meta["key_columns"]["key"]) == {"year", "h3_cell"}
+        assert meta["value_columns"]["key"] == ["value1"]
+
+    def test_parquet_output_queried_by_geomesh(self, database_dir):
+        cells = [h3.geo_to_h3(lat, 10.0, 5) for lat in [10.0, 30.0, 50.0]]
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "pq",
+            "partition_resolution": 2,
+        }
+        df = DataFrame({
+            "h3_cell": cells,
+            "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": [1.0, 2.0, 3.0],
+        })
+        LocalParquetOutputStep(conf).write(df.iloc[:2])
+        conf["mode"] = "insert"
+        LocalParquetOutputStep(conf).write(df.iloc[2:])
+
+        out = Geomesh(database_dir).bounding_box_get(
+            "pq", 5, 25.0, 55.0, 5.0, 15.0, None, None, None)
+
+        assert set((r["h3_cell"], r["value1"]) for r in out) == \
+               {(cells[1], 2.0), (cells[2], 3.0)}
+
+    def test_statistics_collected(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "stats",
+            "collect_statistics": True,
+            "key_columns": ["year"],
+            "pyramid_min_resolution": 4,
+        }).write(DataFrame({
+            "h3_cell": cells,
+            "year": [2000 + i for i in range(len(cells))],
+            "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": [float(i) for i in range(len(cells))],
+        }))
+
+        stats = MetadataDB(database_dir).get_dataset_statistics("stats")
+
+        lats = [h3.h3_to_geo(c)[0] for c in cells]
+        assert stats["row_count"] == len(cells)
+        assert stats["resolutions"]["5"] == len(cells)
+        assert 0 < stats["resolutions"]["4"] <= len(cells)
+        assert stats["extent"]["min_lat"] == pytest.approx(min(lats))
+        assert stats["extent"]["max_lat"] == pytest.approx(max(lats))
+        assert stats["key_ranges"]["year"] == {
+            "min": 2000, "max": 2000 + len(cells) - 1}
+        value1 = stats["columns"]["value1"]
+        assert (value1["min"], value1["max"]) == (0.0, len(cells) - 1)
+        assert value1["mean"] == pytest.approx((len(cells) - 1) / 2)
+        assert sum(value1["histogram"]["counts"]) == len(cells)
+        assert list(stats["columns"]) == ["value1"]
+        assert stats["centroids"] is True
+
+    def test_parquet_output_geometry(self, database_dir):
+        LocalParquetOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "pq",
+            "dataset_type": "point",
+            "include_geometry": True,
+        }).write(DataFrame({
+            "latitude": [10.0, 20.0],
+            "longitude": [30.0, 40.0],
+            "value1": [1.0, 2.0],
+        }))
+
+        table = pyarrow.dataset.dataset(
+            f"{tmp_folder}/pq", partitioning="hive").to_table()
+        geo = json.loads(table.schema.metadata[b"geo"])
+        assert geo["primary_column"] == "geometry"
+        points = sorted(
+            (p.x, p.y) for p in shapely.from_wkb(table["geometry"]))
+        assert points == [(30.0, 10.0), (40.0, 20.0)]
+
+    def test_parquet_output_create_existing(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "pq",
+        }
+        df = DataFrame({"h3_cell": [h3.geo_to_h3(1, 1, 5)], "value1": [1.0]})
+        LocalParquetOutputStep(conf).write(df)
+        with pytest.raises(ValueError):
+            LocalParquetOutputStep(conf).write(df)
+
+    def test_parquet_output_create_registered(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "pq",
+        }
+        df = DataFrame({"h3_cell": [h3.geo_to_h3(1, 1, 5)], "value1": [1.0]})
+        LocalDuckdbOutputStep(conf).write(df)
+
+        with pytest.raises(ValueError):
+            LocalParquetOutputStep(conf).write(df)
+        # nothing is written for a dataset that cannot be registered
+        assert not os.path.exists(
+            LocalParquetOutputStep(conf)._get_out_dir())
+
+    def test_merge_writes_only_changes(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "merged",
+            "key_columns": ["year"],
+            "mode": "merge",
+        }
+        LocalDuckdbOutputStep(conf).write(DataFrame({
+            "h3_cell": ["a", "b", "c"],
+            "year": [2020, 2020, 2020],
+            "value1": [1.0, 2.0, 3.0],
+        }))
+
+        output_step = LocalDuckdbOutputStep(conf)
+        output_step.write(DataFrame({
+            "h3_cell": ["a", "b", "d"],
+            "year": [2020, 2020, 2020],
+            "value1": [1.0, 5.0, 4.0],
+        }))
+
+        assert output_step.change_counts == \
+               {"inserted": 1, "updated": 1, "deleted": 0, "unchanged": 1}
+        assert sorted(read_temp_db("merged")) == [
+            ("a", 2020, 1.0), ("b", 2020, 5.0),
+            ("c", 2020, 3.0), ("d", 2020, 4.0)
+        ]
+        assert len(read_metadata_db("merged")) == 1
+
+    def test_merge_deletes_missing(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "merged_delete",
+            "mode": "merge",
+            "delete_missing": True,
+        }
+        LocalDuckdbOutputStep(conf).write(DataFrame({
+            "h3_cell": ["a", "b"],
+            "value1": [1.0, 2.0],
+        }))
+
+        output_step = LocalDuckdbOutputStep(conf)
+        output_step.write(DataFrame({
+            "h3_cell": ["b"],
+            "value1": [2.0],
+        }))
+
+        assert output_step.change_counts == \
+               {"inserted": 0, "updated": 0, "deleted": 1, "unchanged": 1}
+        assert read_temp_db("merged_delete") == [("b", 2.0)]
+
+    def test_pyramid_levels(self, database_dir):
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))[:4]
+        df = DataFrame({
+            "h3_cell": cells,
+            "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+            "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+            "value1": [1.0, 2.0, 3.0, 6.0],
+        })
+        LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "pyr",
+            "pyramid_min_resolution": 3,
+        }).write(df)
+
+        connection = duckdb.connect(f"{tmp_folder}/pyr.duckdb")
+        for res in [4, 3]:
+            rows = connection.execute(
+                f"SELECT h3_cell, value1_count, value1_min, value1_max,"
+                f" value1_sum, value1 FROM pyr_{res}"
+            ).fetchall()
+            parents = set(h3.h3_to_parent(c, res) for c in cells)
+            assert set(r[0] for r in rows) == parents
+            assert sum(r[1] for r in rows) == 4
+            assert min(r[2] for r in rows) == 1.0
+            assert max(r[3] for r in rows) == 6.0
+            assert sum(r[4] for r in rows) == 12.0
+            for row in rows:
+                assert row[5] == pytest.approx(row[4] / row[1])
+        connection.close()
+
+        storage = MetadataDB(database_dir).get_storage_info("pyr")
+        assert storage["storage_options"]["base_resolution"] == 5
+        assert storage["storage_options"]["pyramid_resolutions"] == [4, 3]
+
+        geomesh = Geomesh(database_dir)
+        coarse = geomesh.bounding_box_get(
+            "pyr", 3, 49.0, 51.0, 9.0, 11.0, None, None, None)
+        assert set(r["h3_cell"] for r in coarse) == \
+               set(h3.h3_to_parent(c, 3) for c in cells)
+        too_coarse = geomesh.bounding_box_get(
+            "pyr", 1, 49.0, 51.0, 9.0, 11.0, None, None, None)
+        assert set(r["h3_cell"] for r in too_coarse) == \
+               set(r["h3_cell"] for r in coarse)
+        too_fine = geomesh.bounding_box_get(
+            "pyr", 7, 49.0, 51.0, 9.0, 11.0, None, None, None)
+        assert set(r["h3_cell"] for r in too_fine) == set(cells)
+
+    def test_pyramid_rebuilt_on_insert(self, database_dir):
+        conf = {
+            "database_dir": database_dir,
+            "dataset_name": "pyr_insert",
+            "pyramid_min_resolution": 4,
+        }
+        cells = sorted(h3.k_ring(h3.geo_to_h3(50.0, 10.0, 5), 1))[:2]
+        df = DataFrame({"h3_cell": cells, "value1": [1.0, 2.0]})
+        LocalDuckdbOutputStep(conf).write(df.iloc[:1])
+        del conf["pyramid_min_resolution"]
+        conf["mode"] = "insert"
+        LocalDuckdbOutputStep(conf).write(df.iloc[1:])
+
+        connection = duckdb.connect(f"{tmp_folder}/pyr_insert.duckdb")
+        total = connection.execute(
+            "SELECT sum(value1_count), sum(value1_sum) FROM pyr_insert_4"
+        ).fetchone()
+        connection.close()
+        assert total == (2, 3.0)
+
+    def test_pyramid_name_collision(self, database_dir):
+        output_step = LocalDuckdbOutputStep({
+            "database_dir": database_dir,
+            "dataset_name": "pyr_collision",
+            "pyramid_min_resolution": 4,
+        })
+        with pytest.raises(ValueError):
+            output_step.write(DataFrame({
+                "h3_cell": [h3.geo_to_h3(50.0, 10.0, 5)],
+                "value1": [1.0],
+                "value1_max": [1.0],
+            }))
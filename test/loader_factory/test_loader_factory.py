@@ -12,6 +12,7 @@ import time
 
 import pytest
 
+from common import connection_manager
 from loader.loader_factory import LoaderFactory
 from loader.csvloader import CSVLoader
 from loader.parquet_loader import ParquetLoader
@@ -26,6 +27,7 @@ def database_dir():
 
     yield tmp_folder
 
+    connection_manager.close_all()
     gc.collect()
     time.sleep(0.1)
     if os.path.exists(tmp_folder):
@@ -0,0 +1,108 @@
+import gc
+import multiprocessing
+import os
+import shutil
+import time
+
+import pytest
+
+from common import connection_manager
+from geoserver import metadata
+from geoserver.metadata import MetadataDB
+
+tmp_folder = "./test/test_data/metadata_tmp"
+
+
+@pytest.fixture()
+def database_dir(monkeypatch):
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+    # files written by the tests are always recent, so would otherwise
+    #  never be trusted
+    monkeypatch.setattr(metadata, "CATALOG_TRUST_DELAY_NS", 0)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+@pytest.fixture()
+def load_count(monkeypatch):
+    counts = [0]
+    load = MetadataDB._load_catalog
+
+    def counting_load(self, signature):
+        counts[0] += 1
+        return load(self, signature)
+
+    monkeypatch.setattr(MetadataDB, "_load_catalog", counting_load)
+    return counts
+
+
+def add_entry(database_dir: str, dataset_name: str):
+    MetadataDB(database_dir).add_metadata_entry(
+        dataset_name, "", {}, {"value1": "DOUBLE"}, "point")
+
+
+class TestMetadataCatalog:
+
+    def test_lookups_served_from_memory(self, database_dir, load_count):
+        add_entry(database_dir, "ds1")
+        meta_db = MetadataDB(database_dir)
+
+        for _ in range(5):
+            assert meta_db.ds_meta_exists("ds1")
+            assert meta_db.get_ds_metadata("ds1")["dataset_type"] == "point"
+            assert meta_db.get_storage_info("ds1")["storage_type"] == \
+                   "duckdb"
+            assert meta_db.get_dataset_version("ds1") == 0
+
+        assert load_count[0] == 1
+
+    def test_write_in_process_reloads(self, database_dir, load_count):
+        add_entry(database_dir, "ds1")
+        meta_db = MetadataDB(database_dir)
+        assert not meta_db.ds_meta_exists("ds2")
+
+        add_entry(database_dir, "ds2")
+        meta_db.bump_dataset_version("ds2")
+
+        assert meta_db.ds_meta_exists("ds2")
+        assert meta_db.get_dataset_version("ds2") == 1
+        assert [m["dataset_name"] for m in meta_db.show_meta()] == \
+               ["ds1", "ds2"]
+
+    def test_write_by_other_process_reloads(self, database_dir):
+        add_entry(database_dir, "ds1")
+        meta_db = MetadataDB(database_dir)
+        assert not meta_db.ds_meta_exists("ds2")
+
+        process = multiprocessing.Process(
+            target=add_entry, args=(database_dir, "ds2"))
+        process.start()
+        process.join()
+
+        assert meta_db.ds_meta_exists("ds2")
+
+    def test_returned_entries_are_copies(self, database_dir):
+        add_entry(database_dir, "ds1")
+        meta_db = MetadataDB(database_dir)
+
+        meta_db.get_ds_metadata("ds1")["value_columns"]["key"].append("x")
+
+        assert meta_db.get_ds_metadata("ds1")["value_columns"]["key"] == \
+               ["value1"]
+
+    def test_missing_database(self, database_dir):
+        meta_db = MetadataDB(database_dir)
+
+        assert not meta_db.ds_meta_exists("ds1")
+        with pytest.raises(ValueError):
+            meta_db.get_ds_metadata("ds1")
+        with pytest.raises(ValueError):
+            meta_db.show_meta()
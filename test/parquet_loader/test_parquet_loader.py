@@ -15,6 +15,7 @@ import duckdb
 import h3
 import pytest as pytest
 
+from common import connection_manager
 from loader.loader_factory import LoaderFactory
 
 tmp_folder = "./test/test_data/parquet_loader/tmp"
@@ -28,6 +29,7 @@ def database_dir():
 
     yield tmp_folder
 
+    connection_manager.close_all()
     gc.collect()
     time.sleep(0.1)
     if os.path.exists(tmp_folder):
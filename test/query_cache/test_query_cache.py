@@ -0,0 +1,128 @@
+import gc
+import os
+import shutil
+import time
+
+import h3
+import pyarrow
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.geomesh import Geomesh
+from geoserver.metadata import MetadataDB
+from geoserver.query_cache import QueryResultCache
+from loader.output_step import LocalDuckdbOutputStep
+
+tmp_folder = "./test/test_data/query_cache_tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+def make_table(rows: int) -> pyarrow.Table:
+    return pyarrow.table({"v": pyarrow.array(range(rows), pyarrow.int64())})
+
+
+def write_cells(database_dir: str, cells, value: float, mode: str):
+    LocalDuckdbOutputStep({
+        "database_dir": database_dir,
+        "dataset_name": "cached",
+        "mode": mode,
+    }).write(DataFrame({
+        "h3_cell": cells,
+        "latitude": [h3.h3_to_geo(c)[0] for c in cells],
+        "longitude": [h3.h3_to_geo(c)[1] for c in cells],
+        "value1": [value] * len(cells),
+    }))
+
+
+class TestQueryResultCache:
+
+    def test_evicts_least_recently_used(self):
+        # each table is 800 bytes
+        cache = QueryResultCache(max_bytes=2000)
+        cache.put(("a",), 1, make_table(100))
+        cache.put(("b",), 1, make_table(100))
+        cache.get(("a",), 1)
+        cache.put(("c",), 1, make_table(100))
+
+        assert cache.get(("a",), 1) is not None
+        assert cache.get(("b",), 1) is None
+        assert cache.get(("c",), 1) is not None
+        assert cache.size_bytes() == 1600
+
+    def test_version_change_invalidates(self):
+        cache = QueryResultCache()
+        cache.put(("a",), 1, make_table(10))
+
+        assert cache.get(("a",), 2) is None
+        assert cache.get(("a",), 1) is None
+        assert cache.size_bytes() == 0
+
+    def test_result_larger_than_cache_not_cached(self):
+        cache = QueryResultCache(max_bytes=100)
+        cache.put(("a",), 1, make_table(100))
+
+        assert cache.get(("a",), 1) is None
+
+    def test_spill_to_disk(self, database_dir):
+        spill_dir = os.path.join(database_dir, "spill")
+        cache = QueryResultCache(max_bytes=1000, spill_dir=spill_dir)
+        cache.put(("a",), 1, make_table(100))
+        cache.put(("b",), 1, make_table(100))
+
+        assert len(os.listdir(spill_dir)) == 1
+        assert cache.get(("a",), 1).equals(make_table(100))
+        # a was read back into memory, which spilled b
+        assert cache.get(("b",), 1).equals(make_table(100))
+
+        cache.clear()
+        assert os.listdir(spill_dir) == []
+
+
+class TestGeomeshCache:
+
+    def test_repeat_query_served_from_cache(self, database_dir):
+        cells = list(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 4), 1))
+        write_cells(database_dir, cells, 1.0, "create")
+        cache = QueryResultCache()
+        geomesh = Geomesh(database_dir, cache)
+        args = ["cached", 4, 40.0, 50.0, -80.0, -70.0, None, None, None]
+
+        first = geomesh.bounding_box_get(*args)
+        second = geomesh.bounding_box_get(*args)
+        # other instances can share the cache
+        third = Geomesh(database_dir, cache).bounding_box_get_df(*args)
+
+        assert first == second
+        assert third.to_dict("records") == first
+        assert (cache.hits, cache.misses) == (2, 1)
+
+    def test_write_invalidates_cached_result(self, database_dir):
+        cells = list(h3.k_ring(h3.geo_to_h3(45.0, -75.0, 4), 1))
+        write_cells(database_dir, cells[:3], 1.0, "create")
+        geomesh = Geomesh(database_dir, QueryResultCache())
+        args = ["cached", 4, 40.0, 50.0, -80.0, -70.0, None, None, None]
+
+        before = geomesh.bounding_box_get(*args)
+        version = MetadataDB(database_dir).get_dataset_version("cached")
+        write_cells(database_dir, cells[3:], 2.0, "insert")
+        after = geomesh.bounding_box_get(*args)
+
+        assert len(before) == 3
+        assert len(after) == len(cells)
+        assert MetadataDB(database_dir).get_dataset_version("cached") == \
+               version + 1
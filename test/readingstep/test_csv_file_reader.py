@@ -0,0 +1,145 @@
+import os
+import shutil
+
+import pytest
+
+from loader.reading_step import CSVFileReader
+
+test_dir = "./test/test_data/readingstep/"
+tmp_folder = f"{test_dir}/tmp"
+# 2_value_company.csv has a header row and columns:
+#  latitude, longitude, value1, value2, company
+# invalid_lat.csv has a header row and a row with latitude 95
+
+
+@pytest.fixture()
+def tmp_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+class TestCSVFileReader:
+    two_value_conf = {
+        "file_path": test_dir + "2_value_company.csv",
+        "has_header_row": True,
+        "columns": {
+            "latitude": "float",
+            "longitude": "float",
+            "value1": "int",
+            "value2": "float",
+            "company": "str"
+        },
+        "data_columns": ["value1", "value2"]
+    }
+
+    def test_unused_cols_dropped(self):
+        reader = CSVFileReader(self.two_value_conf)
+        out = reader.read()
+
+        assert set(out.columns) == \
+               {"latitude", "longitude", "value1", "value2"}
+
+    def test_rows_as_expected(self):
+        reader = CSVFileReader(self.two_value_conf)
+        out = reader.read()
+        expectedout = {
+            (49, -91, 10, 100),
+            (51, -102, 9, 90),
+            (51, -102.5, 9, 80),
+            (45, -102, 8, 80),
+            (43, -118, 7, 70)
+        }
+
+        vals = set(tuple(i) for i in
+                   out[["latitude", "longitude", "value1", "value2"]]
+                   .values.tolist())
+        assert vals == expectedout
+
+    def test_columns_typed(self):
+        reader = CSVFileReader(self.two_value_conf)
+        out = reader.read()
+
+        assert str(out["value1"].dtype) == "int64"
+        assert str(out["value2"].dtype) == "float64"
+
+    def test_key_cols_preserved(self):
+        conf = self.two_value_conf.copy()
+        conf["key_columns"] = ["company"]
+
+        reader = CSVFileReader(conf)
+        out = reader.read()
+
+        assert set(out.columns) == \
+               {"latitude", "longitude", "value1", "value2", "company"}
+        assert reader.get_key_cols() == ["company"]
+
+    def test_batches_cover_whole_file(self, tmp_dir):
+        csv_path = os.path.join(tmp_dir, "many_rows.csv")
+        with open(csv_path, "w") as f:
+            for i in range(5000):
+                f.write(f"{i % 90},{i % 180},{i}\n")
+
+        reader = CSVFileReader({
+            "file_path": csv_path,
+            "columns": {
+                "latitude": "float",
+                "longitude": "float",
+                "value1": "int",
+            },
+            "data_columns": ["value1"],
+            "batch_size": 2048,
+            "max_parallelism": 2
+        })
+        batches = list(reader.read_batches())
+
+        assert len(batches) == 3
+        assert [v for b in batches for v in b["value1"].tolist()] == \
+               list(range(5000))
+
+    def test_error_on_lat_out_of_range(self):
+        reader = CSVFileReader({
+            "file_path": test_dir + "invalid_lat.csv",
+            "has_header_row": True,
+            "columns": {
+                "latitude": "float",
+                "longitude": "float",
+                "value1": "int",
+            },
+            "data_columns": ["value1"]
+        })
+
+        with pytest.raises(ValueError):
+            reader.read()
+
+    def test_error_on_lat_not_in_columns(self):
+        conf = self.two_value_conf.copy()
+        conf["columns"] = {
+            "lat": "float",
+            "longitude": "float",
+            "value1": "int",
+            "value2": "float",
+            "company": "str"
+        }
+
+        with pytest.raises(ValueError):
+            CSVFileReader(conf)
+
+    def test_error_on_data_col_not_in_columns(self):
+        conf = self.two_value_conf.copy()
+        conf["data_columns"] = ["value1", "not_exist"]
+
+        with pytest.raises(ValueError):
+            CSVFileReader(conf)
+
+    def test_error_on_input_file_not_exist(self):
+        conf = self.two_value_conf.copy()
+        conf["file_path"] = test_dir + "file_does_not_exist.csv"
+
+        with pytest.raises(ValueError):
+            CSVFileReader(conf)
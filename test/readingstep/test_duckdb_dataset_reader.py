@@ -0,0 +1,238 @@
+import gc
+import os
+import shutil
+import time
+
+import duckdb
+import pytest
+from pandas import DataFrame
+
+from common import connection_manager
+from geoserver.metadata import MetadataDB
+from loader.aggregation_step import MaxAggregation
+from loader.load_pipeline import LoadingPipeline
+from loader.output_step import LocalDuckdbOutputStep
+from loader.reading_step import DuckdbDatasetReader
+
+test_dir = "./test/test_data/readingstep/"
+tmp_folder = f"{test_dir}/tmp"
+
+
+@pytest.fixture()
+def database_dir():
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+    os.mkdir(tmp_folder)
+
+    yield tmp_folder
+
+    connection_manager.close_all()
+    gc.collect()
+    time.sleep(0.1)
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+
+def write_point_dataset(database_dir: str, dataset_name: str) -> None:
+    df = DataFrame({
+        "latitude": [49.0, 51.0, 51.0, 45.0, 43.0],
+        "longitude": [-91.0, -102.0, -102.5, -102.0, -118.0],
+        "value1": [10, 9, 9, 8, 7],
+        "value2": [100.0, 90.0, 80.0, 80.0, 70.0],
+        "company": ["a", "a", "b", "b", "c"],
+    })
+    LocalDuckdbOutputStep({
+        "database_dir": database_dir,
+        "dataset_name": dataset_name,
+        "dataset_type": "point"
+    }).write(df)
+
+
+class TestDuckdbDatasetReader:
+
+    def test_default_columns_from_metadata(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        reader = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+        })
+
+        out = reader.read()
+
+        assert reader.get_data_cols() == ["value1", "value2", "company"]
+        assert reader.get_key_cols() == []
+        assert set(out.columns) == \
+               {"latitude", "longitude", "value1", "value2", "company"}
+        assert len(out) == 5
+
+    def test_projection(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        reader = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "data_columns": ["value1"],
+        })
+
+        out = reader.read()
+
+        assert set(out.columns) == {"latitude", "longitude", "value1"}
+
+    def test_key_filters(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        single = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "filters": {"company": "a"},
+        }).read()
+        multiple = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "filters": {"company": ["a", "c"]},
+        }).read()
+
+        assert set(single["company"]) == {"a"}
+        assert len(single) == 2
+        assert set(multiple["company"]) == {"a", "c"}
+        assert len(multiple) == 3
+
+    def test_empty_filter_list(self, database_dir):
+        write_point_dataset(database_dir, "points")
+
+        with pytest.raises(ValueError):
+            DuckdbDatasetReader({
+                "database_dir": database_dir,
+                "dataset_name": "points",
+                "filters": {"company": []},
+            })
+
+    def test_h3_dataset_needs_resolution(self, database_dir):
+        connection = duckdb.connect(os.path.join(database_dir, "h3.duckdb"))
+        connection.execute(
+            "CREATE TABLE h3_0 (latitude DOUBLE, longitude DOUBLE,"
+            " h3_cell VARCHAR, value1 DOUBLE)")
+        connection.close()
+        MetadataDB(database_dir).add_metadata_entry(
+            "h3", "",
+            {"latitude": "DOUBLE", "longitude": "DOUBLE",
+             "h3_cell": "VARCHAR"},
+            {"value1": "DOUBLE"}, "h3")
+
+        with pytest.raises(ValueError):
+            DuckdbDatasetReader({
+                "database_dir": database_dir,
+                "dataset_name": "h3",
+            })
+        out = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "h3",
+            "resolution": 0,
+        }).read()
+        assert len(out) == 0
+
+    def test_bounding_box(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        out = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "min_lat": 44,
+            "max_lat": 50,
+            "min_long": -103,
+        }).read()
+
+        assert set(zip(out["latitude"], out["longitude"])) == \
+               {(49, -91), (45, -102)}
+
+    def test_batches_match_read(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        reader = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "batch_size": 2,
+        })
+
+        batches = list(reader.read_batches())
+        full = reader.read()
+
+        assert len(batches) == 3
+        assert sum(len(b) for b in batches) == len(full)
+
+    def test_rollup_to_coarser_resolution(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        LoadingPipeline(
+            DuckdbDatasetReader({
+                "database_dir": database_dir,
+                "dataset_name": "points",
+                "data_columns": ["value1"],
+                "key_columns": ["company"],
+            }),
+            [], [MaxAggregation({})], [],
+            LocalDuckdbOutputStep({
+                "database_dir": database_dir,
+                "dataset_name": "fine",
+                "key_columns": ["company"],
+            }),
+            2
+        ).run()
+
+        reader = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "fine",
+        })
+        assert "h3_cell" not in reader.get_key_cols()
+        LoadingPipeline(
+            reader, [], [MaxAggregation({})], [],
+            LocalDuckdbOutputStep({
+                "database_dir": database_dir,
+                "dataset_name": "coarse",
+                "key_columns": ["company"],
+            }),
+            0
+        ).run()
+
+        with connection_manager.reading(
+                os.path.join(database_dir, "coarse.duckdb")) as connection:
+            out = connection.execute(
+                "SELECT company, max(value1_max_max) FROM coarse"
+                " GROUP BY company ORDER BY company"
+            ).fetchall()
+        assert out == [("a", 10), ("b", 9), ("c", 7)]
+
+    def test_h3_dataset_requires_resolution(self, database_dir):
+        connection = duckdb.connect(
+            os.path.join(database_dir, "legacy.duckdb"))
+        connection.execute(
+            "CREATE TABLE legacy_1 (latitude DOUBLE, longitude DOUBLE,"
+            " h3_cell VARCHAR, value1 DOUBLE)")
+        connection.execute(
+            "INSERT INTO legacy_1 VALUES (1.0, 2.0, 'abc', 3.0)")
+        connection.close()
+        from geoserver.metadata import MetadataDB
+        MetadataDB(database_dir).add_metadata_entry(
+            "legacy", "", {"h3_cell": "VARCHAR"},
+            {"latitude": "DOUBLE", "longitude": "DOUBLE", "value1": "DOUBLE"},
+            "h3")
+
+        conf = {"database_dir": database_dir, "dataset_name": "legacy"}
+        with pytest.raises(ValueError):
+            DuckdbDatasetReader(conf).read()
+
+        conf["resolution"] = 1
+        out = DuckdbDatasetReader(conf).read()
+        assert out.values.tolist() == [[1.0, 2.0, 3.0]]
+
+    def test_error_on_column_not_exist(self, database_dir):
+        write_point_dataset(database_dir, "points")
+        reader = DuckdbDatasetReader({
+            "database_dir": database_dir,
+            "dataset_name": "points",
+            "data_columns": ["not_exist"],
+        })
+        with pytest.raises(ValueError):
+            reader.read()
+
+    def test_error_on_dataset_not_exist(self, database_dir):
+        with pytest.raises(ValueError):
+            DuckdbDatasetReader({
+                "database_dir": database_dir,
+                "dataset_name": "not_exist",
+            })
@@ -0,0 +1,141 @@
+import math
+
+import pytest
+
+from loader.aggregation_step import CellAggregationStep, MaxAggregation
+from loader.geotiff_reader import MultiGeotiffReader
+
+test_dir = "./test/test_data/readingstep/"
+# rp10.tif and rp100.tif share a 4x4 EPSG:4326 grid with 1 degree pixels,
+#  whose top left corner is at latitude 54, longitude 10.
+#  rp10 has values 1-15 in row order, with no data in the last pixel.
+#  rp100 has 10x the rp10 values, no data in the first pixel and 160 in
+#  the last pixel.
+# rp_two_band.tif contains rp10 as band 1 and rp100 as band 2.
+# rp_other_grid.tif is rp10 shifted one degree east.
+
+
+class TestMultiGeotiffReader:
+    two_file_conf = {
+        "rasters": [
+            {"file_path": test_dir + "rp10.tif", "data_field": "rp10"},
+            {"file_path": test_dir + "rp100.tif", "data_field": "rp100"},
+        ]
+    }
+
+    two_band_conf = {
+        "rasters": [
+            {"file_path": test_dir + "rp_two_band.tif",
+             "data_field": "rp10", "band": 1},
+            {"file_path": test_dir + "rp_two_band.tif",
+             "data_field": "rp100", "band": 2},
+        ]
+    }
+
+    def test_one_column_per_raster(self):
+        reader = MultiGeotiffReader(self.two_file_conf)
+        out = reader.read()
+
+        assert set(out.columns) == \
+               {"latitude", "longitude", "rp10", "rp100"}
+        assert reader.get_data_cols() == ["rp10", "rp100"]
+
+    def test_pixel_kept_if_any_raster_has_data(self):
+        reader = MultiGeotiffReader(self.two_file_conf)
+        out = reader.read()
+
+        assert len(out) == 16
+
+        first = out[(out["latitude"] == 54) & (out["longitude"] == 10)]
+        assert first["rp10"].iloc[0] == 1
+        assert math.isnan(first["rp100"].iloc[0])
+
+        last = out[(out["latitude"] == 51) & (out["longitude"] == 13)]
+        assert math.isnan(last["rp10"].iloc[0])
+        assert last["rp100"].iloc[0] == 160
+
+    def test_bands_match_files(self):
+        from_files = MultiGeotiffReader(self.two_file_conf).read()
+        from_bands = MultiGeotiffReader(self.two_band_conf).read()
+
+        cols = ["latitude", "longitude", "rp10", "rp100"]
+        assert from_files[cols].fillna(-1).values.tolist() == \
+               from_bands[cols].fillna(-1).values.tolist()
+
+    def test_small_windows_match_single_window(self):
+        conf = self.two_file_conf.copy()
+        conf["window_rows"] = 1
+
+        windowed = MultiGeotiffReader(conf).read()
+        single = MultiGeotiffReader(self.two_file_conf).read()
+
+        cols = ["latitude", "longitude", "rp10", "rp100"]
+        assert windowed[cols].fillna(-1).values.tolist() == \
+               single[cols].fillna(-1).values.tolist()
+
+    def test_bounding_box_filter(self):
+        conf = self.two_file_conf.copy()
+        conf["min_lat"] = 52.5
+        conf["max_lat"] = 54.5
+        conf["min_long"] = 10.5
+        conf["max_long"] = 12.5
+
+        out = MultiGeotiffReader(conf).read()
+
+        assert set(zip(out["latitude"], out["longitude"])) == {
+            (54, 11), (54, 12), (53, 11), (53, 12)
+        }
+
+    def test_aggregation_over_all_rasters(self):
+        reader = MultiGeotiffReader(self.two_file_conf)
+        agg = CellAggregationStep(
+            [MaxAggregation({})], 0, reader.get_data_cols(), [])
+
+        out = agg.run(reader.read())
+
+        assert {"rp10_max", "rp100_max"}.issubset(out.columns)
+        assert out["rp10_max"].max() == 15
+        assert out["rp100_max"].max() == 160
+
+    def test_error_on_different_grid(self):
+        conf = {
+            "rasters": [
+                {"file_path": test_dir + "rp10.tif", "data_field": "rp10"},
+                {"file_path": test_dir + "rp_other_grid.tif",
+                 "data_field": "other"},
+            ]
+        }
+        reader = MultiGeotiffReader(conf)
+        with pytest.raises(ValueError):
+            reader.read()
+
+    def test_error_on_band_not_exist(self):
+        conf = {
+            "rasters": [
+                {"file_path": test_dir + "rp10.tif",
+                 "data_field": "rp10", "band": 2},
+            ]
+        }
+        reader = MultiGeotiffReader(conf)
+        with pytest.raises(ValueError):
+            reader.read()
+
+    def test_error_on_duplicate_data_field(self):
+        conf = {
+            "rasters": [
+                {"file_path": test_dir + "rp10.tif", "data_field": "rp"},
+                {"file_path": test_dir + "rp100.tif", "data_field": "rp"},
+            ]
+        }
+        with pytest.raises(ValueError):
+            MultiGeotiffReader(conf)
+
+    def test_error_on_input_file_not_exist(self):
+        conf = {
+            "rasters": [
+                {"file_path": test_dir + "not_exist.tif",
+                 "data_field": "rp10"},
+            ]
+        }
+        with pytest.raises(ValueError):
+            MultiGeotiffReader(conf)